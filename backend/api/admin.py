@@ -3,7 +3,7 @@ from api import models as api_models
 
 admin.site.register(api_models.Category)
 admin.site.register(api_models.Cart)
-# admin.site.register(api_models.CartOrder)
+admin.site.register(api_models.CartOrder)
 admin.site.register(api_models.CartOrderItem)
 admin.site.register(api_models.Teacher)
 admin.site.register(api_models.Lecture)
@@ -15,4 +15,6 @@ admin.site.register(api_models.Notification)
 admin.site.register(api_models.Note)
 admin.site.register(api_models.Certificate)
 admin.site.register(api_models.Coupon)
-admin.site.register(api_models.Course)
\ No newline at end of file
+admin.site.register(api_models.Course)
+admin.site.register(api_models.CourseDailyStats)
+admin.site.register(api_models.TeacherDailyStats)
@@ -0,0 +1,159 @@
+'''
+Teacher and course analytics rollups.
+
+rollup() folds enrollments, reviews and lecture completions into
+CourseDailyStats and TeacherDailyStats. Each source keeps a RollupWatermark
+of the highest row id already counted, so a run only reads rows added since
+the last one. Dashboards read the daily tables and never the source rows.
+
+Ids are handed out before their transactions commit, so a row can become
+visible after a higher id was already folded and would then be skipped.
+A run therefore stops short of the oldest row dated within the last
+settings.ANALYTICS_ROLLUP_LAG seconds; only a transaction held open longer
+than that can still be missed.
+
+The rollups count events: a review deactivated or an enrollment deleted after
+it was counted stays in the totals. `manage.py rollup_analytics --rebuild`
+recounts everything from scratch.
+'''
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+from django.db.models.functions import Coalesce, TruncDate
+
+from api import models as api_models
+
+
+def _enrollment_metrics(queryset):
+    returning = api_models.EnrolledCourse.objects.filter(
+        user_id=models.OuterRef('user_id'),
+        course__teacher_id=models.OuterRef('course__teacher_id'),
+        id__lt=models.OuterRef('id'),
+    )
+    return queryset.alias(returning=models.Exists(returning)), {
+        'enrollments': models.Count('id'),
+        'students': models.Count('user_id'),
+        'new_students': models.Count('id', filter=models.Q(user__isnull=False, returning=False)),
+        'revenue': Coalesce(models.Sum('order_id__total'), models.Value(Decimal('0.00'))),
+    }
+
+
+def _review_metrics(queryset):
+    ratings = {f'rating_{value}': models.Count('id', filter=models.Q(rating=str(value))) for value, label in api_models.RATING}
+    return queryset, {'reviews': models.Count('id'), **ratings}
+
+
+def _completion_metrics(queryset):
+    return queryset, {'completions': models.Count('id')}
+
+
+# source name -> (model, function returning the queryset to group and its aggregates)
+SOURCES = {
+    'enrollments': (api_models.EnrolledCourse, _enrollment_metrics),
+    'reviews': (api_models.Review, _review_metrics),
+    'completions': (api_models.CompletedLecture, _completion_metrics),
+}
+
+
+def _add(model, owner, totals):
+    '''Adds {(owner_id, day): {field: delta}} onto existing daily rows, creating missing ones'''
+    if not totals:
+        return
+    owner_ids = {owner_id for owner_id, day in totals}
+    days = {day for owner_id, day in totals}
+    existing = {
+        (getattr(row, f'{owner}_id'), row.day): row
+        for row in model.objects.filter(**{f'{owner}_id__in': owner_ids, 'day__in': days})
+    }
+    created, updated, fields = [], [], set()
+    for (owner_id, day), deltas in totals.items():
+        row = existing.get((owner_id, day))
+        if row is None:
+            row = model(**{f'{owner}_id': owner_id, 'day': day})
+            created.append(row)
+        else:
+            updated.append(row)
+        for field, delta in deltas.items():
+            # new rows carry the float 0.00 default for revenue
+            setattr(row, field, (getattr(row, field) or 0) + delta)
+        fields.update(deltas)
+    model.objects.bulk_create(created)
+    # only the columns this source feeds; each one is a CASE over every row
+    model.objects.bulk_update(updated, sorted(fields))
+
+
+def _fold(source, batch_size):
+    '''Folds the next batch of one source into the rollups, returns the number of rows read'''
+    model, metrics = SOURCES[source]
+    with transaction.atomic():
+        watermark, _ = api_models.RollupWatermark.objects.get_or_create(source=source)
+        # blocks a second worker on PostgreSQL until this batch commits
+        watermark = api_models.RollupWatermark.objects.select_for_update().get(pk=watermark.pk)
+        pending = model.objects.filter(id__gt=watermark.last_id)
+        cutoff = timezone.now() - timedelta(seconds=settings.ANALYTICS_ROLLUP_LAG)
+        recent = pending.filter(date__gte=cutoff).aggregate(first=models.Min('id'))['first']
+        if recent is not None:
+            # lower ids may still be committing
+            pending = pending.filter(id__lt=recent)
+        ids = list(pending.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return 0
+
+        queryset, aggregates = metrics(
+            model.objects.filter(id__gt=watermark.last_id, id__lte=ids[-1], date__isnull=False, course__isnull=False)
+        )
+        rows = queryset.values(
+            'course_id', owner_id=models.F('course__teacher_id'), day=TruncDate('date'),
+        ).annotate(**aggregates).order_by()
+
+        course_totals = defaultdict(lambda: defaultdict(int))
+        teacher_totals = defaultdict(lambda: defaultdict(int))
+        for row in rows:
+            course_id, teacher_id, day = row.pop('course_id'), row.pop('owner_id'), row.pop('day')
+            new_students = row.pop('new_students', None)
+            for field, value in row.items():
+                course_totals[course_id, day][field] += value
+            if teacher_id:
+                # a teacher's students are the ones enrolling with them for the first time
+                teacher_row = row if new_students is None else dict(row, students=new_students)
+                for field, value in teacher_row.items():
+                    teacher_totals[teacher_id, day][field] += value
+
+        _add(api_models.CourseDailyStats, 'course', course_totals)
+        _add(api_models.TeacherDailyStats, 'teacher', teacher_totals)
+        watermark.last_id = ids[-1]
+        watermark.save()
+    return len(ids)
+
+
+def rollup(batch_size=10000):
+    '''Folds every source up to its newest row, returns {source: rows read}'''
+    processed = {}
+    for source in SOURCES:
+        processed[source] = 0
+        while True:
+            count = _fold(source, batch_size)
+            processed[source] += count
+            if count < batch_size:
+                break
+    return processed
+
+
+def reset():
+    with transaction.atomic():
+        api_models.CourseDailyStats.objects.all().delete()
+        api_models.TeacherDailyStats.objects.all().delete()
+        api_models.RollupWatermark.objects.filter(source__in=SOURCES).delete()
+
+
+def totals(queryset):
+    '''Sums the metric columns of a daily stats queryset into one dict'''
+    model = queryset.model
+    return queryset.aggregate(**{
+        field: Coalesce(models.Sum(field), models.Value(Decimal('0.00') if field == 'revenue' else 0))
+        for field in model.metric_fields
+    })
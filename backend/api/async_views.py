@@ -0,0 +1,203 @@
+'''
+Async variants of the catalog and cart endpoints. api/urls.py routes them in
+place of the ones in api.views when settings.ASYNC_VIEWS is on, which is
+meant for ASGI deployments: a request waiting on the database or the cache
+no longer holds a worker thread, so one process keeps many more clients in
+flight. Under WSGI every async view costs an event loop per request, so the
+setting stays off there.
+
+DRF itself is synchronous. AsyncAPIView keeps its request parsing,
+authentication, permissions, throttling and exception handling, and runs
+initial() in a worker thread because authenticators and throttles use the
+sync ORM and cache. Handlers fetch through the async ORM (aget,
+aget_or_create, async iteration) with everything their serializer reads
+prefetched, so serialization runs on the event loop without touching the
+database. A lazy query there raises SynchronousOnlyOperation instead of
+quietly blocking the loop.
+
+The views keep the class names of their sync counterparts, so both share
+cached responses (see api.cache.BaseVersionedCacheMixin.build_cache_key).
+'''
+import inspect
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import aprefetch_related_objects
+from rest_framework import generics, status
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from api import serializer as api_serializers
+from api import models as api_models
+from api import checkout
+from api.cache import BaseVersionedCacheMixin, SHARED_VERSION, course_version, get_versions
+from core import routers, writer
+
+
+class AsyncAPIView(APIView):
+    '''APIView whose handlers are coroutines'''
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            # options() is inherited from APIView and stays sync
+            if inspect.isawaitable(response):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = await self.afinalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def afinalize_response(self, request, response, *args, **kwargs):
+        return self.finalize_response(request, response, *args, **kwargs)
+
+
+class AsyncGenericAPIView(AsyncAPIView, generics.GenericAPIView):
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except queryset.model.DoesNotExist:
+            raise NotFound()
+        await sync_to_async(self.check_object_permissions)(self.request, obj)
+        return obj
+
+
+class AsyncListAPIView(AsyncGenericAPIView):
+
+    async def get(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer([obj async for obj in queryset], many=True)
+        return Response(serializer.data)
+
+
+class AsyncRetrieveAPIView(AsyncGenericAPIView):
+
+    async def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(await self.aget_object())
+        return Response(serializer.data)
+
+
+class AsyncVersionedCacheMixin(BaseVersionedCacheMixin):
+    '''
+    VersionedCacheMixin for async views. Django's cache backends implement
+    their async API as one thread hop per call, so the lookup rides along in
+    the hop that runs initial() and a miss costs one more hop to store.
+    '''
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.response_cache_key = self.cached = None
+        if request.method == 'GET':
+            self.response_cache_key = self.build_cache_key(request, get_versions(self.get_cache_versions()))
+            self.cached = None if routers.pinned() else cache.get(self.response_cache_key)
+
+    async def get(self, request, *args, **kwargs):
+        if self.cached is not None:
+            return self.cached_response(request, self.cached)
+
+        response = await super().get(request, *args, **kwargs)
+        response.response_cache_key = self.response_cache_key
+        return response
+
+    async def afinalize_response(self, request, response, *args, **kwargs):
+        response = await super().afinalize_response(request, response, *args, **kwargs)
+        key = getattr(response, 'response_cache_key', None)
+        if key is None or response.status_code != 200:
+            return response
+
+        entry = self.cache_entry(response)
+        await sync_to_async(cache.set)(key, entry, routers.cache_timeout(self.cache_timeout))
+        return self.not_modified(request, entry[2]) or response
+
+
+class CategoryListAPIView(AsyncVersionedCacheMixin, AsyncListAPIView):
+    queryset=api_models.Category.objects.for_catalog()
+    serializer_class=api_serializers.CategorySerializer
+    permission_classes=[AllowAny]
+    keyset_ordering=('title', 'id')
+
+
+class CourseListAPIView(AsyncVersionedCacheMixin, AsyncListAPIView):
+    serializer_class=api_serializers.CourseSummarySerializer
+    permission_classes=[AllowAny]
+
+    def get_queryset(self):
+        fields = self.serializer_class.requested_fields(self.request)
+        return api_models.Course.objects.for_listing(self.serializer_class.model_columns(fields))
+
+
+class CourseDetailAPIView(AsyncVersionedCacheMixin, AsyncRetrieveAPIView):
+    serializer_class=api_serializers.CourseSerializer
+    permission_classes=[AllowAny]
+
+    def get_cache_versions(self):
+        return [SHARED_VERSION, course_version(self.kwargs['slug'])]
+
+    async def aget_object(self):
+        try:
+            return await api_models.Course.objects.for_catalog().aget(slug=self.kwargs['slug'])
+        except api_models.Course.DoesNotExist:
+            raise NotFound('No such course')
+
+
+async def user_cart(user):
+    '''The user's cart, created on first use, with its items and their courses loaded'''
+    cart, _ = await api_models.Cart.objects.aget_or_create(user=user)
+    await aprefetch_related_objects([cart], 'cart_items__course')
+    return cart
+
+
+class CartView(AsyncRetrieveAPIView):
+    serializer_class=api_serializers.CartSerializer
+    permission_classes=[IsAuthenticated]
+
+    async def aget_object(self):
+        return await user_cart(self.request.user)
+
+
+class AddToCartView(AsyncGenericAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = api_serializers.AddToCartSerializer
+
+    async def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        # validate_course_id looks the course up
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+
+        cart, created = await sync_to_async(writer.run)(checkout.add_to_cart, request.user, serializer.validated_data['course_id'])
+
+        if not created:
+            return Response({ 'detail':'Course already in cart' }, status=status.HTTP_200_OK)
+
+        await aprefetch_related_objects([cart], 'cart_items__course')
+        return Response({ 'detail': 'Course added to cart', 'cart': api_serializers.CartSerializer(cart).data}, status=status.HTTP_201_CREATED)
@@ -0,0 +1,158 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+from core import routers
+
+CATALOG_VERSION = 'catalog'
+SHARED_VERSION = 'catalog-shared'
+# what cart totals are built from besides the cart itself (see api.pricing)
+PRICES_VERSION = 'prices'
+COUPONS_VERSION = 'coupons'
+COUNTRIES_VERSION = 'countries'
+
+
+def course_version(slug):
+    return f'course:{slug}'
+
+
+def cart_version(cart_id):
+    return f'cart:{cart_id}'
+
+
+def course_access_key(user_id, course_id):
+    return f'course-access:{user_id}:{course_id}'
+
+
+def again_on_commit(fn, *args):
+    '''
+    Runs fn(*args) now and, inside a transaction, once more after it commits.
+    Now, so the writing transaction never reads its own stale entries. After
+    the commit, so an entry rebuilt meanwhile by another request, which still
+    saw the old rows, does not outlive the write.
+    '''
+    fn(*args)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: fn(*args))
+
+
+def forget_course_access(pairs):
+    '''Drops cached lecture access answers for (user_id, course_id) pairs'''
+    keys = [course_access_key(user_id, course_id) for user_id, course_id in pairs if user_id]
+    if keys:
+        again_on_commit(cache.delete_many, keys)
+
+
+def _version_key(name):
+    return f'version:{name}'
+
+
+def get_versions(names):
+    '''
+    Returns the current stamp for every version name. A missing stamp (never
+    bumped, or evicted) starts from the clock so it can never collide with a
+    value that was used before the eviction.
+    '''
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns())
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*names):
+    '''Invalidates every cached response built from these versions, see again_on_commit()'''
+    if names:
+        again_on_commit(_bump, names)
+
+
+def _bump(names):
+    routers.note_write()
+    for name in names:
+        key = _version_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+class BaseVersionedCacheMixin:
+    '''
+    Caches rendered GET responses keyed by endpoint, query string, negotiated
+    format and the version stamps returned by get_cache_versions(). Writes bump
+    the stamps (see the receivers in api.models), so entries never go stale and
+    only need a timeout to free space. Responses carry a strong ETag and
+    If-None-Match is answered with 304 Not Modified.
+
+    The lookup and the store live in VersionedCacheMixin for sync views and in
+    api.async_views.AsyncVersionedCacheMixin for async ones.
+    '''
+    cache_timeout = 60 * 60
+
+    def get_cache_versions(self):
+        return [CATALOG_VERSION]
+
+    def build_cache_key(self, request, versions):
+        parts = [
+            type(self).__name__,
+            request.accepted_renderer.format,
+            request.get_host(),
+            request.path,
+            '&'.join(sorted(request.META.get('QUERY_STRING', '').split('&'))),
+            ':'.join(str(version) for version in versions),
+        ]
+        return 'response:' + hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest()
+
+    def cached_response(self, request, cached):
+        content, content_type, etag = cached
+        response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        return self.not_modified(request, etag) or response
+
+    def cache_entry(self, response):
+        '''Renders the response, tags it with its ETag and returns what the cache keeps'''
+        response.render()
+        etag = quote_etag(hashlib.md5(response.content, usedforsecurity=False).hexdigest())
+        response['ETag'] = etag
+        return (response.content, response['Content-Type'], etag)
+
+    def not_modified(self, request, etag):
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in etags or '*' in etags:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        return None
+
+
+class VersionedCacheMixin(BaseVersionedCacheMixin):
+
+    def get_cache_key(self, request):
+        return self.build_cache_key(request, get_versions(self.get_cache_versions()))
+
+    def get(self, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        # a client pinned to the primary must not get a page built from a lagging replica
+        cached = None if routers.pinned() else cache.get(key)
+        if cached is not None:
+            return self.cached_response(request, cached)
+
+        response = super().get(request, *args, **kwargs)
+        response.response_cache_key = key
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(response, 'response_cache_key', None)
+        if key is None or response.status_code != 200:
+            return response
+
+        entry = self.cache_entry(response)
+        cache.set(key, entry, routers.cache_timeout(self.cache_timeout))
+        return self.not_modified(request, entry[2]) or response
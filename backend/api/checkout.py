@@ -0,0 +1,218 @@
+'''
+Cart checkout.
+
+place_order() turns everything in a user's cart into one CartOrder awaiting
+payment. confirm_payment() marks it Paid and writes the EnrolledCourse rows
+and the teacher/student Notification fan-out. Only a confirmed payment grants
+access. checkout() does both in one transaction for carts with nothing to
+pay and refuses the rest until a payment provider confirms orders. Every
+write is one bulk statement, so the number of queries does not grow with the
+number of cart items.
+
+Double submits are settled by claiming the cart lines with a conditional
+UPDATE: only lines still sitting in the cart can move to the new order, and a
+checkout that claims fewer lines than it read rolls back. The unique
+(user, course) constraint on EnrolledCourse backs this up in the database.
+
+Lines are priced with api.pricing.line_amounts(), the same rounding the cart
+totals use, and the coupons that applied are marked used by the student.
+
+add_to_cart() is the write behind the add-to-cart endpoints, small and
+frequent enough to go through core.writer.
+'''
+from decimal import Decimal
+
+from django.db import models, transaction
+
+from api import models as api_models
+from api import pricing
+from api.cache import CATALOG_VERSION, COUPONS_VERSION, bump_versions, cart_version, course_version, forget_course_access
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    pass
+
+
+class CheckoutConflict(CheckoutError):
+    '''Another checkout of the same cart got there first'''
+    pass
+
+
+class PaymentRequired(CheckoutError):
+    pass
+
+
+def add_to_cart(user, course_id):
+    '''Puts a course in the user's cart. Returns the cart and whether the course was new to it.'''
+    cart, _ = api_models.Cart.objects.get_or_create(user=user)
+    _, created = api_models.CartOrderItem.objects.get_or_create(cart=cart, course_id=course_id)
+    return cart, created
+
+
+def _load_items(cart, codes=()):
+    '''The cart lines with their courses and, as coupon_id and discount, the coupon that applies to each'''
+    return list(
+        api_models.CartOrderItem.objects.filter(cart=cart, order__isnull=True)
+        .select_related('course')
+        .annotate(coupon_id=pricing.coupon(cart.user_id, codes, 'id'), discount=pricing.coupon(cart.user_id, codes, 'discount'))
+        .order_by('id')
+    )
+
+
+def _enrolled_course_ids(user, items):
+    return set(
+        api_models.EnrolledCourse.objects.filter(user=user, course_id__in=[item.course_id for item in items])
+        .values_list('course_id', flat=True)
+    )
+
+
+def _by_id(items, values):
+    '''A CASE expression giving each cart line its own value in one UPDATE'''
+    return models.Case(
+        *[models.When(id=item.id, then=models.Value(value)) for item, value in zip(items, values)],
+        default=models.Value(Decimal('0.00')),
+    )
+
+
+def place_order(user, full_name=None, email=None, country=None, coupons=()):
+    '''
+    Moves the user's cart into a new CartOrder awaiting payment ('Processing')
+    and returns it. Courses the user is already enrolled in are dropped from
+    the cart instead of charged again. Lines are priced like api.pricing
+    prices the cart: the best of the coupon codes their teacher issued, then
+    the country's tax. Nothing is granted until confirm_payment().
+    '''
+    codes = pricing.clean_codes(coupons)
+    with transaction.atomic():
+        # a row lock on PostgreSQL; SQLite serializes writers anyway
+        cart = api_models.Cart.objects.select_for_update().filter(user=user).first()
+        items = _load_items(cart, codes) if cart else []
+        if not items:
+            raise EmptyCart('The cart is empty')
+
+        owned = _enrolled_course_ids(user, items)
+        if owned:
+            api_models.CartOrderItem.objects.filter(id__in=[item.id for item in items if item.course_id in owned]).delete()
+            items = [item for item in items if item.course_id not in owned]
+            if not items:
+                raise EmptyCart('Every course in the cart is already enrolled')
+
+        prices = [item.course.price or Decimal('0.00') for item in items]
+        rate = pricing.tax_rate(country)
+        saved, tax_fees, totals = zip(*[pricing.line_amounts(price, item.discount, rate) for item, price in zip(items, prices)])
+        applied = sorted({item.coupon_id for item, line_saved in zip(items, saved) if item.coupon_id and line_saved})
+        sub_total = sum(prices, Decimal('0.00'))
+        order = api_models.CartOrder.objects.create(
+            student=user,
+            sub_total=sub_total,
+            initial_total=sub_total,
+            saved=sum(saved, Decimal('0.00')),
+            tax_fee=sum(tax_fees, Decimal('0.00')),
+            total=sum(totals, Decimal('0.00')),
+            # the order keeps one coupon, Coupon.used_by records all of them
+            coupons_id=applied[0] if applied else None,
+            payment_status='Processing',
+            full_name=full_name or user.full_name,
+            email=email or user.email,
+            country=country,
+        )
+
+        claimed = api_models.CartOrderItem.objects.filter(
+            id__in=[item.id for item in items], cart=cart, order__isnull=True,
+        ).update(
+            cart=None,
+            order=order,
+            teacher=models.Subquery(api_models.Course.objects.filter(id=models.OuterRef('course_id')).values('teacher_id')[:1]),
+            initial_total=_by_id(items, prices),
+            saved=_by_id(items, saved),
+            tax_fee=_by_id(items, tax_fees),
+            total=_by_id(items, totals),
+        )
+        if claimed != len(items):
+            raise CheckoutConflict('This cart is already being checked out')
+        if applied:
+            api_models.Coupon.used_by.through.objects.bulk_create([
+                api_models.Coupon.used_by.through(coupon_id=coupon_id, user_id=user.id) for coupon_id in applied
+            ])
+
+        teachers = set(filter(None, [item.course.teacher_id for item in items]))
+        api_models.CartOrder.teachers.through.objects.bulk_create([
+            api_models.CartOrder.teachers.through(cartorder_id=order.id, teacher_id=teacher_id)
+            for teacher_id in teachers
+        ])
+        # the claim UPDATE and the used_by INSERT send no signals
+        bump_versions(cart_version(cart.id), *([COUPONS_VERSION] if applied else []))
+
+    return order
+
+
+def confirm_payment(order):
+    '''
+    Marks a Processing order Paid and enrolls its student in its courses, the
+    EnrolledCourse rows and the teacher/student Notification fan-out in one
+    transaction. An order is only ever confirmed once.
+    '''
+    with transaction.atomic():
+        paid = api_models.CartOrder.objects.filter(id=order.id, payment_status='Processing').update(payment_status='Paid')
+        if not paid:
+            raise CheckoutConflict('This order is not awaiting payment')
+        order.payment_status = 'Paid'
+        user = order.student
+        items = list(order.orderitem.select_related('course').order_by('id'))
+        # bought elsewhere while the payment was pending
+        owned = _enrolled_course_ids(user, items)
+        items = [item for item in items if item.course_id not in owned]
+        if not items:
+            return order
+
+        teacher_ids = set(filter(None, [item.course.teacher_id for item in items]))
+        new_teacher_ids = teacher_ids - set(
+            api_models.EnrolledCourse.objects.filter(user=user, course__teacher_id__in=teacher_ids).values_list('course__teacher_id', flat=True)
+        )
+        # enrollment_id is generated in Python, so every row is complete before the INSERT
+        api_models.EnrolledCourse.objects.bulk_create([
+            api_models.EnrolledCourse(
+                user=user, course_id=item.course_id, teacher_id=item.course.teacher_id, order_id_id=item.id,
+                total_lectures=item.course.total_lectures,
+            )
+            for item in items
+        ])
+        notifications = [
+            api_models.Notification(user=user, order=order, order_item_id=item.id, type='Course Enrollment Completed')
+            for item in items
+        ]
+        notifications += [
+            api_models.Notification(teacher_id=item.course.teacher_id, order=order, order_item_id=item.id, type='New Order')
+            for item in items if item.course.teacher_id
+        ]
+        api_models.Notification.objects.fan_out(notifications)
+
+        # bulk_create skips post_save, so the counters and cached pages the
+        # enrollment signals maintain are updated here in bulk
+        api_models.Course.objects.filter(id__in=[item.course_id for item in items]).update(
+            total_students=models.F('total_students') + 1,
+        )
+        # teachers count distinct students, so only ones the student is new to move
+        api_models.Teacher.objects.filter(id__in=new_teacher_ids).update(total_students=models.F('total_students') + 1)
+        bump_versions(CATALOG_VERSION, *{course_version(item.course.slug) for item in items if item.course.slug})
+        forget_course_access([(user.id, item.course_id) for item in items])
+
+    return order
+
+
+def checkout(user, full_name=None, email=None, country=None, coupons=()):
+    '''
+    Places the order and returns it. There is no payment provider yet, so
+    only orders with nothing to pay are confirmed here; any other cart is
+    refused with PaymentRequired and left as it was.
+    '''
+    with transaction.atomic():
+        order = place_order(user, full_name=full_name, email=email, country=country, coupons=coupons)
+        if order.total:
+            # rolls the order back, the lines return to the cart
+            raise PaymentRequired('This cart needs a payment, which is not available yet')
+        return confirm_payment(order)
@@ -0,0 +1,77 @@
+'''
+Sample requests for every route in api/urls.py, shared by the
+audit_query_plans and bench_api commands.
+
+existing_sample() picks a published course, an enrolled student and the
+course's teacher from the current data; sample_requests() turns every route
+into a concrete request for them. Routes under teacher/ are sent as the
+teacher, everything else as the student.
+'''
+import re
+
+from django.core.management.base import CommandError
+from django.urls import URLPattern
+
+from usersauth.models import User
+from api import models as api_models
+from api import urls as api_urls
+
+PASSWORD = 'audit-pass-123'
+
+# Request method and payload per route; everything else is sent as a GET
+SAMPLE_REQUESTS = {
+    'user/token': ('post', lambda s: {'email': s['user'].email, 'password': PASSWORD}),
+    'user/token/refresh/': ('post', lambda s: {'refresh': s['refresh']}),
+    'user/register/': ('post', lambda s: {'full_name': 'audit new', 'email': 'audit-new@example.com', 'password': PASSWORD, 'password2': PASSWORD}),
+    # read at request time, the password-reset endpoint rotates the otp
+    'user/password-change/': ('post', lambda s: {'otp': User.objects.get(pk=s['user'].pk).otp, 'uuidb64': s['user'].pk, 'password': PASSWORD}),
+    'course/search/': ('get', lambda s: {'q': 'course'}),
+    'cart/add/': ('post', lambda s: {'course_id': s['course'].id}),
+    'cart/remove/<int:course_id>': ('delete', lambda s: {}),
+    'cart/checkout/': ('post', lambda s: {}),
+    'teacher/lecture-upload/<upload_id>/chunk/<int:index>/': ('put', lambda s: {}),
+    'teacher/lecture-upload/<upload_id>/finalize/': ('post', lambda s: {}),
+    'student/lectures-completed/': ('post', lambda s: {
+        'course_id': s['course'].id,
+        'lecture_ids': list(api_models.Lecture.objects.filter(section__course=s['course']).values_list('id', flat=True)),
+    }),
+}
+
+
+def existing_sample():
+    course = api_models.Course.objects.published().filter(teacher__isnull=False).order_by('id').first()
+    enrollment = api_models.EnrolledCourse.objects.filter(user__isnull=False).order_by('id').first()
+    user = enrollment.user if enrollment else User.objects.order_by('id').first()
+    if course is None or user is None:
+        raise CommandError('No sample data: seed some courses and users first')
+    lecture = api_models.Lecture.objects.filter(section__course=course).order_by('id').first()
+    question = api_models.QuestionAnswer.objects.filter(course=course).order_by('id').first()
+    user.set_password(PASSWORD)
+    user.otp = '000000'
+    user.save()
+
+    from rest_framework_simplejwt.tokens import RefreshToken
+    return {
+        'user': user,
+        'teacher': course.teacher.user,
+        'course': course,
+        'refresh': str(RefreshToken.for_user(user)),
+        'kwargs': {
+            'email': user.email, 'slug': course.slug, 'course_id': course.id,
+            'lecture_id': lecture.lecture_id if lecture else 'none',
+            'qa_id': question.qa_id if question else 'none',
+            'upload_id': 'none', 'index': 0,
+        },
+    }
+
+
+def sample_requests(sample):
+    '''Yields (route, method, path, payload, user) for every route in api/urls.py'''
+    for pattern in api_urls.urlpatterns:
+        if not isinstance(pattern, URLPattern):
+            continue
+        route = str(pattern.pattern)
+        path = '/api/v1/' + re.sub(r'<(?:\w+:)?(\w+)>', lambda m: str(sample['kwargs'][m.group(1)]), route)
+        method, payload = SAMPLE_REQUESTS.get(route, ('get', lambda s: {}))
+        user = sample['teacher'] if route.startswith('teacher/') else sample['user']
+        yield route, method, path, payload, user
@@ -0,0 +1,162 @@
+import re
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from usersauth.models import User, Profile
+from api import models as api_models
+from api.endpoints import PASSWORD, existing_sample, sample_requests
+
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs every endpoint in api/urls.py, EXPLAINs each SQL statement it issues and '
+        'fails on full table scans or temp B-tree sorts over large tables'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=40, help='Courses to seed before auditing')
+        parser.add_argument('--students', type=int, default=30, help='Enrollments per seeded course')
+        parser.add_argument('--no-seed', action='store_true', help='Audit the data already in the database')
+        parser.add_argument('--min-rows', type=int, default=500, help='Tables with fewer rows may be scanned')
+        parser.add_argument('--keep', action='store_true', help='Commit seeded data instead of rolling it back, not with --no-seed')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'EXPLAIN parsing is not implemented for {connection.vendor}')
+        if options['keep'] and options['no_seed']:
+            # the sample user's password and every write the endpoints make would be committed to real data
+            raise CommandError('--keep only keeps seeded data, it cannot be combined with --no-seed')
+
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', ALLOWED_HOSTS=['*']):
+            with transaction.atomic():
+                if options['no_seed']:
+                    sample = existing_sample()
+                else:
+                    sample = self.seed(options['courses'], options['students'])
+                problems = self.audit(sample, options['min_rows'])
+                if not options['keep']:
+                    transaction.set_rollback(True)
+
+        if problems:
+            for endpoint, sql, reason in problems:
+                self.stdout.write(self.style.ERROR(f'{endpoint}: {reason}\n    {sql[:300]}'))
+            raise CommandError(f'{len(problems)} query plan problems found')
+        self.stdout.write(self.style.SUCCESS('No full table scans or temp B-tree sorts on large tables'))
+
+    def seed(self, courses, students):
+        password = make_password(PASSWORD)
+        users = User.objects.bulk_create([
+            User(email=f'audit{i}@example.com', username=f'audit{i}', full_name=f'audit{i}', password=password)
+            for i in range(students + courses)
+        ])
+        Profile.objects.bulk_create([Profile(user=user, full_name=user.full_name) for user in users])
+        teachers = api_models.Teacher.objects.bulk_create([
+            api_models.Teacher(user=user, full_name=user.full_name) for user in users[students:]
+        ])
+        category = api_models.Category.objects.create(title='Audit')
+
+        for index, teacher in enumerate(teachers):
+            course = api_models.Course.objects.create(category=category, teacher=teacher, title=f'Audit course {index}', description='Audit')
+            section = api_models.Section.objects.create(course=course, title='Section')
+            lectures = [api_models.Lecture.objects.create(section=section, title=f'Lecture {i}') for i in range(3)]
+            for user in users[:students]:
+                api_models.EnrolledCourse.objects.create(user=user, course=course, teacher=teacher)
+                api_models.Review.objects.create(user=user, course=course, review='Audit', rating=4, active=True)
+            api_models.CompletedLecture.objects.bulk_create([
+                api_models.CompletedLecture(user=user, course=course, lesson=lectures[0]) for user in users[:students]
+            ])
+            api_models.Note.objects.bulk_create([
+                api_models.Note(user=user, course=course, title='Note', note='Note') for user in users[:students]
+            ])
+            question = api_models.QuestionAnswer.objects.create(user=users[0], course=course, title='Question')
+            api_models.QuestionAnswerResponse.objects.bulk_create([
+                api_models.QuestionAnswerResponse(user=user, course=course, question=question, message='Answer') for user in users[:students]
+            ])
+        api_models.Notification.objects.bulk_create([
+            api_models.Notification(user=user, type='New Order') for user in users for _ in range(5)
+        ])
+        return existing_sample()
+
+    def audit(self, sample, min_rows):
+        client = Client(raise_request_exception=False)
+        self.row_counts = {}
+        problems = []
+
+        for route, method, path, payload, user in sample_requests(sample):
+            data = payload(sample)
+            # password-change invalidates the session, so log in again every time
+            client.force_login(User.objects.get(pk=user.pk))
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                if method == 'get':
+                    response = client.get(path, data)
+                else:
+                    response = getattr(client, method)(path, data, content_type='application/json')
+            self.stdout.write(f'{method.upper():6} {path} -> {response.status_code}, {len(queries)} queries')
+
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith(EXPLAINABLE):
+                    continue
+                for reason in self.check_plan(sql, min_rows):
+                    problems.append((f'{method.upper()} {path}', sql, reason))
+        return problems
+
+    def row_count(self, table):
+        if table not in self.row_counts:
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+                self.row_counts[table] = cursor.fetchone()[0]
+        return self.row_counts[table]
+
+    def resolve_tables(self, sql, names):
+        '''
+        Maps plan names back to tables. Aliases resolve through the FROM/JOIN
+        clauses; CTEs and subqueries resolve to nothing, their own scans are
+        reported separately.
+        '''
+        tables = set(connection.introspection.table_names())
+        aliases = {
+            alias: table for table, alias in
+            re.findall(r'(?:FROM|JOIN)\s+"?(\w+)"?\s+(?:AS\s+)?"?(\w+)"?', sql, re.IGNORECASE)
+        }
+        resolved = []
+        for name in names:
+            name = name if name in tables else aliases.get(name)
+            if name in tables:
+                resolved.append(name)
+        return resolved
+
+    def check_plan(self, sql, min_rows):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = '\n'.join(row[-1] for row in cursor.fetchall())
+            else:
+                cursor.execute('EXPLAIN ' + sql)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+
+        if connection.vendor == 'sqlite':
+            full_scans = re.findall(r'^\s*SCAN (\w+)(?:$| AS)', plan, re.MULTILINE)
+            # full index scans still read the whole table, which is what makes a sort expensive
+            scans = re.findall(r'^\s*SCAN (\w+)\b(?! VIRTUAL TABLE)', plan, re.MULTILINE)
+            sorts = re.findall(r'USE TEMP B-TREE FOR [\w ]+', plan)
+        else:
+            full_scans = re.findall(r'Seq Scan on (\w+)', plan)
+            scans = full_scans
+            sorts = re.findall(r'^\s*(?:->\s*)?Sort\b.*$', plan, re.MULTILINE)
+
+        large = lambda table: self.row_count(table) >= min_rows
+        reasons = [
+            f'full scan of {table} ({self.row_count(table)} rows)'
+            for table in self.resolve_tables(sql, full_scans) if large(table)
+        ]
+        if sorts and any(large(table) for table in self.resolve_tables(sql, scans)):
+            reasons.append(f'temp B-tree sort over a scanned large table: {sorts[0].strip()}')
+        return reasons
@@ -0,0 +1,189 @@
+import gc
+import json
+import logging
+import math
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+
+from api.endpoints import existing_sample, sample_requests
+
+
+class QueryTimer:
+    '''Counts and times the statements a connection runs, to the microsecond'''
+    # the benchmark's own savepoints are not the endpoint's
+    IGNORED = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.startswith(self.IGNORED):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+def percentile(values, share):
+    '''Nearest-rank percentile of an already sorted list'''
+    return values[max(math.ceil(share * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Times every endpoint in api/urls.py anonymously and with a JWT, records latency percentiles, '
+        'query counts, SQL time and response sizes as JSON, and optionally fails on regressions '
+        'against a saved baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per endpoint')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', help='Compare against the results in this JSON file')
+        parser.add_argument('--threshold', type=float, default=0.25, help='Allowed relative p95 increase over the baseline')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0, help='Ignore p95 increases smaller than this')
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every request')
+        parser.add_argument('--route', action='append', default=[], help='Only run routes containing this text, can be repeated')
+        parser.add_argument('--seed', action='store_true', help='Run seed_lms at its default size first, rolled back afterwards')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                baseline = json.load(handle)
+
+        # buckets would start refusing the auth endpoints after a few iterations
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+        # the notification stream ends after its first event, so connecting to it is what gets timed
+        with override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', ALLOWED_HOSTS=['*'], REST_FRAMEWORK=rest_framework,
+            NOTIFICATION_STREAM_SECONDS=0,
+        ):
+            # nothing a benchmark writes, the sample user's password included, is kept
+            with transaction.atomic():
+                if options['seed']:
+                    call_command('seed_lms', stdout=self.stdout)
+                # 401s and 404s are expected here, one warning per request would bury the table
+                request_logger = logging.getLogger('django.request')
+                level = request_logger.level
+                request_logger.setLevel(logging.ERROR)
+                try:
+                    results = self.bench(existing_sample(), options)
+                finally:
+                    request_logger.setLevel(level)
+                transaction.set_rollback(True)
+
+        report = {
+            'meta': {
+                'created': datetime.now(dt_timezone.utc).isoformat(timespec='seconds'),
+                'vendor': connection.vendor,
+                'iterations': options['iterations'],
+                'cold': options['cold'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2, sort_keys=True)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if baseline is not None:
+            regressions = self.compare(baseline['results'], results, options['threshold'], options['min_delta_ms'])
+            if regressions:
+                for regression in regressions:
+                    self.stdout.write(self.style.ERROR(regression))
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}'))
+
+    def bench(self, sample, options):
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        client = Client(raise_request_exception=False)
+        results = {}
+        self.stdout.write(f'{"endpoint":64} {"status":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>7} {"sql ms":>7} {"bytes":>8}')
+        for route, method, path, payload, user in sample_requests(sample):
+            if options['route'] and not any(text in route for text in options['route']):
+                continue
+            for mode in ('anon', 'auth'):
+                headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'} if mode == 'auth' else {}
+                timings, stats = [], None
+                for iteration in range(options['warmup'] + options['iterations']):
+                    stats = self.request(client, method, path, payload(sample), headers, options['cold'])
+                    if iteration >= options['warmup']:
+                        timings.append(stats.pop('ms'))
+
+                timings.sort()
+                key = f'{method.upper()} {route} [{mode}]'
+                results[key] = {
+                    'status': stats['status'],
+                    'p50_ms': round(percentile(timings, 0.50), 3),
+                    'p95_ms': round(percentile(timings, 0.95), 3),
+                    'p99_ms': round(percentile(timings, 0.99), 3),
+                    'queries': stats['queries'],
+                    'sql_ms': stats['sql_ms'],
+                    'bytes': stats['bytes'],
+                }
+                row = results[key]
+                self.stdout.write(
+                    f'{key:64} {row["status"]:>6} {row["p50_ms"]:>8.2f} {row["p95_ms"]:>8.2f} {row["p99_ms"]:>8.2f} '
+                    f'{row["queries"]:>7} {row["sql_ms"]:>7.2f} {row["bytes"]:>8}'
+                )
+        return results
+
+    def request(self, client, method, path, data, headers, cold):
+        '''Sends one request in a savepoint that is rolled back, so every iteration sees the same data'''
+        if cold:
+            cache.clear()
+        queries = QueryTimer()
+        # like timeit, collect before and not during the request, a collection would land on whichever route is running
+        gc.collect()
+        gc.disable()
+        try:
+            with transaction.atomic(), connection.execute_wrapper(queries):
+                started = time.perf_counter()
+                if method == 'get':
+                    response = client.get(path, data, **headers)
+                else:
+                    response = getattr(client, method)(path, data, content_type='application/json', **headers)
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+                elapsed = time.perf_counter() - started
+                transaction.set_rollback(True)
+        finally:
+            gc.enable()
+        return {
+            'ms': elapsed * 1000,
+            'status': response.status_code,
+            'queries': queries.count,
+            'sql_ms': round(queries.seconds * 1000, 3),
+            'bytes': len(body),
+        }
+
+    def compare(self, baseline, results, threshold, min_delta_ms):
+        regressions = []
+        for key, row in results.items():
+            before = baseline.get(key)
+            if before is None:
+                continue
+            if row['status'] != before['status']:
+                regressions.append(f'{key}: status {before["status"]} -> {row["status"]}')
+            # query counts do not depend on timing noise, so any increase counts
+            if row['queries'] > before['queries']:
+                regressions.append(f'{key}: {before["queries"]} -> {row["queries"]} queries')
+            slower = row['p95_ms'] - before['p95_ms']
+            if slower > min_delta_ms and row['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append(f'{key}: p95 {before["p95_ms"]:.2f} -> {row["p95_ms"]:.2f} ms')
+        return regressions
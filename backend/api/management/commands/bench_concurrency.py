@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from api.management.commands.bench_api import percentile
+
+# name -> (server interface, settings.ASYNC_VIEWS)
+CONFIGS = {
+    'wsgi': ('wsgi', False),
+    'asgi-sync': ('asgi', False),
+    'asgi-async': ('asgi', True),
+}
+DEFAULT_PATHS = ['/api/v1/course/course-list/', '/api/v1/course/category/']
+
+
+def wsgi_request(application, path, token):
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': 'testserver',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if token:
+        environ['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    status = []
+    body = application(environ, lambda line, headers, exc_info=None: status.append(line))
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return int(status[0].split()[0])
+
+
+async def asgi_request(application, path, token):
+    path, _, query = path.partition('?')
+    headers = [(b'host', b'testserver')]
+    if token:
+        headers.append((b'authorization', f'Bearer {token}'.encode()))
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': headers,
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    # Django keeps listening for a disconnect while the view runs
+    disconnected = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    status = []
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares request throughput and latency of the WSGI and ASGI applications at increasing numbers '
+        'of concurrent clients. Each configuration runs in its own process, with the async catalog and '
+        'cart views (settings.ASYNC_VIEWS) on or off'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', default='100,250,500,1000', help='Comma separated numbers of concurrent clients')
+        parser.add_argument('--requests', type=int, default=5, help='Requests each client sends, one after the other')
+        parser.add_argument('--path', action='append', default=[], help='GET these paths in turn, can be repeated')
+        parser.add_argument('--threads', type=int, default=32, help='Worker threads serving the WSGI application')
+        parser.add_argument('--email', help='Send a JWT for this user with every request')
+        parser.add_argument('--no-cache', action='store_true', help='Use a dummy cache, so every request reaches the database')
+        parser.add_argument('--config', action='append', choices=sorted(CONFIGS), default=[], help='Only run these configurations, can be repeated')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        # set on the per-configuration child processes
+        parser.add_argument('--child', choices=sorted(CONFIGS), help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['clients'].split(',')]
+        except ValueError:
+            raise CommandError('--clients must be a comma separated list of numbers')
+        if not levels or min(levels) < 1 or options['requests'] < 1 or options['threads'] < 1:
+            raise CommandError('--clients, --requests and --threads must be at least 1')
+
+        if options['child']:
+            results = self.run(options['child'], levels, options)
+            self.stdout.write(json.dumps(results))
+            return
+
+        results = {}
+        self.stdout.write(f'{"config":12} {"clients":>7} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>6}')
+        for name in options['config'] or list(CONFIGS):
+            results[name] = self.spawn(name, options)
+            for clients, row in results[name].items():
+                self.stdout.write(
+                    f'{name:12} {clients:>7} {row["rps"]:>9.1f} {row["p50_ms"]:>8.2f} {row["p95_ms"]:>8.2f} '
+                    f'{row["p99_ms"]:>8.2f} {row["errors"]:>6}'
+                )
+
+        if options['output']:
+            report = {
+                'meta': {
+                    'created': datetime.now(dt_timezone.utc).isoformat(timespec='seconds'),
+                    'vendor': connection.vendor,
+                    'requests': options['requests'],
+                    'threads': options['threads'],
+                    'paths': options['path'] or DEFAULT_PATHS,
+                    'cache': not options['no_cache'],
+                },
+                'results': results,
+            }
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2, sort_keys=True)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def spawn(self, name, options):
+        '''Runs one configuration in a fresh process, the URLconf picks its views at import time'''
+        command = [
+            sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_concurrency', '--child', name, '--skip-checks',
+            '--clients', options['clients'], '--requests', str(options['requests']), '--threads', str(options['threads']),
+        ]
+        for path in options['path']:
+            command += ['--path', path]
+        if options['email']:
+            command += ['--email', options['email']]
+        if options['no_cache']:
+            command.append('--no-cache')
+
+        env = {**os.environ, 'ASYNC_VIEWS': '1' if CONFIGS[name][1] else '0'}
+        finished = subprocess.run(command, env=env, capture_output=True, text=True)
+        if finished.returncode != 0:
+            raise CommandError(f'{name} failed:\n{finished.stderr}')
+        return json.loads(finished.stdout.strip().splitlines()[-1])
+
+    def run(self, name, levels, options):
+        server, async_views = CONFIGS[name]
+        if settings.ASYNC_VIEWS != async_views:
+            raise CommandError(f'{name} needs ASYNC_VIEWS={int(async_views)}')
+
+        token = None
+        if options['email']:
+            from rest_framework_simplejwt.tokens import AccessToken
+            from usersauth.models import User
+            user = User.objects.filter(email=options['email']).first()
+            if user is None:
+                raise CommandError(f'No user with email {options["email"]}')
+            token = str(AccessToken.for_user(user))
+
+        overrides = {'ALLOWED_HOSTS': ['*']}
+        if options['no_cache']:
+            overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+        paths = options['path'] or DEFAULT_PATHS
+        results = {}
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            with override_settings(**overrides):
+                if server == 'wsgi':
+                    from django.core.wsgi import get_wsgi_application
+                    application = get_wsgi_application()
+                else:
+                    from django.core.asgi import get_asgi_application
+                    application = get_asgi_application()
+                for clients in levels:
+                    results[clients] = asyncio.run(self.level(server, application, clients, paths, token, options))
+        finally:
+            request_logger.setLevel(level)
+        return results
+
+    async def level(self, server, application, clients, paths, token, options):
+        '''
+        Starts every client at once and times each request from send to last
+        byte. WSGI requests queue for the worker threads the way they would in
+        a threaded server, ASGI requests all run on this event loop.
+        '''
+        loop = asyncio.get_running_loop()
+        pool = ThreadPoolExecutor(options['threads']) if server == 'wsgi' else None
+        latencies, statuses = [], Counter()
+
+        async def client(number):
+            for index in range(options['requests']):
+                path = paths[(number + index) % len(paths)]
+                started = time.perf_counter()
+                if pool is not None:
+                    status = await loop.run_in_executor(pool, wsgi_request, application, path, token)
+                else:
+                    status = await asgi_request(application, path, token)
+                latencies.append(time.perf_counter() - started)
+                statuses[status] += 1
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(client(number) for number in range(clients)))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'seconds': round(elapsed, 3),
+            'rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'errors': sum(count for status, count in statuses.items() if status >= 400),
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        }
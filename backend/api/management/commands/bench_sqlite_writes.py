@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+from api import checkout
+from api import models as api_models
+from api.management.commands.bench_api import percentile
+from usersauth.models import User
+from core import writer
+
+# name -> environment of the process that runs it
+PROFILES = {
+    'default': {'SQLITE_PRODUCTION': '0', 'SQLITE_WRITE_QUEUE': '0'},
+    'tuned': {'SQLITE_PRODUCTION': '1', 'SQLITE_WRITE_QUEUE': '0'},
+    'tuned+queue': {'SQLITE_PRODUCTION': '1', 'SQLITE_WRITE_QUEUE': '1'},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures sustained write throughput on SQLite while many threads read, with the stock settings, '
+        'with the SQLITE_PRODUCTION pragmas and with the single-writer queue. Every profile runs in its own '
+        'process on a fresh copy of a small seeded database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=10.0, help='How long each profile runs')
+        parser.add_argument('--writers', type=int, default=16, help='Threads marking lectures completed and adding to carts')
+        parser.add_argument('--readers', type=int, default=32, help='Threads reading the catalog')
+        parser.add_argument('--profile', action='append', choices=list(PROFILES), default=[], help='Only run these profiles, can be repeated')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        # set on the per-profile child processes
+        parser.add_argument('--child', choices=list(PROFILES), help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['seconds'] <= 0 or options['writers'] < 1 or options['readers'] < 0:
+            raise CommandError('--seconds and --writers must be positive, --readers at least 0')
+
+        if options['child']:
+            if connection.vendor != 'sqlite':
+                raise CommandError('This benchmark needs a SQLite database')
+            self.stdout.write(json.dumps(self.run(options)))
+            return
+
+        directory = tempfile.mkdtemp()
+        try:
+            template = os.path.join(directory, 'template.sqlite3')
+            self.stdout.write('Seeding a scratch database...')
+            self.manage(['migrate', '-v0'], template)
+            self.manage(['seed_lms', '--users', '300', '--courses', '30', '--enrollments', '3000'], template)
+
+            results = {}
+            self.stdout.write(
+                f'{"profile":12} {"writes/s":>9} {"w p50 ms":>9} {"w p99 ms":>9} {"reads/s":>9} '
+                f'{"r p99 ms":>9} {"locked":>7} {"batch":>6}'
+            )
+            for name in options['profile'] or list(PROFILES):
+                # a '+' would read as a space in DATABASE_URL
+                database = os.path.join(directory, f'{name.replace("+", "-")}.sqlite3')
+                shutil.copyfile(template, database)
+                command = [
+                    'bench_sqlite_writes', '--child', name, '--seconds', str(options['seconds']),
+                    '--writers', str(options['writers']), '--readers', str(options['readers']),
+                ]
+                row = results[name] = json.loads(self.manage(command, database, PROFILES[name]).strip().splitlines()[-1])
+                # no latency without any writes or readers
+                milliseconds = {key: '-' if row[key] is None else f'{row[key]:.2f}' for key in ('write_p50_ms', 'write_p99_ms', 'read_p99_ms')}
+                self.stdout.write(
+                    f'{name:12} {row["writes_per_second"]:>9.1f} {milliseconds["write_p50_ms"]:>9} {milliseconds["write_p99_ms"]:>9} '
+                    f'{row["reads_per_second"]:>9.1f} {milliseconds["read_p99_ms"]:>9} {row["locked"]:>7} {row["batch_size"]:>6.1f}'
+                )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump({'options': {key: options[key] for key in ('seconds', 'writers', 'readers')}, 'results': results}, handle, indent=2, sort_keys=True)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def manage(self, command, database, extra_env=None):
+        env = {**os.environ, 'DATABASE_URL': f'sqlite:///{database}', 'REPLICA_DATABASE_URLS': '', **(extra_env or {})}
+        finished = subprocess.run(
+            [sys.executable, str(settings.BASE_DIR / 'manage.py'), *command, '--skip-checks'],
+            env=env, capture_output=True, text=True,
+        )
+        if finished.returncode != 0:
+            raise CommandError(f'{command[0]} failed:\n{finished.stderr}')
+        return finished.stdout
+
+    def run(self, options):
+        enrollments = list(api_models.EnrolledCourse.objects.filter(user__isnull=False).select_related('course'))
+        lectures = {}
+        for lecture_id, course_id in api_models.Lecture.objects.values_list('id', 'section__course_id'):
+            lectures.setdefault(course_id, []).append(lecture_id)
+        users = list(User.objects.order_by('id')[:options['writers'] * 4])
+        course_ids = list(api_models.Course.objects.values_list('id', flat=True))
+        enrollments = [enrollment for enrollment in enrollments if lectures.get(enrollment.course_id)]
+        if not enrollments or not users:
+            raise CommandError('No enrollments with lectures to write to')
+
+        stop = threading.Event()
+        writes, reads, locked = [], [], []
+
+        def write(number):
+            rng = random.Random(number)
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    # mostly completions, the most frequent write, with some cart traffic
+                    if rng.random() < 0.8:
+                        enrollment = rng.choice(enrollments)
+                        enrollment.mark_completed(rng.sample(lectures[enrollment.course_id], 1))
+                    else:
+                        writer.run(checkout.add_to_cart, rng.choice(users), rng.choice(course_ids))
+                except OperationalError:
+                    locked.append(1)
+                    continue
+                writes.append(time.perf_counter() - started)
+
+        def read(number):
+            rng = random.Random(-number - 1)
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    list(api_models.Course.objects.for_listing(['title', 'price', 'total_students']).order_by('-date', '-id')[:20])
+                    api_models.EnrolledCourse.objects.filter(user=rng.choice(users)).count()
+                except OperationalError:
+                    locked.append(1)
+                    continue
+                reads.append(time.perf_counter() - started)
+
+        def thread(target, number):
+            try:
+                target(number)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=thread, args=(write, number)) for number in range(options['writers'])]
+        threads += [threading.Thread(target=thread, args=(read, number)) for number in range(options['readers'])]
+        started = time.perf_counter()
+        for worker in threads:
+            worker.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for worker in threads:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        writes.sort()
+        reads.sort()
+        queue = writer._writer
+        return {
+            'writes': len(writes),
+            'writes_per_second': round(len(writes) / elapsed, 1),
+            'write_p50_ms': round(percentile(writes, 0.50) * 1000, 3) if writes else None,
+            'write_p99_ms': round(percentile(writes, 0.99) * 1000, 3) if writes else None,
+            'reads': len(reads),
+            'reads_per_second': round(len(reads) / elapsed, 1),
+            'read_p99_ms': round(percentile(reads, 0.99) * 1000, 3) if reads else None,
+            'locked': len(locked),
+            'batch_size': round(queue.writes / queue.batches, 1) if queue and queue.batches else 1.0,
+        }
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import models as api_models
+from api import uploads
+
+
+class Command(BaseCommand):
+    help = 'Deletes unfinished lecture uploads, and their partial files, that were started too long ago'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=48, help='Age after which an unfinished upload is abandoned')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        stale = api_models.LectureUpload.objects.filter(status=api_models.LectureUpload.Status.UPLOADING, created_at__lt=cutoff)
+        count = 0
+        for upload in stale.iterator():
+            uploads.discard(upload)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Removed {count} abandoned uploads'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text course search index from scratch'
+
+    def handle(self, *args, **options):
+        search.reindex_courses(None)
+        self.stdout.write(self.style.SUCCESS('Course search index rebuilt'))
@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models.functions import Cast
+
+from api import models as api_models
+
+
+def _grouped(queryset, key, **aggregates):
+    '''Returns {key: {aggregate: value}} for a values().annotate() grouping'''
+    return {row.pop(key): row for row in queryset.values(key).annotate(**aggregates).order_by()}
+
+
+class Command(BaseCommand):
+    help = 'Recomputes denormalized course, category, teacher and enrollment progress counters from scratch and reports drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drift, do not write')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        active_reviews = api_models.Review.objects.filter(active=True)
+        rating = Cast('rating', models.IntegerField())
+
+        expected = {
+            api_models.Course: self.merge(
+                _grouped(active_reviews, 'course_id', rating_sum=models.Sum(rating), total_reviews=models.Count('id')),
+                _grouped(api_models.EnrolledCourse.objects.all(), 'course_id', total_students=models.Count('id')),
+                _grouped(api_models.Lecture.objects.all(), 'section__course_id', total_lectures=models.Count('id'), total_duration=models.Sum('duration')),
+            ),
+            api_models.Category: self.merge(
+                _grouped(api_models.Course.objects.all(), 'category_id', total_courses=models.Count('id')),
+            ),
+            api_models.Teacher: self.merge(
+                _grouped(api_models.Course.objects.all(), 'teacher_id', total_courses=models.Count('id')),
+                _grouped(active_reviews, 'course__teacher_id', total_reviews=models.Count('id')),
+                _grouped(api_models.EnrolledCourse.objects.all(), 'course__teacher_id', total_students=models.Count('user_id', distinct=True)),
+            ),
+        }
+
+        drifted = 0
+        for model, values in expected.items():
+            drifted += self.rebuild(model, values, options['dry_run'], options['batch_size'])
+        drifted += self.rebuild(
+            api_models.EnrolledCourse, self.enrollment_progress(expected[api_models.Course]),
+            options['dry_run'], options['batch_size'], fields=['completed_lectures', 'total_lectures', 'progress'],
+        )
+
+        verb = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {drifted} rows with drifted counters'))
+
+    def merge(self, *groups):
+        merged = {}
+        for group in groups:
+            for key, row in group.items():
+                merged.setdefault(key, {}).update(row)
+        return merged
+
+    def enrollment_progress(self, course_totals):
+        completed = {
+            (row['user_id'], row['course_id']): row['count']
+            for row in api_models.CompletedLecture.objects.values('user_id', 'course_id').annotate(count=models.Count('id')).order_by()
+        }
+        expected = {}
+        for pk, user_id, course_id in api_models.EnrolledCourse.objects.values_list('pk', 'user_id', 'course_id').iterator():
+            done = completed.get((user_id, course_id), 0)
+            total = course_totals.get(course_id, {}).get('total_lectures') or 0
+            expected[pk] = {
+                'completed_lectures': done,
+                'total_lectures': total,
+                'progress': min(done * 100 // total, 100) if total else 0,
+            }
+        return expected
+
+    def rebuild(self, model, expected, dry_run, batch_size, fields=None):
+        fields = list(fields or model.counter_fields)
+        changed = []
+        for obj in model.objects.only(*fields).order_by('pk').iterator(chunk_size=batch_size):
+            row = expected.get(obj.pk, {})
+            diffs = []
+            for field in fields:
+                value = row.get(field) or 0
+                if getattr(obj, field) != value:
+                    diffs.append(f'{field} {getattr(obj, field)} -> {value}')
+                    setattr(obj, field, value)
+            if diffs:
+                self.stdout.write(f'{model.__name__} {obj.pk}: ' + ', '.join(diffs))
+                changed.append(obj)
+
+        if changed and not dry_run:
+            with transaction.atomic():
+                model.objects.bulk_update(changed, fields, batch_size=batch_size)
+        return len(changed)
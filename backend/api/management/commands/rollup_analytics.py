@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api import analytics
+
+
+class Command(BaseCommand):
+    help = 'Folds enrollments, reviews and lecture completions added since the last run into the daily course and teacher stats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Source rows folded per transaction')
+        parser.add_argument('--rebuild', action='store_true', help='Drop the rollups and watermarks and recount everything')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            analytics.reset()
+        processed = analytics.rollup(batch_size=max(1, options['batch_size']))
+        for source, count in processed.items():
+            self.stdout.write(f'{source}: {count} new rows')
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {sum(processed.values())} rows'))
@@ -0,0 +1,305 @@
+'''
+Generates a large, reproducible LMS dataset for local benchmarking.
+
+Every row comes from one random.Random(seed), so the same options give the
+same data (dates are relative to today). Course popularity, teacher output,
+category size and student activity follow power laws, so a few courses and
+students hold most of the enrollments as they do in production.
+
+Rows are built in memory a batch at a time and written with bulk_create,
+which sends no signals: profiles are created here instead of by the User
+post_save receiver, ShortUUIDs come from the seeded generator, and counters,
+the search index and the analytics rollups are rebuilt once at the end.
+
+    manage.py seed_lms --users 500000 --courses 20000 --enrollments 4000000
+
+writes roughly 10M rows.
+'''
+import random
+import time
+from array import array
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from usersauth.models import User, Profile
+from api import models as api_models
+
+PASSWORD = 'seed-pass-123'
+ALPHABET = 'abcdefgh12345'
+HISTORY_DAYS = 730
+
+FIRST_NAMES = ['Aisha', 'Ben', 'Carmen', 'Dev', 'Elena', 'Farid', 'Grace', 'Hiro', 'Ines', 'Jonas', 'Kavya', 'Liam', 'Maya', 'Noah', 'Olu', 'Priya', 'Quinn', 'Rosa', 'Sami', 'Tara']
+LAST_NAMES = ['Ahmed', 'Brown', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Gupta', 'Hassan', 'Ivanov', 'Jones', 'Khan', 'Lopez', 'Müller', 'Nguyen', 'Okafor', 'Patel', 'Rossi', 'Silva', 'Tanaka', 'Wright']
+COUNTRIES = ['India', 'United States', 'Nigeria', 'United Kingdom', 'Germany', 'Brazil', 'Pakistan', 'Canada', 'Indonesia', 'Spain']
+CATEGORIES = ['Development', 'Business', 'Design', 'Marketing', 'Data Science', 'Photography', 'Music', 'Finance', 'Health', 'Languages', 'IT & Software', 'Personal Development']
+TOPICS = ['Python', 'Django', 'React', 'SQL', 'Machine Learning', 'Excel', 'Figma', 'SEO', 'Guitar', 'Photoshop', 'Accounting', 'Kubernetes', 'Public Speaking', 'Spanish', 'Statistics', 'Rust', 'Copywriting', 'Yoga']
+TITLE_FORMS = ['{topic} for Beginners', 'Complete {topic} Bootcamp', 'Mastering {topic}', '{topic} in 30 Days', 'Practical {topic}', 'Advanced {topic}']
+WORDS = 'the a to of and in lecture course example module practice project data build learn step simple quick review question answer'.split()
+PRICES = [Decimal(price) for price in ('0.00', '9.99', '19.99', '49.99', '99.99', '199.99')]
+RATINGS = [1, 2, 3, 4, 5]
+RATING_WEIGHTS = [3, 4, 10, 30, 53]
+
+
+def power_law(count, exponent, rng):
+    '''Cumulative weights for picking among `count` items, item popularity falling off as rank ** -exponent'''
+    weights = [1 / (rank + 1) ** exponent for rank in range(count)]
+    rng.shuffle(weights)  # so popularity does not follow insertion order
+    return list(accumulate(weights))
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a deterministic synthetic LMS dataset using batched bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help='Users, teachers included')
+        parser.add_argument('--teachers', type=int, default=None, help='Defaults to 2%% of users')
+        parser.add_argument('--categories', type=int, default=len(CATEGORIES))
+        parser.add_argument('--courses', type=int, default=200)
+        parser.add_argument('--sections', type=int, default=5, help='Average sections per course')
+        parser.add_argument('--lectures', type=int, default=6, help='Average lectures per section')
+        parser.add_argument('--enrollments', type=int, default=10000, help='Approximate total enrollments')
+        parser.add_argument('--review-rate', type=float, default=0.25, help='Share of enrollments with a review')
+        parser.add_argument('--question-rate', type=float, default=0.1, help='Share of enrollments that ask a question')
+        parser.add_argument('--note-rate', type=float, default=0.2, help='Share of enrollments with notes')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--skip-rebuild', action='store_true', help='Leave counters, search index and rollups stale')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username='seed0').exists():
+            raise CommandError('This database is already seeded, run seed_lms on an empty one')
+        teachers = options['teachers'] if options['teachers'] is not None else max(1, options['users'] // 50)
+        if not 0 < teachers <= options['users'] or options['courses'] < 1 or options['categories'] < 1:
+            raise CommandError('Need at least one user, teacher, category and course, and no more teachers than users')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.options = options
+        self.pending = {}
+        self.counts = {}
+        started = time.monotonic()
+
+        if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+            # a crash mid-seed leaves a database to throw away anyway
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA synchronous = OFF')
+
+        self.seed_users(options['users'], teachers)
+        self.seed_catalog(options['categories'], options['courses'], options['sections'], options['lectures'])
+        self.seed_activity(options['enrollments'])
+
+        for model, count in self.counts.items():
+            self.stdout.write(f'{model._meta.label}: {count}')
+        self.stdout.write(f'inserted {sum(self.counts.values())} rows in {time.monotonic() - started:.1f}s')
+
+        if not options['skip_rebuild']:
+            # every counter starts at zero, so skip the per-row drift report
+            stats = StringIO()
+            call_command('rebuild_stats', stdout=stats)
+            self.stdout.write(stats.getvalue().strip().splitlines()[-1])
+            call_command('rebuild_search_index', stdout=self.stdout)
+            call_command('rollup_analytics', '--rebuild', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Seeded in {time.monotonic() - started:.1f}s, users log in with {PASSWORD}'))
+
+    # helpers
+
+    def short_uuid(self, prefix):
+        return prefix + ''.join(self.rng.choices(ALPHABET, k=22))
+
+    def past(self, days=HISTORY_DAYS, after=None):
+        '''A random moment in the last `days` days, not before `after`'''
+        moment = self.now - timedelta(seconds=self.rng.randrange(days * 86400))
+        return max(moment, after) if after else moment
+
+    def text(self, words):
+        return ' '.join(self.rng.choices(WORDS, k=words)).capitalize() + '.'
+
+    def add(self, obj):
+        '''Queues a row; children queued after their parents are written after them'''
+        rows = self.pending.setdefault(type(obj), [])
+        rows.append(obj)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with transaction.atomic():
+            # dicts keep insertion order, which is parent before child
+            for model, rows in self.pending.items():
+                if rows:
+                    model.objects.bulk_create(rows)
+                    self.counts[model] = self.counts.get(model, 0) + len(rows)
+                    rows.clear()
+
+    def insert_all(self, model, rows):
+        '''Writes rows of one model in batches and returns their primary keys'''
+        ids = array('q')
+        for start in range(0, len(rows), self.batch_size):
+            with transaction.atomic():
+                created = model.objects.bulk_create(rows[start:start + self.batch_size])
+            ids.extend(obj.pk for obj in created)
+        self.counts[model] = self.counts.get(model, 0) + len(rows)
+        return ids
+
+    # phases
+
+    def seed_users(self, count, teachers):
+        password = make_password(PASSWORD)
+        self.user_ids = array('q')
+        self.user_joined = []
+        for start in range(0, count, self.batch_size):
+            users = []
+            for index in range(start, min(start + self.batch_size, count)):
+                first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+                users.append(User(
+                    email=f'seed{index}@example.com', username=f'seed{index}', full_name=f'{first} {last} {index}',
+                    first_name=first, last_name=last, password=password, date_joined=self.past(),
+                ))
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                Profile.objects.bulk_create([
+                    Profile(user=user, full_name=user.full_name, country=self.rng.choice(COUNTRIES)) for user in users
+                ])
+            self.user_ids.extend(user.pk for user in users)
+            self.user_joined.extend(user.date_joined for user in users)
+        self.counts[User] = self.counts[Profile] = count
+
+        # the first users are the teachers
+        self.teacher_ids = self.insert_all(api_models.Teacher, [
+            api_models.Teacher(
+                user_id=self.user_ids[index], full_name=f'{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}',
+                bio=self.text(8)[:100], country=self.rng.choice(COUNTRIES),
+            )
+            for index in range(teachers)
+        ])
+
+    def seed_catalog(self, categories, courses, sections, lectures):
+        category_ids = self.insert_all(api_models.Category, [
+            api_models.Category(title=title, slug=f'{slugify(title)}-{index}')
+            for index, title in enumerate(
+                CATEGORIES[index] if index < len(CATEGORIES) else f'{CATEGORIES[index % len(CATEGORIES)]} {index}'
+                for index in range(categories)
+            )
+        ])
+        category_weights = power_law(categories, 1.0, self.rng)
+        teacher_weights = power_law(len(self.teacher_ids), 1.2, self.rng)
+
+        self.course_ids = array('q')
+        self.course_teacher = array('q')
+        self.course_date = []
+        self.course_lectures = []
+        statuses = [api_models.Course.CourseStatus.PUBLISHED] * 18 + [api_models.Course.CourseStatus.REVIEW, api_models.Course.CourseStatus.DISABLED]
+        for start in range(0, courses, self.batch_size):
+            batch = []
+            for index in range(start, min(start + self.batch_size, courses)):
+                title = self.rng.choice(TITLE_FORMS).format(topic=self.rng.choice(TOPICS))
+                teacher = self.rng.choices(range(len(self.teacher_ids)), cum_weights=teacher_weights)[0]
+                batch.append(api_models.Course(
+                    category_id=category_ids[self.rng.choices(range(categories), cum_weights=category_weights)[0]],
+                    teacher_id=self.teacher_ids[teacher],
+                    title=title,
+                    description=self.text(40),
+                    price=self.rng.choice(PRICES),
+                    language=self.rng.choices(api_models.Course.CourseLanguage.values, weights=[8, 2])[0],
+                    level=self.rng.choice(api_models.Course.CourseLevel.values),
+                    platform_status=self.rng.choice(statuses),
+                    featured=self.rng.random() < 0.05,
+                    course_id=self.short_uuid('course-'),
+                    slug=f'{slugify(title)}-{index}',
+                    date=self.past(),
+                ))
+            with transaction.atomic():
+                api_models.Course.objects.bulk_create(batch)
+            self.course_ids.extend(course.pk for course in batch)
+            self.course_teacher.extend(course.teacher_id for course in batch)
+            self.course_date.extend(course.date for course in batch)
+            self.seed_curriculum(batch, sections, lectures)
+        self.counts[api_models.Course] = courses
+
+    def seed_curriculum(self, courses, sections, lectures):
+        section_rows, lecture_rows = [], []
+        for course in courses:
+            for position in range(self.rng.randint(1, 2 * sections - 1)):
+                section = api_models.Section(course=course, title=f'Part {position + 1}: {self.text(3)}', section_id=self.short_uuid('section-'), date=course.date)
+                section_rows.append(section)
+                for number in range(self.rng.randint(1, 2 * lectures - 1)):
+                    duration = int(self.rng.lognormvariate(6, 0.7))
+                    lecture = api_models.Lecture(
+                        section=section, title=self.text(4), duration=duration,
+                        preview=position == 0 and number == 0, lecture_id=self.short_uuid('lecture-'), date=course.date,
+                    )
+                    lecture.content_duration = lecture.duration_formatted
+                    lecture_rows.append(lecture)
+        self.insert_all(api_models.Section, section_rows)
+        # bulk_create copies the section pks over, reading lecture.section afterwards would query
+        sections = [lecture.section for lecture in lecture_rows]
+        self.insert_all(api_models.Lecture, lecture_rows)
+
+        by_course = {course.pk: array('q') for course in courses}
+        for lecture, section in zip(lecture_rows, sections):
+            by_course[section.course_id].append(lecture.pk)
+        self.course_lectures.extend(by_course[course.pk] for course in courses)
+
+    def seed_activity(self, enrollments):
+        '''Walks the students one by one, so enrollments need no global de-duplication'''
+        rng = self.rng
+        course_weights = power_law(len(self.course_ids), 1.1, rng)
+        students = range(len(self.teacher_ids), len(self.user_ids)) or range(len(self.user_ids))
+        mean = enrollments / len(students)
+        teacher_users = dict(api_models.Teacher.objects.values_list('id', 'user_id'))
+        completed_type, order_type, review_type, question_type = (
+            'Course Enrollment Completed', 'New Order', 'New Review', 'New QandA',
+        )
+
+        for student in students:
+            user_id = self.user_ids[student]
+            # pareto(2) - 1 has mean 1: most students take a course or two, a few take dozens
+            wanted = min(round((rng.paretovariate(2) - 1) * mean), len(self.course_ids))
+            picked = set(rng.choices(range(len(self.course_ids)), cum_weights=course_weights, k=wanted))
+
+            for course in sorted(picked):
+                course_id, teacher_id = self.course_ids[course], self.course_teacher[course]
+                lectures = self.course_lectures[course]
+                date = self.past(after=max(self.course_date[course], self.user_joined[student]))
+                # many stop early, some finish
+                done = len(lectures) if rng.random() < 0.15 else int(len(lectures) * rng.betavariate(0.7, 1.5))
+                self.add(api_models.EnrolledCourse(
+                    user_id=user_id, course_id=course_id, teacher_id=teacher_id, enrollment_id=self.short_uuid('enrol-'), date=date,
+                    completed_lectures=done, total_lectures=len(lectures),
+                    progress=done * 100 // len(lectures) if lectures else 0,
+                    last_lecture_id=lectures[done - 1] if done else None,
+                ))
+                self.add(api_models.Notification(teacher_id=teacher_id, type=order_type, seen=rng.random() < 0.6, date=date))
+                for lecture_id in lectures[:done]:
+                    self.add(api_models.CompletedLecture(user_id=user_id, course_id=course_id, lesson_id=lecture_id, date=date))
+                if lectures and done == len(lectures):
+                    self.add(api_models.Notification(user_id=user_id, type=completed_type, seen=rng.random() < 0.8, date=date))
+
+                if rng.random() < self.options['review_rate']:
+                    self.add(api_models.Review(
+                        user_id=user_id, course_id=course_id, review=self.text(rng.randint(3, 30)),
+                        rating=str(rng.choices(RATINGS, weights=RATING_WEIGHTS)[0]), active=rng.random() < 0.9, date=date,
+                    ))
+                    self.add(api_models.Notification(teacher_id=teacher_id, type=review_type, date=date))
+                if rng.random() < self.options['note_rate']:
+                    for _ in range(rng.randint(1, 5)):
+                        self.add(api_models.Note(user_id=user_id, course_id=course_id, title=self.text(3)[:100], note=self.text(25), note_id=self.short_uuid('note-'), date=date))
+                if rng.random() < self.options['question_rate']:
+                    question = api_models.QuestionAnswer(user_id=user_id, course_id=course_id, title=self.text(8), qa_id=self.short_uuid('qa-'), date=date)
+                    self.add(question)
+                    self.add(api_models.Notification(teacher_id=teacher_id, type=question_type, date=date))
+                    for reply in range(int(rng.expovariate(0.5))):
+                        author = teacher_users.get(teacher_id) if reply == 0 else self.user_ids[rng.choice(students)]
+                        self.add(api_models.QuestionAnswerResponse(
+                            course_id=course_id, question=question, user_id=author, message=self.text(15), qam_id=self.short_uuid('qam-'), date=date,
+                        ))
+        self.flush()
@@ -0,0 +1,192 @@
+'''
+Lecture media serving.
+
+Lecture files are only reachable through LectureMediaAPIView, which checks
+access (preview lecture, enrollment, or the course's teacher) and then either
+streams the file itself with HTTP Range support, or hands the transfer to the
+web server with X-Accel-Redirect (nginx) / X-Sendfile (Apache, lighttpd) when
+settings.MEDIA_OFFLOAD asks for it. The web server then does the range
+handling and no worker is held for the duration of the download.
+
+mp4_duration() reads lecture lengths from uploaded files, see api.uploads.
+'''
+import mimetypes
+import os
+import re
+import struct
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from api import models as api_models
+from api.cache import course_access_key
+
+CHUNK_SIZE = 64 * 1024
+ACCESS_TIMEOUT = 5 * 60
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def can_stream(user, lecture, course):
+    '''
+    Preview lectures are public; everything else needs an enrollment or to be
+    the course's teacher. The answer is cached per user and course, and
+    dropped by api.cache.forget_course_access() whenever an enrollment changes.
+    '''
+    if lecture.preview:
+        return True
+    if not user.is_authenticated:
+        return False
+    key = course_access_key(user.id, course.id)
+    allowed = cache.get(key)
+    if allowed is None:
+        allowed = (
+            api_models.Teacher.objects.filter(id=course.teacher_id, user_id=user.id).exists()
+            or api_models.EnrolledCourse.objects.filter(user_id=user.id, course_id=course.id).exists()
+        )
+        cache.set(key, allowed, ACCESS_TIMEOUT)
+    return allowed
+
+
+def protected_media(request, *args, **kwargs):
+    '''Stands in front of the public media route so lecture files cannot be fetched directly'''
+    raise Http404('Lecture media is served through the lecture media endpoint')
+
+
+def parse_range(header, size):
+    '''
+    Returns (start, end) inclusive for a single satisfiable byte range, None
+    when the header should be ignored (absent, malformed or multi-range) and
+    raises ValueError when the range cannot be satisfied.
+    '''
+    match = RANGE_RE.match(header.replace(' ', '')) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if size == 0:
+        raise ValueError('empty file')
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError('empty suffix range')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError('range outside the file')
+    return start, end
+
+
+def _if_range_matches(header, etag, mtime):
+    if not header:
+        return True
+    if header.startswith(('"', 'W/')):
+        # weak validators never allow a partial response
+        return header == etag
+    date = parse_http_date_safe(header)
+    return date is not None and date == int(mtime)
+
+
+def _read(path, start, length):
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, field_file):
+    path = field_file.path
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404('Lecture file is missing')
+    size = stat.st_size
+    etag = quote_etag(f'{int(stat.st_mtime)}-{size}')
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    offload = getattr(settings, 'MEDIA_OFFLOAD', '')
+    if offload:
+        response = HttpResponse(content_type=content_type)
+        if offload == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + quote(field_file.name)
+        else:
+            response['X-Sendfile'] = path
+    else:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range and not _if_range_matches(request.META.get('HTTP_IF_RANGE'), etag, stat.st_mtime):
+            byte_range = None
+
+        start, end = byte_range or (0, size - 1)
+        length = max(end - start + 1, 0)
+        response = StreamingHttpResponse(_read(path, start, length), content_type=content_type, status=206 if byte_range else 200)
+        response['Content-Length'] = str(length)
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+
+def _boxes(handle, start, end):
+    '''Yields (type, payload_start, box_end) for the ISO-BMFF boxes between two offsets'''
+    offset = start
+    while offset + 8 <= end:
+        handle.seek(offset)
+        header = handle.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        payload = offset + 8
+        if size == 1:
+            largesize = handle.read(8)
+            if len(largesize) < 8:
+                return
+            size = struct.unpack('>Q', largesize)[0]
+            payload += 8
+        elif size == 0:
+            size = end - offset
+        if size < payload - offset:
+            return
+        yield kind, payload, min(offset + size, end)
+        offset += size
+
+
+def mp4_duration(path):
+    '''
+    Reads the duration in seconds from the movie header (moov/mvhd) of an MP4
+    or QuickTime file without decoding any media. Only box headers are read,
+    so a multi-GB mdat before the moov costs one seek. Returns None when the
+    file has no movie header.
+    '''
+    with open(path, 'rb') as handle:
+        size = os.fstat(handle.fileno()).st_size
+        for kind, start, end in _boxes(handle, 0, size):
+            if kind != b'moov':
+                continue
+            for inner, payload, _ in _boxes(handle, start, end):
+                if inner != b'mvhd':
+                    continue
+                handle.seek(payload)
+                version = handle.read(4)[:1]
+                if version == b'\x01':
+                    timescale, duration = struct.unpack('>IQ', handle.read(28)[16:28])
+                else:
+                    timescale, duration = struct.unpack('>II', handle.read(16)[8:16])
+                return duration / timescale if timescale else None
+    return None
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='country',
+            options={'verbose_name_plural': 'Countries'},
+        ),
+        migrations.RemoveField(
+            model_name='course',
+            name='file',
+        ),
+        migrations.RemoveField(
+            model_name='teacher',
+            name='about',
+        ),
+        migrations.AlterField(
+            model_name='cartorderitem',
+            name='cart',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_items', to='api.cart'),
+        ),
+        migrations.AlterField(
+            model_name='course',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='course',
+            name='description',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='course',
+            name='language',
+            field=models.CharField(choices=[('EN', 'English'), ('HI', 'Hindi')], default='EN', max_length=2),
+        ),
+        migrations.AlterField(
+            model_name='course',
+            name='level',
+            field=models.CharField(choices=[('BEG', 'Beginner'), ('INT', 'Intermediate'), ('Adv', 'Advanced')], default='BEG', max_length=3),
+        ),
+        migrations.AlterField(
+            model_name='course',
+            name='platform_status',
+            field=models.CharField(choices=[('Review', 'Review'), ('Disabled', 'Disabled'), ('Published', 'Published'), ('Rejected', 'Rejected')], default='Published', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='course',
+            name='title',
+            field=models.CharField(max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='teacher',
+            name='image',
+            field=models.FileField(blank=True, default='default.jpg', null=True, upload_to='teachers/'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_course_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['title', 'id'], name='category_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['platform_status', 'date', 'id'], name='course_status_date_id_idx'),
+        ),
+    ]
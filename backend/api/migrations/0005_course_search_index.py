@@ -0,0 +1,67 @@
+from django.db import migrations
+
+# The DDL and the initial fill are frozen here rather than imported from
+# api.search, so later changes to the runtime module can't alter this migration.
+SQLITE_CREATE = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS api_course_search '
+    "USING fts5(title, description, lectures, category, teacher, tokenize='porter unicode61')"
+)
+SQLITE_FILL = (
+    'INSERT INTO api_course_search (rowid, title, description, lectures, category, teacher) '
+    "SELECT c.id, c.title, c.description, coalesce((SELECT group_concat(l.title, ' ') FROM api_lecture l "
+    "INNER JOIN api_section s ON s.id = l.section_id WHERE s.course_id = c.id), ''), "
+    "coalesce(cat.title, ''), coalesce(t.full_name, '') "
+    'FROM api_course c '
+    'LEFT OUTER JOIN api_category cat ON cat.id = c.category_id '
+    'LEFT OUTER JOIN api_teacher t ON t.id = c.teacher_id'
+)
+SQLITE_DROP = 'DROP TABLE IF EXISTS api_course_search'
+
+POSTGRESQL_CREATE = (
+    'ALTER TABLE api_course ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    'CREATE INDEX IF NOT EXISTS course_search_vector_idx ON api_course USING GIN (search_vector)',
+)
+POSTGRESQL_FILL = (
+    'UPDATE api_course c SET search_vector = '
+    "setweight(to_tsvector('english', coalesce(c.title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce((SELECT string_agg(l.title, ' ') FROM api_lecture l "
+    "INNER JOIN api_section s ON s.id = l.section_id WHERE s.course_id = c.id), '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce((SELECT cat.title FROM api_category cat WHERE cat.id = c.category_id), '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce((SELECT t.full_name FROM api_teacher t WHERE t.id = c.teacher_id), '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(c.description, '')), 'C')"
+)
+POSTGRESQL_DROP = (
+    'DROP INDEX IF EXISTS course_search_vector_idx',
+    'ALTER TABLE api_course DROP COLUMN IF EXISTS search_vector',
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_CREATE)
+        schema_editor.execute(SQLITE_FILL)
+    elif vendor == 'postgresql':
+        for sql in POSTGRESQL_CREATE:
+            schema_editor.execute(sql)
+        schema_editor.execute(POSTGRESQL_FILL)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_DROP)
+    elif vendor == 'postgresql':
+        for sql in POSTGRESQL_DROP:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
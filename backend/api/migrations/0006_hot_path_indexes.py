@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_course_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='completedlecture',
+            index=models.Index(fields=['user', 'course'], name='completed_user_course_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='enrolledcourse',
+            index=models.Index(fields=['user', 'course'], name='enrolled_user_course_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'seen', 'date'], name='notification_user_seen_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionanswer',
+            index=models.Index(fields=['course', 'date'], name='qa_course_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionanswerresponse',
+            index=models.Index(fields=['question', 'date'], name='qa_response_question_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['course', 'active', 'date'], name='review_course_active_idx'),
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:14
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+def drop_duplicate_enrollments(apps, schema_editor):
+    '''Keeps the oldest enrollment of each (user, course), as the unique constraint below requires'''
+    EnrolledCourse = apps.get_model('api', 'EnrolledCourse')
+    first = EnrolledCourse.objects.filter(user__isnull=False).values('user', 'course').annotate(first=models.Min('id')).values('first')
+    EnrolledCourse.objects.filter(user__isnull=False).exclude(id__in=first).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sub_total', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('tax_fee', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('total', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('initial_total', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('saved', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('payment_status', models.CharField(choices=[('Paid', 'Paid'), ('Processing', 'Processing'), ('Failed', 'Failed')], default='Processing', max_length=100)),
+                ('full_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('country', models.CharField(blank=True, max_length=50, null=True)),
+                ('stripe_session_id', models.CharField(blank=True, max_length=1000, null=True)),
+                ('cart_order_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='enrolledcourse',
+            name='enrolled_user_course_idx',
+        ),
+        migrations.AddField(
+            model_name='cartorderitem',
+            name='initial_total',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cartorderitem',
+            name='saved',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cartorderitem',
+            name='tax_fee',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cartorderitem',
+            name='teacher',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.teacher'),
+        ),
+        migrations.AddField(
+            model_name='cartorderitem',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='cartorderitem',
+            name='cart',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cart_items', to='api.cart'),
+        ),
+        migrations.RunPython(drop_duplicate_enrollments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='enrolledcourse',
+            constraint=models.UniqueConstraint(fields=('user', 'course'), name='enrolled_unique_user_course'),
+        ),
+        migrations.AddField(
+            model_name='cartorder',
+            name='coupons',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.coupon'),
+        ),
+        migrations.AddField(
+            model_name='cartorder',
+            name='student',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='cartorder',
+            name='teachers',
+            field=models.ManyToManyField(blank=True, to='api.teacher'),
+        ),
+        migrations.AddField(
+            model_name='cartorderitem',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='orderitem', to='api.cartorder'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.cartorder'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def drop_duplicate_completions(apps, schema_editor):
+    '''Keeps the oldest completion of each (user, lesson), as the unique constraint below requires'''
+    CompletedLecture = apps.get_model('api', 'CompletedLecture')
+    first = CompletedLecture.objects.filter(user__isnull=False).values('user', 'lesson').annotate(first=models.Min('id')).values('first')
+    CompletedLecture.objects.filter(user__isnull=False).exclude(id__in=first).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_checkout'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enrolledcourse',
+            name='completed_lectures',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='enrolledcourse',
+            name='last_lecture',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.lecture'),
+        ),
+        migrations.AddField(
+            model_name='enrolledcourse',
+            name='progress',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='enrolledcourse',
+            name='total_lectures',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(drop_duplicate_completions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='completedlecture',
+            constraint=models.UniqueConstraint(fields=('user', 'lesson'), name='completed_unique_user_lesson'),
+        ),
+    ]
@@ -1,9 +1,19 @@
-from django.db import models
+from collections import Counter, defaultdict
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Least
+from django.db.models.lookups import GreaterThan
+from django.db.models.signals import m2m_changed, pre_save, post_save, pre_delete, post_delete
 from usersauth.models import User, Profile
 from django.utils.text import slugify
 from shortuuid.django_fields import ShortUUIDField
 from django.utils import timezone
 import uuid
+from api import notifications, search
+from api.cache import (
+    CATALOG_VERSION, COUNTRIES_VERSION, COUPONS_VERSION, PRICES_VERSION, SHARED_VERSION,
+    bump_versions, cart_version, course_version, forget_course_access,
+)
+from core import writer
 
 RATING = (
     (1, '1 Star'),
@@ -28,21 +38,111 @@ PAYMENT_STATUS = (
     ('Failed', 'Failed')
 )
 
-class Teacher(models.Model):
+class CounterFieldsMixin:
+    '''
+    Models with denormalized counters. The counters are only ever changed with
+    F() updates, so a regular save() of a stale instance must not write them back.
+    '''
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+class StatsTrackingMixin:
+    '''
+    Models whose writes feed counters on other models. Remembers the values the
+    counters were computed from, and runs save() and the post_save counter
+    update in one transaction.
+    '''
+    stats_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(field in instance.__dict__ for field in cls.stats_fields):
+            instance._stats_state = instance.stats_state()
+        return instance
+
+    def stats_state(self):
+        return {field: getattr(self, field) for field in self.stats_fields}
+
+    def save(self, *args, **kwargs):
+        self._stats_old_state = None
+        if not self._state.adding:
+            self._stats_old_state = getattr(self, '_stats_state', None) or (
+                type(self)._base_manager.filter(pk=self.pk).values(*self.stats_fields).first()
+            )
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._stats_state = self.stats_state()
+
+class CategoryQuerySet(models.QuerySet):
+
+    def for_catalog(self):
+        return self.filter(active=True)
+
+class CourseQuerySet(models.QuerySet):
+
+    def published(self):
+        return self.filter(platform_status=Course.CourseStatus.PUBLISHED)
+
+    def for_listing(self, columns):
+        '''
+        Published courses loading only the given columns. Related columns such as
+        'category__title' are joined in, everything else (description, ...) is deferred.
+        '''
+        columns = set(columns) | {'date'}
+        related = {column.split('__')[0] for column in columns if '__' in column}
+        return self.published().select_related(*related).only(*(columns | related))
+
+    def for_catalog(self):
+        '''
+        Published courses with everything CourseSerializer reads loaded up front.
+        The number of queries stays the same no matter how many courses,
+        enrollments, lectures or reviews are fetched.
+        '''
+        questions = QuestionAnswer.objects.select_related('user__profile').prefetch_related(
+            models.Prefetch('questionanswerresponse_set', queryset=QuestionAnswerResponse.objects.select_related('user__profile')),
+        )
+        return self.published().select_related(
+            'category', 'teacher__user',
+        ).prefetch_related(
+            'teacher__user__groups',
+            'teacher__user__user_permissions',
+            'sections__Lectures',
+            'enrolledcourse_set',
+            'completedlecture_set',
+            'note_set',
+            models.Prefetch('review_set', queryset=Review.objects.select_related('user__profile')),
+            models.Prefetch('questionanswer_set', queryset=questions),
+        )
+
+class Teacher(CounterFieldsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    image = models.FileField(upload_to='/teachers', blank=True, null=True, default='default.jpg')
+    image = models.FileField(upload_to='teachers/', blank=True, null=True, default='default.jpg')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     full_name = models.CharField(max_length=50)
     bio = models.CharField(max_length=100, blank=True, null=True)
     twitter = models.URLField(null=True, blank=True)
     linkedin = models.URLField(null=True, blank=True)
     country = models.CharField(max_length=60, null=True, blank=True)
+    total_courses = models.PositiveIntegerField(default=0, editable=False)
+    total_reviews = models.PositiveIntegerField(default=0, editable=False)
+    total_students = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('total_courses', 'total_reviews', 'total_students')
 
     def __str__(self):
         return self.full_name
     
     def students(self):
-        '''Returns all students that have been enrolled with courses of this teacher'''
-        pass
+        '''Returns count of distinct students enrolled with courses of this teacher, as of the last analytics rollup'''
+        return self.teacherdailystats_set.aggregate(students=Coalesce(models.Sum('students'), 0))['students']
 
     def courses(self):
         '''Returns all courses created by a particular teacher'''
@@ -50,24 +150,33 @@ class Teacher(models.Model):
     
     def review(self):
         '''Returns count of reviews made on courses by this teacher'''
-        return Course.objects.filter(teacher=self).count()
+        return self.total_reviews
 
-class Category(models.Model):
+class Category(CounterFieldsMixin, models.Model):
     title = models.CharField(max_length=100)
     image = models.FileField(upload_to='course-file', default='category.jpg', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     active = models.BooleanField(default=True)
     slug = models.SlugField(unique=True, null=True, blank=True)
+    total_courses = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('total_courses',)
+
+    objects = CategoryQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = 'Categories'
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['title', 'id'], name='category_title_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
     
     def course_count(self):
         '''Returns count of courses in this category'''
-        return Course.objects.filter(category=self).count()
+        return self.total_courses
     
     def save(self, *args, **kwargs):
         if self.slug == '' or self.slug == None:
@@ -75,7 +184,7 @@ class Category(models.Model):
 
         super(Category, self).save(*args, **kwargs)
 
-class Course(models.Model):
+class Course(StatsTrackingMixin, CounterFieldsMixin, models.Model):
     class CourseLanguage(models.TextChoices):
         ENGLISH = 'EN', 'English'
         HINDI = 'HI', 'Hindi'
@@ -94,6 +203,7 @@ class Course(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, blank=True, null=True)
     image = models.FileField(upload_to='course-thumbnail/', blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     title = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=12, decimal_places=2, default=0.00, blank=True, null=True)
@@ -104,6 +214,21 @@ class Course(models.Model):
     course_id = ShortUUIDField(unique=True, prefix='course-', max_length=50, alphabet="abcdefgh12345")
     slug = models.SlugField(unique=True, null=True, blank=True)
     date = models.DateTimeField(default=timezone.now)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    total_reviews = models.PositiveIntegerField(default=0, editable=False)
+    total_students = models.PositiveIntegerField(default=0, editable=False)
+    total_lectures = models.PositiveIntegerField(default=0, editable=False)
+    total_duration = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CourseQuerySet.as_manager()
+
+    stats_fields = ('category_id', 'teacher_id')
+    counter_fields = ('rating_sum', 'total_reviews', 'total_students', 'total_lectures', 'total_duration')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['platform_status', 'date', 'id'], name='course_status_date_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -113,29 +238,49 @@ class Course(models.Model):
             self.slug = slugify(self.title)
         super(Course, self).save(*args, **kwargs)
 
+    def _is_prefetched(self, name):
+        return name in getattr(self, '_prefetched_objects_cache', {})
+
+    def _prefetched_by_user(self, name):
+        '''Groups a prefetched relation of this course by user_id, built once per instance'''
+        if not self._is_prefetched(name):
+            return None
+        grouped = self.__dict__.setdefault('_grouped_by_user', {})
+        if name not in grouped:
+            rows = defaultdict(list)
+            for obj in getattr(self, name).all():
+                rows[obj.user_id].append(obj)
+            grouped[name] = rows
+        return grouped[name]
+
     def students(self):
         '''Returns students enrolled in this course'''
-        return EnrolledCourse.objects.filter(course=self)
+        return self.enrolledcourse_set.all()
     
     def curriculum(self):
         '''Returns curriculum of the course. This includes all sections of this course'''
-        return Section.objects.filter(course=self)
+        return self.sections.all()
     
     def lectures(self):
         '''Returns all lectures associated with this course'''
+        if self._is_prefetched('sections'):
+            return [lecture for section in self.sections.all() for lecture in section.Lectures.all()]
         return Lecture.objects.filter(section__course=self)
     
     def average_rating(self):
         '''Returns average rating students gave to this course'''
-        average_rating = Review.objects.filter(course=self, active=True).aggregate(avg_rating=models.Avg('rating'))
-        return average_rating['avg_rating']
+        if not self.total_reviews:
+            return None
+        return self.rating_sum / self.total_reviews
     
     def rating_count(self):
         '''Returns total ratings made on this course'''
-        return Review.objects.filter(course=self, active=True).count()
+        return self.total_reviews
     
     def reviews(self):
         '''Returns all reviews made on this course'''
+        if self._is_prefetched('review_set'):
+            return [review for review in self.review_set.all() if review.active]
         return Review.objects.filter(course=self, active=True)
 
 class Section(models.Model):
@@ -150,9 +295,9 @@ class Section(models.Model):
     
     def lectures(self):
         '''Returns lectures associated with this Section of the course'''
-        return Lecture.objects.filter(section=self)
+        return self.Lectures.all()
 
-class Lecture(models.Model):
+class Lecture(StatsTrackingMixin, models.Model):
     """Represents individual lessons/content within a course section"""
     section = models.ForeignKey(Section, on_delete=models.CASCADE, related_name='Lectures')
     title = models.CharField(max_length=100)
@@ -164,17 +309,79 @@ class Lecture(models.Model):
     lecture_id = ShortUUIDField(unique=True, max_length=50, prefix='lecture-', alphabet='12345abcdefgh')
     date = models.DateField(default=timezone.now, null=True, blank=True)
 
+    stats_fields = ('section_id', 'duration')
+
     def __str__(self):
         return self.section + self.title
     
     @property
     def duration_formatted(self):
         """Return duration in HH:MM:SS format"""
-        hours = self.duration_seconds // 3600
-        minutes = (self.duration_seconds % 3600) // 60
-        seconds = self.duration_seconds % 60
+        hours = self.duration // 3600
+        minutes = (self.duration % 3600) // 60
+        seconds = self.duration % 60
         return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
     
+class LectureUpload(models.Model):
+    """A resumable upload of a lecture file, sent in fixed-size chunks (see api.uploads)"""
+    class Status(models.TextChoices):
+        UPLOADING = 'uploading', 'Uploading'
+        COMPLETE = 'complete', 'Complete'
+
+    lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE, related_name='uploads')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    upload_id = ShortUUIDField(unique=True, max_length=50, prefix='upload-', alphabet='abcdefgh12345')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.UPLOADING)
+    created_at = models.DateTimeField(default=timezone.now)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.upload_id
+
+    def total_chunks(self):
+        return max(-(-self.size // self.chunk_size), 1)
+
+    def chunk_length(self, index):
+        '''Bytes chunk number index must carry, the last chunk is the remainder'''
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def received_chunks(self):
+        return list(self.chunks.order_by('index').values_list('index', flat=True))
+
+class LectureUploadChunk(models.Model):
+    upload = models.ForeignKey(LectureUpload, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=64)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['upload', 'index'], name='upload_chunk_unique_index'),
+        ]
+
+    def __str__(self):
+        return f'{self.upload_id} #{self.index}'
+
+class QuestionAnswerQuerySet(models.QuerySet):
+
+    def threads(self):
+        '''
+        Questions with the asker's profile, the number of replies and the latest
+        reply with its author's profile. Two queries for any number of threads
+        and replies.
+        '''
+        replies = QuestionAnswerResponse.objects.filter(question=models.OuterRef('pk')).order_by().values('question')
+        return self.select_related('user__profile').annotate(
+            reply_count=Coalesce(models.Subquery(replies.annotate(count=models.Count('id')).values('count')), 0),
+        ).prefetch_related(models.Prefetch(
+            'questionanswerresponse_set',
+            queryset=QuestionAnswerResponse.objects.select_related('user__profile').order_by('-date', '-id')[:1],
+            to_attr='latest_replies',
+        ))
+
 class QuestionAnswer(models.Model):
     course = models.ForeignKey(to=Course, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -182,17 +389,28 @@ class QuestionAnswer(models.Model):
     qa_id = ShortUUIDField(unique=True, prefix='qa-',max_length=50, alphabet='abcdefgh12345')
     date = models.DateTimeField(default=timezone.now, null=True, blank=True)
 
+    objects = QuestionAnswerQuerySet.as_manager()
+
     def __str__(self):
         return self.course.title + self.user.full_name
     
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['course', 'date'], name='qa_course_date_idx'),
+        ]
 
     def messages(self):
-        return QuestionAnswerResponse.objects.filter(question=self)
+        return self.questionanswerresponse_set.all()
+
+    def latest_reply(self):
+        '''The newest reply, as loaded by QuestionAnswerQuerySet.threads() when it was used'''
+        if hasattr(self, 'latest_replies'):
+            return self.latest_replies[0] if self.latest_replies else None
+        return self.questionanswerresponse_set.select_related('user__profile').order_by('-date', '-id').first()
     
     def profile(self):
-        return Profile.objects.get(user=self.user)
+        return self.user.profile if self.user else None
 
 class QuestionAnswerResponse(models.Model):
     course = models.ForeignKey(to=Course, on_delete=models.CASCADE)
@@ -207,9 +425,12 @@ class QuestionAnswerResponse(models.Model):
     
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['question', 'date'], name='qa_response_question_date_idx'),
+        ]
     
     def profile(self):
-        return Profile.objects.get(user=self.user)
+        return self.user.profile if self.user else None
 
 class Coupon(models.Model):
     teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE)
@@ -234,63 +455,64 @@ class Cart(models.Model):
 
     def total_cart_items(self):
         '''Returns count of items in the cart'''
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('cart_items')
+        if prefetched is not None:
+            return len(prefetched)
         return CartOrderItem.objects.filter(cart=self).count()
 
     def __str__(self):
         return f"{self.user.full_name}'s Cart"
 
-# class CartOrder(models.Model):
-#     student = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
-#     teachers = models.ManyToManyField(Teacher, blank=True)
-#     sub_total = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
-#     tax_fee = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
-#     total = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
-#     initial_total = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
-#     saved = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
-#     payment_status = models.CharField(choices=PAYMENT_STATUS, default='Processing')
-#     full_name = models.CharField(max_length=100, null=True, blank=True)
-#     email = models.EmailField(null=True, blank=True)
-#     country = models.CharField(max_length=50, null=True, blank=True)
-#     coupons = models.ForeignKey(Coupon, on_delete=models.CASCADE, null=True, blank=True)
-#     stripe_session_id = models.CharField(max_length=1000,null=True, blank=True)
-#     cart_order_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
-#     date = models.DateTimeField(default=timezone.now)
-
-#     class Meta:
-#         ordering = ['-date']
-
-#     def order_items(self):
-#         '''Return all items ordered under this order'''
-#         return CartOrderItem.objects.filter(order=self)
-
-#     def __str__(self):
-#         return self.oid
+class CartOrder(models.Model):
+    student = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    teachers = models.ManyToManyField(Teacher, blank=True)
+    sub_total = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
+    tax_fee = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
+    total = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
+    initial_total = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
+    saved = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
+    payment_status = models.CharField(max_length=100, choices=PAYMENT_STATUS, default='Processing')
+    full_name = models.CharField(max_length=100, null=True, blank=True)
+    email = models.EmailField(null=True, blank=True)
+    country = models.CharField(max_length=50, null=True, blank=True)
+    coupons = models.ForeignKey(Coupon, on_delete=models.SET_NULL, null=True, blank=True)
+    stripe_session_id = models.CharField(max_length=1000,null=True, blank=True)
+    cart_order_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-date']
+
+    def order_items(self):
+        '''Return all items ordered under this order'''
+        return self.orderitem.all()
+
+    def __str__(self):
+        return str(self.cart_order_id)
 
 class CartOrderItem(models.Model):
-    cart = models.ForeignKey(to=Cart, on_delete=models.CASCADE, related_name='cart_items')
+    '''
+    A course in a cart. Checkout moves the row from the cart to its order and
+    snapshots the price, so the same row is the cart line and the order line.
+    '''
+    cart = models.ForeignKey(to=Cart, on_delete=models.CASCADE, related_name='cart_items', null=True, blank=True)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     added_at = models.DateTimeField(default=timezone.now, null=True, blank=True)
+    order = models.ForeignKey(CartOrder, on_delete=models.CASCADE, related_name='orderitem', null=True, blank=True)
+    teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, blank=True)
+    tax_fee = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
+    total = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
+    initial_total = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
+    saved = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
 
     class Meta:
         unique_together = ('cart', 'course')
         ordering = ['-added_at']
-    # order = models.ForeignKey(CartOrder, on_delete=models.CASCADE, related_name='orderitem', null=True, blank=True)
-    # course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='order_item', null=True, blank=True)
-    # teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, null=True, blank=True)
-    # tax_fee = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
-    # total = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
-    # initial_total = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
-    # saved = models.DecimalField(max_digits=12, default=0.00, decimal_places=2)
     # coupons = models.ForeignKey(Coupon, on_delete=models.SET_NULL, null=True)
     # applied_coupon = models.BooleanField(default=False)
-    # order_item_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
-    # date = models.DateTimeField(default=timezone.now)        
 
-    # def order_id(self):
-        # return f"Order ID #{self.order.oid}"
-    
-    # def payment_status(self):
-        # return self.order.payment_status
+    def payment_status(self):
+        return self.order.payment_status if self.order_id else None
     
     def __str__(self):
         return self.course.title
@@ -305,48 +527,124 @@ class Certificate(models.Model):
     def __str__(self):
         return self.course.title
     
-class CompletedLecture(models.Model):
+class CompletedLecture(StatsTrackingMixin, models.Model):
     user = models.ForeignKey(to=User, on_delete=models.SET_NULL, null=True)
     course = models.ForeignKey(to=Course, on_delete=models.CASCADE)
     lesson = models.ForeignKey(to=Lecture, on_delete=models.CASCADE)
     date = models.DateTimeField(default=timezone.now, null=True, blank=True)
 
+    stats_fields = ('user_id', 'course_id', 'lesson_id')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'course'], name='completed_user_course_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'lesson'], name='completed_unique_user_lesson'),
+        ]
+
     def __str__(self):
         return self.course.title
 
-class EnrolledCourse(models.Model):
+class EnrolledCourse(StatsTrackingMixin, CounterFieldsMixin, models.Model):
     user = models.ForeignKey(to=User, on_delete=models.SET_NULL, null=True)
     course = models.ForeignKey(to=Course, on_delete=models.CASCADE)
     teacher = models.ForeignKey(to=Teacher, on_delete=models.SET_NULL, null=True)
     order_id = models.ForeignKey(to=CartOrderItem, on_delete=models.CASCADE, null=True)
     enrollment_id = ShortUUIDField(unique=True, prefix='enrol-', max_length=50, alphabet='abcdefgh12345')
     date = models.DateTimeField(default=timezone.now, null=True, blank=True)
+    completed_lectures = models.PositiveIntegerField(default=0, editable=False)
+    total_lectures = models.PositiveIntegerField(default=0, editable=False)
+    progress = models.PositiveSmallIntegerField(default=0, editable=False)
+    last_lecture = models.ForeignKey(to=Lecture, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+
+    stats_fields = ('user_id', 'course_id')
+    counter_fields = ('completed_lectures', 'total_lectures', 'progress', 'last_lecture')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'course'], name='enrolled_unique_user_course'),
+        ]
 
     def __str__(self):
         return self.course.title
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.course_id and not self.total_lectures:
+            self.total_lectures = Course.objects.filter(id=self.course_id).values_list('total_lectures', flat=True).first() or 0
+        super(EnrolledCourse, self).save(*args, **kwargs)
+
     def lectures(self):
         '''Returns lectures associated with enrolled course'''
-        return Lecture.objects.filter(course=self.course)
+        return self.course.lectures()
+
+    def mark_completed(self, lecture_ids):
+        '''
+        Marks lectures of this course as completed in one INSERT, skipping ones
+        already completed, then recounts the stored progress. Repeating a
+        completion writes nothing. Returns the ids of the lectures that belong
+        to the course.
+        '''
+        valid = set(Lecture.objects.filter(id__in=lecture_ids, section__course_id=self.course_id).values_list('id', flat=True))
+        lecture_ids = list(dict.fromkeys(lecture_id for lecture_id in lecture_ids if lecture_id in valid))
+        if not lecture_ids:
+            return []
+
+        if not writer.run(self._save_completions, lecture_ids):
+            return lecture_ids
+        bump_versions(*[course_version(slug) for slug in Course.objects.filter(id=self.course_id).values_list('slug', flat=True) if slug])
+        self.refresh_from_db(fields=self.counter_fields)
+        return lecture_ids
     
+    def _save_completions(self, lecture_ids):
+        completed = Coalesce(models.Subquery(
+            CompletedLecture.objects.filter(user_id=models.OuterRef('user_id'), course_id=models.OuterRef('course_id'))
+            .order_by().values('course_id').annotate(count=models.Count('id')).values('count')
+        ), 0)
+        with transaction.atomic():
+            done = set(CompletedLecture.objects.filter(user_id=self.user_id, course_id=self.course_id, lesson_id__in=lecture_ids).values_list('lesson_id', flat=True))
+            if done.issuperset(lecture_ids):
+                return False
+            # bulk_create sends no post_save, so the recount below replaces the per-row counter update
+            CompletedLecture.objects.bulk_create([
+                CompletedLecture(user_id=self.user_id, course_id=self.course_id, lesson_id=lecture_id)
+                for lecture_id in lecture_ids if lecture_id not in done
+            ], ignore_conflicts=True)
+            EnrolledCourse.objects.filter(pk=self.pk).update(
+                completed_lectures=completed,
+                progress=_progress(completed, models.F('total_lectures')),
+                last_lecture_id=lecture_ids[-1],
+            )
+        return True
+
     def completed_lesson(self):
         '''Returns lectures completed by user in this enrolled course'''
+        completed = self.course._prefetched_by_user('completedlecture_set')
+        if completed is not None:
+            return completed.get(self.user_id, [])
         return CompletedLecture.objects.filter(course=self.course, user = self.user)
     
     def curriculum(self):
         '''Returns curriculum of enrolled course'''
-        return Section.objects.filter(course=self.course)
+        return self.course.curriculum()
     
     def note(self):
         '''Returns notes associated with this course by the enrolled user'''
+        notes = self.course._prefetched_by_user('note_set')
+        if notes is not None:
+            return notes.get(self.user_id, [])
         return Note.objects.filter(course=self.course, user=self.user)
     
     def question_answer(self):
         '''Returns all Q&A associated with the enrolled course'''
-        return QuestionAnswer.objects.filter(course=self.course)
+        return self.course.questionanswer_set.all()
     
     def review(self):
         '''Returns reviews of user for this course'''
+        reviews = self.course._prefetched_by_user('review_set')
+        if reviews is not None:
+            user_reviews = reviews.get(self.user_id, [])
+            return user_reviews[0] if user_reviews else None
         return Review.objects.filter(course=self.course, user=self.user).first()
     
 class Note(models.Model):
@@ -360,7 +658,7 @@ class Note(models.Model):
     def __str__(self):
         return self.title
     
-class Review(models.Model):
+class Review(StatsTrackingMixin, models.Model):
     user = models.ForeignKey(to=User, on_delete=models.SET_NULL, null=True)
     course = models.ForeignKey(to=Course, on_delete=models.CASCADE, null=True)
     review = models.TextField(max_length=1000)
@@ -369,23 +667,81 @@ class Review(models.Model):
     active = models.BooleanField(default=False)
     date = models.DateTimeField(default=timezone.now, null=True, blank=True)
 
+    stats_fields = ('course_id', 'active', 'rating')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['course', 'active', 'date'], name='review_course_active_idx'),
+        ]
+
     def __str__(self):
         return self.course.title
     
     def profile(self):
         '''Returns profile of user who gave review'''
-        return Profile.objects.get(user=self.user)
+        return self.user.profile if self.user else None
     
+class NotificationQuerySet(models.QuerySet):
+
+    def for_recipient(self, user):
+        '''Notifications addressed to the user, as a student or through their teacher profile'''
+        # a subquery rather than a join, so each side of the OR can use its index
+        return self.filter(models.Q(user=user) | models.Q(teacher__in=Teacher.objects.filter(user=user).values('id')))
+
+    def unseen(self):
+        return self.filter(seen=False)
+
+    def unread_count(self, user):
+        '''The number of unseen notifications for the user, from the cache when possible'''
+        return notifications.unread_count(user.pk, lambda: self.for_recipient(user).unseen().count())
+
+    def fan_out(self, rows):
+        '''
+        Inserts notifications with one bulk INSERT and adds them to their
+        recipients' unread counters once the transaction commits.
+        '''
+        rows = self.bulk_create(rows)
+        teacher_users = dict(
+            Teacher.objects.filter(id__in={row.teacher_id for row in rows if row.teacher_id}).values_list('id', 'user_id')
+        ) if any(row.teacher_id for row in rows) else {}
+        unread = Counter()
+        for row in rows:
+            if not row.seen:
+                # counted once when it reaches the same user both ways, like for_recipient()
+                unread.update({row.user_id, teacher_users.get(row.teacher_id)} - {None})
+        if unread:
+            transaction.on_commit(lambda: notifications.count_new(unread), using=self.db)
+        return rows
+
+    def mark_all_seen(self, user):
+        '''Marks all of the user's notifications seen with one UPDATE, returns how many changed'''
+        updated = self.for_recipient(user).unseen().update(seen=True)
+        transaction.on_commit(lambda: notifications.set_unread(user.pk, 0), using=self.db)
+        return updated
+
 class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, blank=True)
-    # order = models.ForeignKey(CartOrder, on_delete=models.SET_NULL, null=True, blank=True)
+    order = models.ForeignKey(CartOrder, on_delete=models.SET_NULL, null=True, blank=True)
     order_item = models.ForeignKey(CartOrderItem, on_delete=models.SET_NULL, null=True, blank=True)
     review = models.ForeignKey(Review, on_delete=models.SET_NULL, null=True, blank=True)
     type = models.CharField(max_length=50, choices=NOTI_TYPE)
     seen = models.BooleanField(default=False)
     date = models.DateTimeField(default=timezone.now, null=True, blank=True)
 
+    objects = NotificationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'seen', 'date'], name='notification_user_seen_idx'),
+            models.Index(fields=['teacher', 'seen', 'date'], name='notification_teacher_seen_idx'),
+        ]
+
+    def recipient_ids(self):
+        '''Users who see this notification'''
+        teacher_user = Teacher.objects.filter(id=self.teacher_id).values_list('user_id', flat=True).first() if self.teacher_id else None
+        return {self.user_id, teacher_user} - {None}
+
     def __str__(self):
         return self.type
 
@@ -405,4 +761,333 @@ class Country(models.Model):
         verbose_name_plural = 'Countries'
         
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class DailyStats(models.Model):
+    '''
+    One day of activity, written only by `manage.py rollup_analytics`.
+    For a course, students counts enrollments with a user; for a teacher it
+    counts students enrolling with that teacher for the first time, so summing
+    any range of days gives distinct students.
+    '''
+    day = models.DateField()
+    enrollments = models.PositiveIntegerField(default=0)
+    students = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+    reviews = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    completions = models.PositiveIntegerField(default=0)
+
+    metric_fields = (
+        'enrollments', 'students', 'revenue', 'reviews',
+        'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5', 'completions',
+    )
+
+    class Meta:
+        abstract = True
+        ordering = ['day']
+
+class CourseDailyStats(DailyStats):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+
+    class Meta(DailyStats.Meta):
+        verbose_name_plural = 'Course daily stats'
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'day'], name='course_daily_stats_unique_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.course_id} {self.day}'
+
+class TeacherDailyStats(DailyStats):
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE)
+
+    class Meta(DailyStats.Meta):
+        verbose_name_plural = 'Teacher daily stats'
+        constraints = [
+            models.UniqueConstraint(fields=['teacher', 'day'], name='teacher_daily_stats_unique_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.teacher_id} {self.day}'
+
+class RollupWatermark(models.Model):
+    '''Highest source row id already folded into the daily stats'''
+    source = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.source} @ {self.last_id}'
+
+
+def _bump(queryset, **deltas):
+    '''Atomically adds deltas to counter columns of every row in queryset'''
+    deltas = {field: models.F(field) + delta for field, delta in deltas.items() if delta}
+    if deltas:
+        queryset.update(**deltas)
+
+def _apply_review_stats(state, sign):
+    if not state['active'] or not state['course_id']:
+        return
+    _bump(Course.objects.filter(id=state['course_id']), rating_sum=sign * int(state['rating']), total_reviews=sign)
+    _bump(Teacher.objects.filter(course__id=state['course_id']), total_reviews=sign)
+
+def _apply_enrollment_stats(state, sign):
+    if not state['course_id']:
+        return
+    _bump(Course.objects.filter(id=state['course_id']), total_students=sign)
+    # teachers count distinct students: only a student's first enrollment with
+    # the teacher adds one, and only their last one removes it
+    teacher_id = Course.objects.filter(id=state['course_id']).values_list('teacher_id', flat=True).first()
+    if not teacher_id or not state['user_id']:
+        return
+    others = EnrolledCourse.objects.filter(user_id=state['user_id'], course__teacher_id=teacher_id).exclude(course_id=state['course_id'])
+    if not others.exists():
+        _bump(Teacher.objects.filter(id=teacher_id), total_students=sign)
+
+def recount_teacher_students(teacher_ids):
+    '''Recomputes the distinct student count of the given teachers'''
+    students = EnrolledCourse.objects.filter(course__teacher_id=models.OuterRef('id')).order_by().values('course__teacher_id').annotate(
+        count=models.Count('user_id', distinct=True),
+    ).values('count')
+    Teacher.objects.filter(id__in=teacher_ids).update(total_students=Coalesce(models.Subquery(students), 0))
+
+def _progress(completed, total):
+    '''SQL for the whole completion percentage of an enrollment'''
+    return models.Case(
+        models.When(GreaterThan(total, 0), then=Least(completed * 100 / total, 100)),
+        default=models.Value(0),
+    )
+
+def _apply_lecture_stats(state, sign):
+    _bump(Course.objects.filter(sections__id=state['section_id']), total_lectures=sign, total_duration=sign * state['duration'])
+    EnrolledCourse.objects.filter(course__sections__id=state['section_id']).update(
+        total_lectures=models.F('total_lectures') + sign,
+        progress=_progress(models.F('completed_lectures'), models.F('total_lectures') + sign),
+    )
+
+def _apply_completion_stats(state, sign):
+    if not state['user_id'] or not state['course_id']:
+        return
+    changes = {
+        'completed_lectures': models.F('completed_lectures') + sign,
+        'progress': _progress(models.F('completed_lectures') + sign, models.F('total_lectures')),
+    }
+    if sign > 0:
+        changes['last_lecture_id'] = state['lesson_id']
+    EnrolledCourse.objects.filter(user_id=state['user_id'], course_id=state['course_id']).update(**changes)
+
+def _apply_course_stats(state, sign, totals=None):
+    '''
+    Counts the course towards its category and teacher. Reviews only move with
+    the course when its teacher changes, and students are recounted then as
+    they may overlap with the new teacher's; on delete the cascaded reviews
+    and enrollments take care of themselves.
+    '''
+    totals = totals or {}
+    if state['category_id']:
+        _bump(Category.objects.filter(id=state['category_id']), total_courses=sign)
+    if state['teacher_id']:
+        _bump(
+            Teacher.objects.filter(id=state['teacher_id']),
+            total_courses=sign,
+            total_reviews=sign * totals.get('total_reviews', 0),
+        )
+
+STATS_APPLIERS = {
+    Review: _apply_review_stats,
+    EnrolledCourse: _apply_enrollment_stats,
+    Lecture: _apply_lecture_stats,
+    CompletedLecture: _apply_completion_stats,
+}
+
+def update_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_state = None if created else getattr(instance, '_stats_old_state', None)
+    new_state = instance.stats_state()
+    if old_state == new_state:
+        return
+    if sender is Course:
+        totals = None
+        if old_state and old_state['teacher_id'] != new_state['teacher_id']:
+            totals = Course.objects.filter(id=instance.id).values('total_reviews').get()
+        if old_state:
+            _apply_course_stats(old_state, -1, totals)
+        _apply_course_stats(new_state, 1, totals)
+        if totals:
+            recount_teacher_students({old_state['teacher_id'], new_state['teacher_id']} - {None})
+        return
+    if old_state:
+        STATS_APPLIERS[sender](old_state, -1)
+    STATS_APPLIERS[sender](new_state, 1)
+
+def update_stats_on_delete(sender, instance, **kwargs):
+    state = getattr(instance, '_stats_state', None) or instance.stats_state()
+    if sender is Course:
+        _apply_course_stats(state, -1)
+    else:
+        STATS_APPLIERS[sender](state, -1)
+
+
+for sender in (Course, Review, EnrolledCourse, Lecture, CompletedLecture):
+    post_save.connect(update_stats_on_save, sender=sender)
+    post_delete.connect(update_stats_on_delete, sender=sender)
+
+
+# Rows that change what catalog list endpoints render
+LISTING_SENDERS = (Course, Category, Teacher, Review, Lecture, EnrolledCourse)
+# Rows nested inside a course detail response, with the lookup for their course
+COURSE_SENDERS = {
+    Section: lambda instance: {'id': instance.course_id},
+    Lecture: lambda instance: {'sections__id': instance.section_id},
+    Review: lambda instance: {'id': instance.course_id},
+    EnrolledCourse: lambda instance: {'id': instance.course_id},
+    CompletedLecture: lambda instance: {'id': instance.course_id},
+    Note: lambda instance: {'id': instance.course_id},
+    QuestionAnswer: lambda instance: {'id': instance.course_id},
+    QuestionAnswerResponse: lambda instance: {'id': instance.course_id},
+}
+
+def remember_course_slug(sender, instance, raw=False, **kwargs):
+    '''
+    A renamed course must also drop what is cached under its old slug, and a
+    repriced one the cart totals it is part of
+    '''
+    instance._slug_before_save = instance._price_before_save = None
+    if instance.pk and not raw:
+        before = Course.objects.filter(pk=instance.pk).values_list('slug', 'price').first()
+        if before:
+            instance._slug_before_save, instance._price_before_save = before
+
+def bump_response_cache(sender, instance, **kwargs):
+    versions = set()
+    if sender in LISTING_SENDERS:
+        versions.add(CATALOG_VERSION)
+    if sender in (Category, Teacher):
+        versions.add(SHARED_VERSION)
+    if sender is Course:
+        slugs = {instance.slug, getattr(instance, '_slug_before_save', None)}
+        if getattr(instance, '_slug_before_save', None) is not None and instance.price != instance._price_before_save:
+            versions.add(PRICES_VERSION)
+    elif sender in COURSE_SENDERS:
+        slugs = set(Course.objects.filter(**COURSE_SENDERS[sender](instance)).values_list('slug', flat=True))
+    else:
+        slugs = set()
+    versions.update(course_version(slug) for slug in slugs if slug)
+    bump_versions(*versions)
+
+
+def bump_profile_pages(sender, instance, created=False, raw=False, **kwargs):
+    '''Reviews and Q&A embed their authors' profiles in the cached course pages'''
+    if created or raw or not instance.user_id:
+        return
+    authored = models.Q(id__in=Review.objects.filter(user_id=instance.user_id).values('course_id'))
+    for model in (QuestionAnswer, QuestionAnswerResponse):
+        authored |= models.Q(id__in=model.objects.filter(user_id=instance.user_id).values('course_id'))
+    slugs = Course.objects.filter(authored).values_list('slug', flat=True)
+    bump_versions(*[course_version(slug) for slug in slugs if slug])
+
+
+pre_save.connect(remember_course_slug, sender=Course)
+for sender in set(LISTING_SENDERS) | set(COURSE_SENDERS):
+    post_save.connect(bump_response_cache, sender=sender)
+    post_delete.connect(bump_response_cache, sender=sender)
+post_save.connect(bump_profile_pages, sender=Profile)
+
+
+def sync_search_index(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if sender is Course:
+        course_ids = [instance.id]
+    elif sender is Lecture:
+        # a lecture moved to another section leaves its old course's text too
+        section_ids = {instance.section_id, (getattr(instance, '_stats_old_state', None) or {}).get('section_id')}
+        course_ids = Section.objects.filter(id__in=section_ids - {None}).values_list('course_id', flat=True).distinct()
+    elif sender is Category:
+        course_ids = Course.objects.filter(category=instance).values_list('id', flat=True)
+    else:
+        course_ids = Course.objects.filter(teacher=instance).values_list('id', flat=True)
+    search.reindex_courses(course_ids)
+
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_courses([instance.id])
+
+def remember_category_courses(sender, instance, **kwargs):
+    '''Deleting a category nulls its courses' category_id with an update() that sends no signals'''
+    instance._course_ids_before_delete = list(Course.objects.filter(category=instance).values_list('id', flat=True))
+
+def unindex_category(sender, instance, **kwargs):
+    search.reindex_courses(getattr(instance, '_course_ids_before_delete', ()))
+
+
+def forget_lecture_access(sender, instance, **kwargs):
+    forget_course_access([(instance.user_id, instance.course_id)])
+
+post_save.connect(forget_lecture_access, sender=EnrolledCourse)
+post_delete.connect(forget_lecture_access, sender=EnrolledCourse)
+
+
+for sender in (Course, Lecture, Category, Teacher):
+    post_save.connect(sync_search_index, sender=sender)
+post_delete.connect(sync_search_index, sender=Lecture)
+post_delete.connect(remove_from_search_index, sender=Course)
+pre_delete.connect(remember_category_courses, sender=Category)
+post_delete.connect(unindex_category, sender=Category)
+
+
+def notify_teacher(sender, instance, created, raw=False, **kwargs):
+    '''New reviews and questions notify the course's teacher'''
+    if not created or raw:
+        return
+    teacher_id = Course.objects.filter(id=instance.course_id).values_list('teacher_id', flat=True).first()
+    if teacher_id is None:
+        return
+    if sender is Review:
+        rows = [Notification(teacher_id=teacher_id, review=instance, type='New Review')]
+    else:
+        rows = [Notification(teacher_id=teacher_id, type='New QandA')]
+    Notification.objects.fan_out(rows)
+
+def notify_asker(sender, instance, created, raw=False, **kwargs):
+    '''Answers notify whoever asked the question, unless they answered themselves'''
+    if not created or raw:
+        return
+    asker_id = QuestionAnswer.objects.filter(id=instance.question_id).values_list('user_id', flat=True).first()
+    if asker_id is not None and asker_id != instance.user_id:
+        Notification.objects.fan_out([Notification(user_id=asker_id, type='New QandA')])
+
+def forget_unread(sender, instance, **kwargs):
+    '''Notifications saved or deleted one at a time (admin, shell) recount their recipients'''
+    user_ids = instance.recipient_ids()
+    transaction.on_commit(lambda: notifications.forget_unread(user_ids))
+
+post_save.connect(notify_teacher, sender=Review)
+post_save.connect(notify_teacher, sender=QuestionAnswer)
+post_save.connect(notify_asker, sender=QuestionAnswerResponse)
+post_save.connect(forget_unread, sender=Notification)
+post_delete.connect(forget_unread, sender=Notification)
+
+
+def forget_cart_totals(sender, instance, **kwargs):
+    '''Cart totals (see api.pricing) are cached per version of the cart'''
+    if instance.cart_id:
+        bump_versions(cart_version(instance.cart_id))
+
+def bump_pricing(sender, **kwargs):
+    bump_versions(COUNTRIES_VERSION if sender is Country else COUPONS_VERSION)
+
+post_save.connect(forget_cart_totals, sender=CartOrderItem)
+post_delete.connect(forget_cart_totals, sender=CartOrderItem)
+for sender in (Coupon, Country):
+    post_save.connect(bump_pricing, sender=sender)
+    post_delete.connect(bump_pricing, sender=sender)
+# a coupon a student has used no longer applies to their cart
+m2m_changed.connect(bump_pricing, sender=Coupon.used_by.through)
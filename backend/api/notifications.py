@@ -0,0 +1,129 @@
+'''
+Notifications: unread counters and the live stream.
+
+Notifications are inserted in bulk by Notification.objects.fan_out() (checkout,
+new reviews, questions and answers). Each user's unread count lives in the
+cache, so the bell icon never runs a COUNT(*): fan_out() increments the
+counters of the recipients once its transaction commits, mark_all_seen() sets
+them to zero, and notifications saved or deleted one by one drop them, to be
+recounted on the next read. A counter that misses an update (a count racing
+a commit) corrects itself after settings.NOTIFICATION_UNREAD_TIMEOUT.
+
+UnreadStream sends the count as server-sent events, once on connect and then
+whenever it changes, so clients stop polling the notification list. Only
+under ASGI (settings.ASYNC_VIEWS) does a stream stay open, waiting on the
+event loop. A WSGI worker thread would be held for the whole stream, so
+there it sends the count once and asks the client to reconnect after
+settings.NOTIFICATION_WSGI_RETRY seconds.
+'''
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.renderers import BaseRenderer
+
+# a comment line every so often keeps proxies from closing an idle stream
+KEEPALIVE_SECONDS = 15
+
+
+def unread_key(user_id):
+    return f'notifications-unread:{user_id}'
+
+
+def unread_count(user_id, count):
+    '''The cached counter, or count() stored as the counter'''
+    unread = cache.get(unread_key(user_id))
+    if unread is None:
+        unread = count()
+        cache.add(unread_key(user_id), unread, settings.NOTIFICATION_UNREAD_TIMEOUT)
+    return unread
+
+
+def set_unread(user_id, unread):
+    cache.set(unread_key(user_id), unread, settings.NOTIFICATION_UNREAD_TIMEOUT)
+
+
+def count_new(unread):
+    '''Adds {user_id: new notifications} to the counters that are cached'''
+    for user_id, new in unread.items():
+        try:
+            cache.incr(unread_key(user_id), new)
+        except ValueError:
+            # not cached, the next read counts from the database
+            pass
+
+
+def forget_unread(user_ids):
+    cache.delete_many([unread_key(user_id) for user_id in user_ids])
+
+
+def event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+class EventStreamRenderer(BaseRenderer):
+    '''Lets DRF accept `Accept: text/event-stream`; errors go out as one `error` event'''
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return event('error', data)
+
+
+class UnreadStream:
+    '''
+    Server-sent `unread` events for one user for up to `seconds`
+    (settings.NOTIFICATION_STREAM_SECONDS), the client reconnecting `retry`
+    seconds after the end. Async-iterate it under ASGI, where waiting between
+    checks holds no thread.
+    '''
+
+    def __init__(self, unread, seconds=None, retry=None):
+        # returns the user's unread count, see NotificationQuerySet.unread_count
+        self.get_unread = unread
+        self.seconds = settings.NOTIFICATION_STREAM_SECONDS if seconds is None else seconds
+        self.retry = settings.NOTIFICATION_STREAM_POLL if retry is None else retry
+        self.unread = None
+        self.sent_at = 0.0
+
+    def check(self):
+        '''What to send now: the count when it changed, a keepalive when due, else nothing'''
+        unread = self.get_unread()
+        now = time.monotonic()
+        if unread != self.unread:
+            self.unread, self.sent_at = unread, now
+            return event('unread', {'unread': unread})
+        if now - self.sent_at >= KEEPALIVE_SECONDS:
+            self.sent_at = now
+            return ': keepalive\n\n'
+        return ''
+
+    def start(self):
+        # EventSource reconnects after `retry` milliseconds when the stream ends
+        return f'retry: {self.retry * 1000}\n\n'
+
+    def __iter__(self):
+        deadline = time.monotonic() + self.seconds
+        yield self.start()
+        while True:
+            chunk = self.check()
+            if chunk:
+                yield chunk
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(settings.NOTIFICATION_STREAM_POLL)
+
+    async def __aiter__(self):
+        deadline = time.monotonic() + self.seconds
+        yield self.start()
+        while True:
+            chunk = await sync_to_async(self.check)()
+            if chunk:
+                yield chunk
+            if time.monotonic() >= deadline:
+                return
+            await asyncio.sleep(settings.NOTIFICATION_STREAM_POLL)
@@ -0,0 +1,195 @@
+import base64
+import json
+from functools import reduce
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.db import connections, models
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.settings import api_settings
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def approximate_count(model, using='default'):
+    '''
+    Returns the planner's row estimate for the model's table, or None when the
+    database keeps no statistics. Costs one catalog lookup instead of a COUNT(*).
+    '''
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            # sqlite_stat1 only exists once ANALYZE has run
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s ORDER BY idx IS NOT NULL LIMIT 1', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class KeysetPagination(BasePagination):
+    '''
+    Cursor pagination that seeks on the full ordering tuple, e.g. (date, id).
+    Every page is a single indexed range scan with LIMIT page_size + 1, so deep
+    pages cost the same as the first one and no COUNT(*) is ever run.
+
+    Views can override the ordering with a `keyset_ordering` attribute. The last
+    ordering field must be unique. Rows with NULL in a nullable ordering field
+    are left out: a row comparison can neither seek past nor stop at them.
+    '''
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    total_query_param = 'with_total'
+    ordering = ('-date', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset, reverse = self.page_queryset(queryset, request, view)
+        rows = self.build_page(list(queryset), reverse)
+        if self.include_total:
+            self.approximate_total = approximate_count(self.model)
+        return rows
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        '''paginate_queryset() for async views, fetching through the async ORM'''
+        queryset, reverse = self.page_queryset(queryset, request, view)
+        rows = self.build_page([row async for row in queryset], reverse)
+        if self.include_total:
+            self.approximate_total = await sync_to_async(approximate_count)(self.model)
+        return rows
+
+    def page_queryset(self, queryset, request, view):
+        '''Returns the queryset for the requested page, one row over the page size, and its direction'''
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = tuple(getattr(view, 'keyset_ordering', self.ordering))
+        self.model = queryset.model
+        self.include_total = request.query_params.get(self.total_query_param) in ('1', 'true')
+
+        cursor = self.decode_cursor(request)
+        self.cursor = cursor
+        reverse = bool(cursor and cursor['r'])
+        ordering = self.reverse_ordering(self.ordering) if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        nullable = [field.lstrip('-') for field in self.ordering if self.model._meta.get_field(field.lstrip('-')).null]
+        if nullable:
+            queryset = queryset.filter(**{f'{name}__isnull': False for name in nullable})
+        if cursor:
+            try:
+                queryset = queryset.filter(self.keyset_filter(ordering, cursor['v']))
+            except (TypeError, ValueError, ValidationError):
+                # values of the wrong type for their field
+                raise NotFound(self.invalid_cursor_message)
+        return queryset[:self.page_size + 1], reverse
+
+    def build_page(self, rows, reverse):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = self.cursor is not None and (has_more if reverse else True)
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def reverse_ordering(self, ordering):
+        return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+    def keyset_filter(self, ordering, values):
+        '''Builds (a, b, c) > (x, y, z) as a OR of prefix-equal comparisons'''
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = '__lt' if field.startswith('-') else '__gt'
+            equal = {f.lstrip('-'): value for f, value in zip(ordering[:index], values[:index])}
+            conditions.append(models.Q(**equal, **{name + lookup: values[index]}))
+        return reduce(lambda left, right: left | right, conditions)
+
+    def position(self, instance):
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            elif not isinstance(value, (int, str)):
+                value = str(value)
+            values.append(value)
+        return values
+
+    def encode_cursor(self, values, reverse):
+        payload = json.dumps({'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            cursor = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            values = cursor['v']
+            if cursor['r'] not in (0, 1) or not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            if not all(isinstance(value, (int, float, str)) and not isinstance(value, bool) for value in values):
+                raise ValueError
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+        }
+        if self.include_total:
+            response['approximate_total'] = self.approximate_total
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'approximate_total': {'type': 'integer', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,124 @@
+'''
+Cart pricing.
+
+price_cart() returns a cart's subtotal, coupon savings, tax and total.
+Coupons belong to a teacher: a code takes its discount percentage off that
+teacher's courses, once per student (Coupon.used_by). Tax is the country's
+tax_rate percent of the discounted price. Every amount is rounded per cart
+line by line_amounts(), the same way checkout prices its order lines, so the
+cart shows exactly what checkout charges.
+
+The lines are summed by one aggregate query grouped by teacher and price,
+with each group's coupon picked by a subquery. Totals are cached under the
+cart's version and the price, coupon and country versions (see api.cache),
+so a cart is priced once per change however often the badge or the
+checkout page renders it. Tax rates come from an in-process copy of the
+Country table that reloads when the countries version moves.
+'''
+import hashlib
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+from django.db import models
+
+from api import models as api_models
+from api.cache import COUNTRIES_VERSION, COUPONS_VERSION, PRICES_VERSION, cart_version, get_versions
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+CACHE_TIMEOUT = 60 * 60
+
+# (countries version, {casefolded name: tax rate}) of this process
+_countries = (None, {})
+
+
+def tax_rates(version):
+    '''Tax rates of the active countries, reloaded only when the countries version moved'''
+    global _countries
+    loaded, rates = _countries
+    if loaded != version:
+        rates = {
+            name.strip().casefold(): rate
+            for name, rate in api_models.Country.objects.filter(active=True).values_list('name', 'tax_rate')
+        }
+        _countries = (version, rates)
+    return rates
+
+
+def tax_rate(country, version=None):
+    '''Tax percentage for a country name, 0 for unknown or inactive countries'''
+    if not country:
+        return ZERO
+    if version is None:
+        [version] = get_versions([COUNTRIES_VERSION])
+    return tax_rates(version).get(country.strip().casefold(), ZERO)
+
+
+def clean_codes(codes):
+    return sorted({code.strip() for code in codes or () if code and code.strip()})
+
+
+def coupon(user, codes, field):
+    '''
+    Subquery for `field` of the best coupon among codes that the cart line's
+    teacher issued and the user has not used yet
+    '''
+    coupons = api_models.Coupon.objects.filter(
+        teacher_id=models.OuterRef('course__teacher_id'), code__in=codes, active=True,
+    ).exclude(used_by=user).order_by('-discount', 'id')
+    return models.Subquery(coupons.values(field)[:1])
+
+
+def line_amounts(price, discount, rate):
+    '''(saved, tax_fee, total) of one cart line; discount and rate are percentages'''
+    price = price or ZERO
+    discount = min(max(discount or 0, 0), 100)
+    saved = (price * discount / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+    tax_fee = ((price - saved) * rate / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+    return saved, tax_fee, price - saved + tax_fee
+
+
+def _cache_key(cart, country, codes, versions):
+    parts = [str(cart.id), str(cart.user_id), (country or '').strip().casefold(), ','.join(codes), *map(str, versions)]
+    return 'cart-pricing:' + hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest()
+
+
+def price_cart(cart, country=None, codes=()):
+    '''
+    Totals of the lines in the cart as a dict of items, sub_total, saved,
+    tax_rate, tax_fee, total and the coupon codes that applied.
+    '''
+    codes = clean_codes(codes)
+    versions = get_versions([cart_version(cart.id), PRICES_VERSION, COUPONS_VERSION, COUNTRIES_VERSION])
+    key = _cache_key(cart, country, codes, versions)
+    totals = cache.get(key)
+    if totals is not None:
+        return totals
+
+    rate = tax_rate(country, versions[3])
+    groups = (
+        api_models.CartOrderItem.objects.filter(cart=cart, order__isnull=True)
+        .values('course__teacher_id', 'course__price')
+        .annotate(
+            lines=models.Count('id'),
+            discount=coupon(cart.user_id, codes, 'discount'),
+            code=coupon(cart.user_id, codes, 'code'),
+        )
+        .order_by()
+    )
+    totals = {'items': 0, 'sub_total': ZERO, 'saved': ZERO, 'tax_rate': rate, 'tax_fee': ZERO, 'total': ZERO, 'coupons': []}
+    applied = set()
+    for group in groups:
+        price, lines = group['course__price'] or ZERO, group['lines']
+        saved, tax_fee, total = line_amounts(price, group['discount'], rate)
+        totals['items'] += lines
+        totals['sub_total'] += price * lines
+        totals['saved'] += saved * lines
+        totals['tax_fee'] += tax_fee * lines
+        totals['total'] += total * lines
+        if group['code'] and saved:
+            applied.add(group['code'])
+    totals['coupons'] = sorted(applied)
+
+    cache.set(key, totals, CACHE_TIMEOUT)
+    return totals
@@ -0,0 +1,186 @@
+'''
+Full-text course search.
+
+On SQLite the text lives in the FTS5 table `api_course_search` (rowid = course
+id). On PostgreSQL it lives in the `api_course.search_vector` tsvector column
+with a GIN index. Both are created by migration 0005 and kept in sync by the
+receivers at the bottom of api.models; `manage.py rebuild_search_index`
+rebuilds them from scratch. Other databases have no index and fall back to an
+unranked case-insensitive match on course title and description.
+'''
+import re
+
+from django.db import connection, models
+
+FTS_TABLE = 'api_course_search'
+# bm25 weights for title, description, lectures, category, teacher
+FTS_WEIGHTS = (10.0, 1.0, 4.0, 3.0, 3.0)
+PRICE_BUCKETS = ((0, 'free'), (500, 'under_500'), (2000, '500_2000'))
+PRICE_BUCKET_ABOVE = '2000_plus'
+FACETS = ('level', 'language', 'category', 'price')
+REINDEX_BATCH_SIZE = 500
+
+
+def _in_clause(column, course_ids):
+    return f'{column} IN ({", ".join(["%s"] * len(course_ids))})', list(course_ids)
+
+
+def reindex_courses(course_ids, using=connection):
+    '''Rewrites the search text of the given courses, or of every course when course_ids is None'''
+    if course_ids is not None:
+        course_ids = list(course_ids)
+        for start in range(0, len(course_ids), REINDEX_BATCH_SIZE):
+            _reindex(course_ids[start:start + REINDEX_BATCH_SIZE], using)
+    else:
+        _reindex(None, using)
+
+
+def _reindex(course_ids, using):
+    if using.vendor == 'sqlite':
+        lectures = (
+            "(SELECT group_concat(l.title, ' ') FROM api_lecture l "
+            "INNER JOIN api_section s ON s.id = l.section_id WHERE s.course_id = c.id)"
+        )
+        insert = (
+            f'INSERT INTO {FTS_TABLE} (rowid, title, description, lectures, category, teacher) '
+            f"SELECT c.id, c.title, c.description, coalesce({lectures}, ''), coalesce(cat.title, ''), coalesce(t.full_name, '') "
+            'FROM api_course c '
+            'LEFT OUTER JOIN api_category cat ON cat.id = c.category_id '
+            'LEFT OUTER JOIN api_teacher t ON t.id = c.teacher_id'
+        )
+        with using.cursor() as cursor:
+            if course_ids is None:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+                cursor.execute(insert)
+            else:
+                clause, params = _in_clause('rowid', course_ids)
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE {clause}', params)
+                clause, params = _in_clause('c.id', course_ids)
+                cursor.execute(f'{insert} WHERE {clause}', params)
+
+    elif using.vendor == 'postgresql':
+        where, params = '', []
+        if course_ids is not None:
+            clause, params = _in_clause('c.id', course_ids)
+            where = f' WHERE {clause}'
+        with using.cursor() as cursor:
+            cursor.execute(
+                'UPDATE api_course c SET search_vector = '
+                "setweight(to_tsvector('english', coalesce(c.title, '')), 'A') || "
+                "setweight(to_tsvector('english', coalesce((SELECT string_agg(l.title, ' ') FROM api_lecture l "
+                "INNER JOIN api_section s ON s.id = l.section_id WHERE s.course_id = c.id), '')), 'B') || "
+                "setweight(to_tsvector('english', coalesce((SELECT cat.title FROM api_category cat WHERE cat.id = c.category_id), '')), 'B') || "
+                "setweight(to_tsvector('english', coalesce((SELECT t.full_name FROM api_teacher t WHERE t.id = c.teacher_id), '')), 'B') || "
+                "setweight(to_tsvector('english', coalesce(c.description, '')), 'C')"
+                + where,
+                params,
+            )
+
+
+def remove_courses(course_ids, using=connection):
+    course_ids = list(course_ids)
+    if using.vendor != 'sqlite' or not course_ids:
+        return  # the tsvector goes away with the course row
+    clause, params = _in_clause('rowid', course_ids)
+    with using.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE {clause}', params)
+
+
+def _fts_query(text):
+    '''Turns free text into an FTS5 query of quoted prefix terms, so user input can never be a syntax error'''
+    terms = re.findall(r'\w+', text)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _search_without_index(text, filters, limit, offset):
+    '''The unranked icontains match used on databases without a search index'''
+    from api.models import Course
+
+    courses = Course.objects.published().filter(models.Q(title__icontains=text) | models.Q(description__icontains=text))
+    for column in ('level', 'language', 'category_id'):
+        if filters.get(column) not in (None, ''):
+            courses = courses.filter(**{column: filters[column]})
+    if filters.get('min_price') is not None:
+        courses = courses.filter(price__gte=filters['min_price'])
+    if filters.get('max_price') is not None:
+        courses = courses.filter(price__lte=filters['max_price'])
+
+    ids = list(courses.order_by('id').values_list('id', flat=True)[offset:offset + limit])
+    bucket = models.Case(
+        models.When(models.Q(price__isnull=True) | models.Q(price=0), then=models.Value(PRICE_BUCKETS[0][1])),
+        *[models.When(price__lt=edge, then=models.Value(name)) for edge, name in PRICE_BUCKETS[1:]],
+        default=models.Value(PRICE_BUCKET_ABOVE),
+        output_field=models.CharField(),
+    )
+    facets = {facet: {} for facet in FACETS}
+    for facet, column in (('level', models.F('level')), ('language', models.F('language')), ('category', models.F('category_id')), ('price', bucket)):
+        rows = courses.annotate(key=column).order_by().values('key').annotate(count=models.Count('id'))
+        facets[facet] = {str(row['key']): row['count'] for row in rows if row['key'] is not None}
+    return ids, facets
+
+
+def search_courses(text, filters=None, limit=20, offset=0):
+    '''
+    Runs one statement returning the ranked page of published course ids and
+    the facet counts over every match. Returns (ids, facets), best match first.
+    '''
+    filters = filters or {}
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        query = _fts_query(text)
+        if not query:
+            return [], {facet: {} for facet in FACETS}
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        source = (
+            f'SELECT c.id, c.level, c.language, c.category_id, c.price, bm25({FTS_TABLE}, {weights}) AS rank '
+            f'FROM {FTS_TABLE} INNER JOIN api_course c ON c.id = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s'
+        )
+        params = [query]
+    elif vendor == 'postgresql':
+        query = text
+        source = (
+            "SELECT c.id, c.level, c.language, c.category_id, c.price, "
+            "-ts_rank(c.search_vector, websearch_to_tsquery('english', %s)) AS rank "
+            "FROM api_course c WHERE c.search_vector @@ websearch_to_tsquery('english', %s)"
+        )
+        params = [query, query]
+    else:
+        return _search_without_index(text, filters, limit, offset)
+
+    source += " AND c.platform_status = 'Published'"
+    for column in ('level', 'language', 'category_id'):
+        if filters.get(column) not in (None, ''):
+            source += f' AND c.{column} = %s'
+            params.append(filters[column])
+    if filters.get('min_price') is not None:
+        source += ' AND c.price >= %s'
+        params.append(filters['min_price'])
+    if filters.get('max_price') is not None:
+        source += ' AND c.price <= %s'
+        params.append(filters['max_price'])
+
+    bucket = 'CASE ' + ' '.join(
+        f"WHEN coalesce(price, 0) {'=' if edge == 0 else '<'} {edge} THEN '{name}'" for edge, name in PRICE_BUCKETS
+    ) + f" ELSE '{PRICE_BUCKET_ABOVE}' END"
+    facet_selects = [
+        f"SELECT '{facet}', CAST({column} AS TEXT), CAST(COUNT(*) AS REAL) FROM hits GROUP BY {column}"
+        for facet, column in (('level', 'level'), ('language', 'language'), ('category', 'category_id'), ('price', bucket))
+    ]
+    sql = (
+        f'WITH hits AS ({source}) '
+        "SELECT * FROM (SELECT 'hit', CAST(id AS TEXT), CAST(rank AS REAL) FROM hits ORDER BY rank, id LIMIT %s OFFSET %s) page "
+        + ' '.join(f'UNION ALL {select}' for select in facet_selects)
+    )
+    params += [limit, offset]
+
+    facets = {facet: {} for facet in FACETS}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    hits = sorted((rank, int(key)) for kind, key, rank in rows if kind == 'hit')
+    ids = [course_id for rank, course_id in hits]
+    for kind, key, count in rows:
+        if kind != 'hit' and key is not None:
+            facets[kind][key] = int(count)
+    return ids, facets
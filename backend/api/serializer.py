@@ -1,7 +1,10 @@
 from usersauth.models import Profile, User
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
+from django.urls import reverse
+from django.core.files.storage import default_storage
 from api import models as api_models
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -52,28 +55,89 @@ class UserSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class ImageVariantsField(serializers.ReadOnlyField):
+    '''
+    Renders a model's image_variants as one srcset string per format, e.g.
+    {"webp": "https://.../a1.webp 64w, https://.../b2.webp 128w", "jpeg": "..."}.
+    Empty until the image worker has processed the upload.
+    '''
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        url = lambda name: request.build_absolute_uri(default_storage.url(name)) if request else default_storage.url(name)
+        return {
+            image_format: ', '.join(f'{url(name)} {width}w' for width, name in sorted(sizes.items(), key=lambda item: int(item[0])))
+            for image_format, sizes in (value or {}).get('variants', {}).items()
+        }
+
 class ProfileSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Profile
         fields = '__all__'
 
+class SparseFieldsetMixin:
+    '''
+    Lets clients pick fields with ?fields=a,b and opt into heavy ones listed in
+    Meta.expandable_fields with ?expand=x. Views use model_columns() to load
+    only the columns the chosen fields read.
+    '''
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None:
+            wanted = set(self.requested_fields(request))
+            for name in list(self.fields):
+                if name not in wanted:
+                    self.fields.pop(name)
+
+    @classmethod
+    def requested_fields(cls, request):
+        params = request.query_params
+        expandable = getattr(cls.Meta, 'expandable_fields', [])
+        expand = set(params.get(cls.expand_query_param, '').split(','))
+        picked = set(filter(None, params.get(cls.fields_query_param, '').split(',')))
+        if picked:
+            fields = [name for name in cls.Meta.fields if name in picked | expand]
+            if fields:
+                return fields
+        return [name for name in cls.Meta.fields if name not in expandable or name in expand]
+
+    @classmethod
+    def model_columns(cls, fields):
+        '''Maps serializer fields to the model columns (or related__columns) they read'''
+        source_columns = getattr(cls.Meta, 'source_columns', {})
+        columns = []
+        for name in fields:
+            columns.extend(source_columns.get(name, [name]))
+        return columns
+
 class CategorySerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = api_models.Category
-        fields = ['id', 'title', 'image', 'slug', 'course_count']
+        fields = ['id', 'title', 'image', 'image_variants', 'slug', 'course_count']
 
 class TeacherSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
 
     class Meta:
-        fields = [ "user", "image", "full_name", "bio", "twitter", "linkedin", "about", "country", "students", "courses", "review",]
+        fields = [ "user", "image", "image_variants", "full_name", "bio", "twitter", "linkedin", "country", "students", "courses", "review",]
         model = api_models.Teacher
 
 class LectureSerializer(serializers.ModelSerializer):
+    media_url = serializers.SerializerMethodField()
     
     class Meta:
         fields = '__all__'
         model = api_models.Lecture
+        # its URL is the unchecked path to the file, media_url is what players load
+        extra_kwargs = {'file': {'write_only': True}}
     
     def __init__(self, *args, **kwargs):
         super(LectureSerializer, self).__init__(*args, **kwargs)
@@ -83,6 +147,10 @@ class LectureSerializer(serializers.ModelSerializer):
         else:
             self.Meta.depth = 3
 
+    def get_media_url(self, obj):
+        '''Lecture files are not public, players load them from the access-checked endpoint'''
+        return reverse('lecture-media', kwargs={'lecture_id': obj.lecture_id}) if obj.file else None
+
 class SectionSerializer(serializers.ModelSerializer):
     lectures = LectureSerializer(many=True)
     class Meta:
@@ -129,6 +197,17 @@ class QuestionAnswerSerializer(serializers.ModelSerializer):
 
 
 
+class QuestionAnswerThreadSerializer(serializers.ModelSerializer):
+    '''A question without its messages, for thread lists; see QuestionAnswerQuerySet.threads()'''
+    profile = ProfileSerializer(many=False)
+    reply_count = serializers.IntegerField(read_only=True)
+    latest_reply = QuestionAnswerResponseSerializer(read_only=True, allow_null=True)
+
+    class Meta:
+        model = api_models.QuestionAnswer
+        fields = ['qa_id', 'course', 'user', 'title', 'date', 'profile', 'reply_count', 'latest_reply']
+
+
 class ReviewSerializer(serializers.ModelSerializer):
     profile = ProfileSerializer(many=False)
 
@@ -143,22 +222,55 @@ class EnrolledCourseSerializer(serializers.ModelSerializer):
     curriculum = SectionSerializer(many=True)
     note = NoteSerializer(many=True)
     question_answer = QuestionAnswerSerializer(many=True)
-    review = ReviewSerializer(many=True)
+    review = ReviewSerializer(many=False)
 
     class Meta:
         model = api_models.EnrolledCourse
         fields = '__all__'
 
 
+class EnrollmentProgressSerializer(serializers.ModelSerializer):
+    course_title = serializers.CharField(source='course.title', read_only=True)
+    course_slug = serializers.CharField(source='course.slug', read_only=True)
+
+    class Meta:
+        model = api_models.EnrolledCourse
+        fields = ['enrollment_id', 'course', 'course_title', 'course_slug', 'completed_lectures', 'total_lectures', 'progress', 'last_lecture', 'date']
+
+
+class LectureCompletionSerializer(serializers.Serializer):
+    course_id = serializers.IntegerField()
+    lecture_ids = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=500)
+
+
 class CourseSerializer(serializers.ModelSerializer):
     students = EnrolledCourseSerializer(many=True)
     curriculum = SectionSerializer(many=True)
     lectures = LectureSerializer(many=True)
     reviews = ReviewSerializer(many=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = api_models.Course
-        fields = [ 'category','teacher','file','image','title','description','price','language','level','platform_status','featured','course_id','slug','date','students','curriculum','lectures','average_rating','rating_count','reviews']
+        fields = [ 'category','teacher','image','image_variants','title','description','price','language','level','platform_status','featured','course_id','slug','date','students','curriculum','lectures','average_rating','rating_count','reviews','total_students','total_lectures','total_duration']
+
+
+class CourseSummarySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    '''Catalog card. Its size does not depend on how many students or lectures a course has.'''
+    category = serializers.CharField(source='category.title', read_only=True, default=None)
+    teacher = serializers.CharField(source='teacher.full_name', read_only=True, default=None)
+    image_variants = ImageVariantsField()
+
+    class Meta:
+        model = api_models.Course
+        fields = ['id','course_id','slug','title','image','image_variants','price','language','level','featured','date','category','teacher','average_rating','rating_count','total_students','total_lectures','total_duration','description']
+        expandable_fields = ['description']
+        source_columns = {
+            'category': ['category__title'],
+            'teacher': ['teacher__full_name'],
+            'average_rating': ['rating_sum', 'total_reviews'],
+            'rating_count': ['total_reviews'],
+        }
 
 
 class CartOrderItemSerializer(serializers.ModelSerializer):
@@ -178,6 +290,40 @@ class CartSerializer(serializers.ModelSerializer):
         model = api_models.Cart
         fields = ['id', 'user', 'cart_items', 'total_cart_items']
 
+class OrderItemSerializer(serializers.ModelSerializer):
+
+    course_title = serializers.CharField(source='course.title', read_only=True)
+
+    class Meta:
+        model = api_models.CartOrderItem
+        fields = ['id', 'course', 'course_title', 'teacher', 'initial_total', 'tax_fee', 'saved', 'total']
+
+
+class CartOrderSerializer(serializers.ModelSerializer):
+    order_items = OrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = api_models.CartOrder
+        fields = ['cart_order_id', 'sub_total', 'tax_fee', 'total', 'initial_total', 'saved', 'payment_status', 'full_name', 'email', 'country', 'date', 'order_items']
+
+
+class CheckoutSerializer(serializers.Serializer):
+    full_name = serializers.CharField(max_length=100, required=False)
+    email = serializers.EmailField(required=False)
+    country = serializers.CharField(max_length=50, required=False)
+    coupons = serializers.ListField(child=serializers.CharField(max_length=50), max_length=20, required=False)
+
+
+class CartPricingSerializer(serializers.Serializer):
+    '''Totals from api.pricing.price_cart()'''
+    items = serializers.IntegerField()
+    sub_total = serializers.DecimalField(max_digits=12, decimal_places=2)
+    saved = serializers.DecimalField(max_digits=12, decimal_places=2)
+    tax_rate = serializers.DecimalField(max_digits=12, decimal_places=2)
+    tax_fee = serializers.DecimalField(max_digits=12, decimal_places=2)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
+    coupons = serializers.ListField(child=serializers.CharField())
+
 class AddToCartSerializer(serializers.ModelSerializer):
     course_id = serializers.IntegerField()
 
@@ -200,6 +346,37 @@ class RemoveFromCartSerializer(serializers.ModelSerializer):
         fields = ['course_id']
 
 
+class TeacherDailyStatsSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = api_models.TeacherDailyStats
+        fields = ['day', *api_models.DailyStats.metric_fields]
+
+
+class CourseDailyStatsSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = api_models.CourseDailyStats
+        fields = ['day', *api_models.DailyStats.metric_fields]
+
+
+class LectureUploadSerializer(serializers.ModelSerializer):
+    lecture_id = serializers.CharField(write_only=True)
+    checksum = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False, allow_blank=True, write_only=True)
+    chunk_size = serializers.IntegerField(required=False, min_value=1)
+    size = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = api_models.LectureUpload
+        fields = ['upload_id', 'lecture_id', 'filename', 'size', 'chunk_size', 'checksum', 'status', 'total_chunks', 'received_chunks']
+        read_only_fields = ['upload_id', 'status']
+
+    def validate_size(self, size):
+        if size > settings.MAX_LECTURE_UPLOAD_SIZE:
+            raise serializers.ValidationError(f'Ensure this value is less than or equal to {settings.MAX_LECTURE_UPLOAD_SIZE}.')
+        return size
+
+
 class CertificateSerializer(serializers.ModelSerializer):
 
     class Meta:
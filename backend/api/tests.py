@@ -1,3 +1,1399 @@
-from django.test import TestCase
+import base64
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+from decimal import Decimal
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from asgiref.sync import async_to_sync
+from rest_framework.test import APIClient, force_authenticate
+
+from usersauth.models import User, Profile
+from api import models as api_models
+from api import serializer as api_serializers
+from api import checkout
+from api import analytics
+from api import notifications
+from api import pricing
+from api import urls as api_urls
+from api import async_views
+from api.cache import SHARED_VERSION, course_version, get_versions
+from api.management.commands.bench_concurrency import CONFIGS
+
+
+class CatalogFixtureMixin:
+    '''Builds catalog rows so tests can grow the dataset and compare query counts'''
+
+    def make_user(self, name):
+        return User.objects.create_user(email=f'{name}@example.com', username=name, full_name=name, password='pass12345')
+
+    def make_course(self, index, students=2, sections=2, lectures=2):
+        teacher_user = self.make_user(f'teacher{index}')
+        teacher = api_models.Teacher.objects.create(user=teacher_user, full_name=f'Teacher {index}')
+        course = api_models.Course.objects.create(
+            category=self.category,
+            teacher=teacher,
+            title=f'Course {index}',
+            description='Description',
+            price=10,
+        )
+        for s in range(sections):
+            section = api_models.Section.objects.create(course=course, title=f'Section {s}')
+            for l in range(lectures):
+                lecture = api_models.Lecture.objects.create(section=section, title=f'Lecture {l}')
+        for s in range(students):
+            student = self.make_user(f'student{index}-{s}')
+            api_models.EnrolledCourse.objects.create(user=student, course=course, teacher=teacher)
+            api_models.CompletedLecture.objects.create(user=student, course=course, lesson=lecture)
+            api_models.Note.objects.create(user=student, course=course, title='Note', note='Note')
+            api_models.Review.objects.create(user=student, course=course, review='Good', rating=5, active=True)
+            question = api_models.QuestionAnswer.objects.create(user=student, course=course, title='Question')
+            api_models.QuestionAnswerResponse.objects.create(user=teacher_user, course=course, question=question, message='Answer')
+        return course
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+
+class CatalogTestCase(CatalogFixtureMixin, TestCase):
+    '''Starts each test with an empty cache, a fresh API client and one category'''
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = api_models.Category.objects.create(title='Programming')
+
+
+class CatalogQueryCountTest(CatalogTestCase):
+
+    def test_category_list_query_count_is_flat(self):
+        self.make_course(0)
+        small = self.count_queries('/api/v1/course/category/')
+        api_models.Category.objects.create(title='Design')
+        self.make_course(1)
+        self.assertEqual(self.count_queries('/api/v1/course/category/'), small)
+
+    def test_course_list_query_count_is_flat(self):
+        self.make_course(0, students=1, sections=1, lectures=1)
+        small = self.count_queries('/api/v1/course/course-list/')
+        for index in range(1, 4):
+            self.make_course(index, students=3, sections=3, lectures=3)
+        self.assertEqual(self.count_queries('/api/v1/course/course-list/'), small)
+
+    def test_course_detail_query_count_is_flat(self):
+        small_course = self.make_course(0, students=1, sections=1, lectures=1)
+        large_course = self.make_course(1, students=4, sections=3, lectures=3)
+        small = self.count_queries(f'/api/v1/course/course-detail/{small_course.slug}')
+        self.assertEqual(self.count_queries(f'/api/v1/course/course-detail/{large_course.slug}'), small)
+
+    def test_course_rating_is_read_from_stored_stats(self):
+        course = self.make_course(0, students=2)
+        api_models.Review.objects.create(course=course, review='Hidden', rating=1, active=False)
+        response = self.client.get(f'/api/v1/course/course-detail/{course.slug}')
+        self.assertEqual(response.data['rating_count'], 2)
+        self.assertEqual(response.data['average_rating'], 5)
+        self.assertEqual(len(response.data['reviews']), 2)
+
+
+class CourseStatsTest(CatalogTestCase):
+
+    def assertStats(self, obj, **expected):
+        obj.refresh_from_db()
+        for field, value in expected.items():
+            self.assertEqual(getattr(obj, field), value, field)
+
+    def test_counters_follow_writes(self):
+        course = self.make_course(0, students=2, sections=2, lectures=2)
+        self.assertStats(course, rating_sum=10, total_reviews=2, total_students=2, total_lectures=4)
+        self.assertStats(course.teacher, total_courses=1, total_reviews=2, total_students=2)
+        self.assertStats(self.category, total_courses=1)
+
+        review = api_models.Review.objects.filter(course=course).first()
+        review.active = False
+        review.save()
+        self.assertStats(course, rating_sum=5, total_reviews=1)
+
+        lecture = api_models.Lecture.objects.filter(section__course=course).first()
+        lecture.duration = 90
+        lecture.save()
+        self.assertStats(course, total_duration=90)
+
+        api_models.EnrolledCourse.objects.filter(course=course).first().delete()
+        self.assertStats(course, total_students=1)
+        self.assertStats(course.teacher, total_students=1)
+
+    def test_teacher_change_moves_counters(self):
+        course = self.make_course(0, students=2)
+        old_teacher = course.teacher
+        new_teacher = api_models.Teacher.objects.create(user=self.make_user('other'), full_name='Other')
+        course.teacher = new_teacher
+        course.save()
+        self.assertStats(old_teacher, total_courses=0, total_reviews=0, total_students=0)
+        self.assertStats(new_teacher, total_courses=1, total_reviews=2, total_students=2)
+
+    def test_teachers_count_each_student_once(self):
+        first = self.make_course(0, students=0)
+        second = self.make_course(1, students=0)
+        second.teacher = first.teacher
+        second.save()
+        student = self.make_user('learner')
+        enrollments = [api_models.EnrolledCourse.objects.create(user=student, course=course) for course in (first, second)]
+        self.assertStats(first.teacher, total_students=1)
+        enrollments[0].delete()
+        self.assertStats(first.teacher, total_students=1)
+        enrollments[1].delete()
+        self.assertStats(first.teacher, total_students=0)
+
+        api_models.EnrolledCourse.objects.create(user=student, course=first)
+        other = self.make_course(2, students=0)
+        api_models.EnrolledCourse.objects.create(user=student, course=other)
+        other.teacher = first.teacher
+        other.save()
+        self.assertStats(first.teacher, total_students=1)
+        out = StringIO()
+        call_command('rebuild_stats', '--dry-run', stdout=out)
+        self.assertIn('found 0 rows', out.getvalue())
+
+    def test_stale_instance_does_not_overwrite_counters(self):
+        course = self.make_course(0, students=0)
+        stale = api_models.Course.objects.get(id=course.id)
+        api_models.EnrolledCourse.objects.create(user=self.make_user('late'), course=course)
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertStats(course, total_students=1, title='Renamed')
+
+    def test_course_delete_updates_category_and_teacher(self):
+        course = self.make_course(0, students=2)
+        teacher = course.teacher
+        course.delete()
+        self.assertStats(teacher, total_courses=0, total_reviews=0, total_students=0)
+        self.assertStats(self.category, total_courses=0)
+
+    def test_rebuild_stats_reports_and_fixes_drift(self):
+        course = self.make_course(0, students=2)
+        api_models.Review.objects.filter(course=course).update(active=False)
+        out = StringIO()
+        call_command('rebuild_stats', stdout=out)
+        self.assertIn('total_reviews 2 -> 0', out.getvalue())
+        self.assertStats(course, rating_sum=0, total_reviews=0)
+        self.assertStats(course.teacher, total_reviews=0)
+
+        out = StringIO()
+        call_command('rebuild_stats', '--dry-run', stdout=out)
+        self.assertIn('found 0 rows', out.getvalue())
+
+
+class KeysetPaginationTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # shared dates make sure ties are broken by id instead of being skipped
+        for index in range(7):
+            course = self.make_course(index, students=0, sections=0)
+            api_models.Course.objects.filter(id=course.id).update(date=timezone.now() - timedelta(days=index // 2))
+
+    def walk(self, url):
+        pages = []
+        while url:
+            page = self.client.get(url).json()
+            pages.append(page)
+            url = page['next']
+        return pages
+
+    def test_walks_every_course_once_in_order(self):
+        pages = self.walk('/api/v1/course/course-list/?page_size=3')
+        titles = [course['title'] for page in pages for course in page['results']]
+        expected = list(api_models.Course.objects.order_by('-date', '-id').values_list('title', flat=True))
+        self.assertEqual(titles, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['previous'])
+
+        previous = self.client.get(pages[2]['previous']).json()
+        self.assertEqual(previous['results'], pages[1]['results'])
+
+    def test_deep_pages_cost_the_same_as_first_page(self):
+        first = self.count_queries('/api/v1/course/course-list/?page_size=2')
+        last_page_url = self.walk('/api/v1/course/course-list/?page_size=2')[-2]['next']
+        cache.clear()
+        self.assertEqual(self.count_queries(last_page_url), first)
+
+    def test_approximate_total_is_optional(self):
+        response = self.client.get('/api/v1/course/course-list/')
+        self.assertNotIn('approximate_total', response.data)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        response = self.client.get('/api/v1/course/course-list/?with_total=1')
+        self.assertEqual(response.data['approximate_total'], 7)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/api/v1/course/course-list/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursor_is_not_found(self):
+        for payload in ({'v': ['2024-01-01T00:00:00+00:00', 1]}, {'v': [1, 2], 'r': 0}, {'v': ['yesterday', 1], 'r': 0},
+                        {'v': ['2024-01-01T00:00:00+00:00', 'one'], 'r': 0}, {'v': [[1], {}], 'r': 0}, {'v': [1, 2], 'r': 2}):
+            cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            response = self.client.get(f'/api/v1/course/course-list/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404, payload)
+
+    def test_rows_without_a_date_are_left_out(self):
+        course = self.make_course(7, students=3, sections=1, lectures=1)
+        undated = api_models.QuestionAnswer.objects.filter(course=course).first()
+        api_models.QuestionAnswer.objects.filter(id=undated.id).update(date=None)
+        pages = self.walk(f'/api/v1/course/question-answer/{course.slug}/?page_size=1')
+        ids = [thread['qa_id'] for page in pages for thread in page['results']]
+        self.assertEqual(len(ids), 2)
+        self.assertNotIn(undated.qa_id, ids)
+
+
+class CourseSummaryTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.make_course(0, students=3)
+
+    def get_with_sql(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response.data['results'][0], ' '.join(query['sql'] for query in queries)
+
+    def test_summary_skips_description_and_nested_rows(self):
+        course, sql = self.get_with_sql('/api/v1/course/course-list/')
+        self.assertNotIn('description', course)
+        self.assertNotIn('"api_course"."description"', sql)
+        self.assertEqual(course['category'], 'Programming')
+        self.assertEqual(course['total_students'], 3)
+        self.assertNotIn('students', course)
+
+    def test_expand_adds_description(self):
+        course, sql = self.get_with_sql('/api/v1/course/course-list/?expand=description')
+        self.assertEqual(course['description'], 'Description')
+        self.assertIn('"api_course"."description"', sql)
+
+    def test_fields_are_pushed_down_to_sql(self):
+        course, sql = self.get_with_sql('/api/v1/course/course-list/?fields=title,slug')
+        self.assertEqual(set(course), {'title', 'slug'})
+        self.assertNotIn('api_category', sql)
+        self.assertNotIn('"api_course"."price"', sql)
+
+
+class VersionedCacheTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.course = self.make_course(0, students=1)
+        self.other = self.make_course(1, students=1)
+
+    def test_warm_cache_runs_no_queries(self):
+        url = f'/api/v1/course/course-detail/{self.course.slug}'
+        cold = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            warm = self.client.get(url)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(warm.content, cold.content)
+        self.assertEqual(warm['ETag'], cold['ETag'])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get('/api/v1/course/course-list/')['ETag']
+        response = self.client.get('/api/v1/course/course-list/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_writes_invalidate_only_affected_course(self):
+        url = f'/api/v1/course/course-detail/{self.course.slug}'
+        other_url = f'/api/v1/course/course-detail/{self.other.slug}'
+        etag = self.client.get(url)['ETag']
+        self.client.get(other_url)
+
+        api_models.Review.objects.create(user=self.make_user('late'), course=self.course, review='Ok', rating=3, active=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['rating_count'], 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(other_url)
+        self.assertEqual(len(queries), 0)
+
+    def test_stamps_move_again_on_commit(self):
+        versions = [SHARED_VERSION, course_version(self.course.slug)]
+        with self.captureOnCommitCallbacks(execute=True):
+            api_models.Review.objects.create(user=self.make_user('late'), course=self.course, review='Ok', rating=3, active=True)
+            # what a request reading the old rows would cache the page under
+            during = get_versions(versions)
+        self.assertNotEqual(get_versions(versions), during)
+
+    def test_profile_edit_invalidates_pages_showing_it(self):
+        url = f'/api/v1/course/course-detail/{self.course.slug}'
+        self.client.get(url)
+        other_etag = self.client.get(f'/api/v1/course/course-detail/{self.other.slug}')['ETag']
+        reviewer = api_models.Review.objects.get(course=self.course).user
+        reviewer.profile.full_name = 'Renamed reviewer'
+        reviewer.profile.save()
+        self.assertIn('Renamed reviewer', self.client.get(url).content.decode())
+        self.assertEqual(self.client.get(f'/api/v1/course/course-detail/{self.other.slug}')['ETag'], other_etag)
+
+    def test_category_write_invalidates_lists(self):
+        self.client.get('/api/v1/course/category/')
+        self.category.title = 'Coding'
+        self.category.save()
+        response = self.client.get('/api/v1/course/category/')
+        self.assertEqual(response.json()['results'][0]['title'], 'Coding')
+
+
+class CourseSearchTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.python = self.make_course(0, students=0, sections=0)
+        self.python.title = 'Python for beginners'
+        self.python.save()
+        self.django = self.make_course(1, students=0, sections=0)
+        self.django.description = 'Build web apps with python and django'
+        self.django.level = api_models.Course.CourseLevel.ADVANCED
+        self.django.price = 3000
+        self.django.save()
+
+    def search(self, query):
+        response = self.client.get('/api/v1/course/search/?' + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_title_matches_rank_above_description_matches(self):
+        data = self.search('q=python')
+        self.assertEqual([course['slug'] for course in data['results']], [self.python.slug, self.django.slug])
+        self.assertEqual(data['facets']['level'], {'BEG': 1, 'Adv': 1})
+        self.assertEqual(data['facets']['price'], {'under_500': 1, '2000_plus': 1})
+
+    def test_filters_narrow_results_and_facets(self):
+        data = self.search('q=python&level=Adv')
+        self.assertEqual([course['slug'] for course in data['results']], [self.django.slug])
+        self.assertEqual(data['facets']['level'], {'Adv': 1})
+
+    def test_index_follows_lecture_teacher_and_delete(self):
+        section = api_models.Section.objects.create(course=self.python, title='Intro')
+        api_models.Lecture.objects.create(section=section, title='Decorators explained')
+        self.assertEqual(len(self.search('q=decorator')['results']), 1)
+
+        self.django.teacher.full_name = 'Guido'
+        self.django.teacher.save()
+        self.assertEqual(self.search('q=guido')['results'][0]['slug'], self.django.slug)
+
+        self.django.delete()
+        self.assertEqual(self.search('q=guido')['results'], [])
+
+    def test_index_follows_lecture_moves_and_category_deletes(self):
+        lecture = api_models.Lecture.objects.create(
+            section=api_models.Section.objects.create(course=self.python, title='Intro'), title='Decorators explained',
+        )
+        lecture.section = api_models.Section.objects.create(course=self.django, title='Intro')
+        lecture.save()
+        self.assertEqual([course['slug'] for course in self.search('q=decorator')['results']], [self.django.slug])
+
+        self.assertEqual(len(self.search('q=programming')['results']), 2)
+        self.category.delete()
+        self.assertEqual(self.search('q=programming')['results'], [])
+
+    def test_other_databases_fall_back_to_icontains(self):
+        with mock.patch('api.search.connection', mock.Mock(vendor='mysql')):
+            data = self.search('q=PYTHON&max_price=1000')
+        self.assertEqual([course['slug'] for course in data['results']], [self.python.slug])
+        self.assertEqual(data['facets']['price'], {'under_500': 1})
+
+    def test_query_syntax_is_never_an_error(self):
+        self.assertEqual(self.search('q=c%2B%2B%20("OR')['results'], [])
+        self.assertEqual(self.client.get('/api/v1/course/search/').status_code, 400)
+
+
+class CheckoutTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.student = self.make_user('buyer')
+        self.client.force_authenticate(self.student)
+
+    def make_course(self, index, price=0, **kwargs):
+        # checkout only completes carts with nothing to pay
+        course = super().make_course(index, **kwargs)
+        api_models.Course.objects.filter(id=course.id).update(price=price)
+        course.price = price
+        return course
+
+    def fill_cart(self, courses):
+        cart, _ = api_models.Cart.objects.get_or_create(user=self.student)
+        for course in courses:
+            api_models.CartOrderItem.objects.create(cart=cart, course=course)
+        return cart
+
+    def checkout(self):
+        with CaptureQueriesContext(connection) as queries:
+            order = checkout.checkout(self.student)
+        return order, len(queries)
+
+    def test_checkout_creates_order_enrollments_and_notifications(self):
+        courses = [self.make_course(index, students=0) for index in range(3)]
+        self.fill_cart(courses)
+        response = self.client.post('/api/v1/cart/checkout/', {'country': 'India'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        order = api_models.CartOrder.objects.get()
+        self.assertEqual((order.total, order.payment_status), (0, 'Paid'))
+        self.assertEqual(order.country, 'India')
+        self.assertEqual(len(response.data['order']['order_items']), 3)
+        self.assertEqual(order.teachers.count(), 3)
+        self.assertEqual(api_models.EnrolledCourse.objects.filter(user=self.student).count(), 3)
+        self.assertEqual(api_models.Notification.objects.filter(order=order, type='New Order', teacher__isnull=False).count(), 3)
+        self.assertEqual(api_models.Notification.objects.filter(order=order, user=self.student).count(), 3)
+        self.assertEqual(api_models.Cart.objects.get(user=self.student).total_cart_items(), 0)
+        for course in courses:
+            course.refresh_from_db()
+            self.assertEqual(course.total_students, 1)
+            self.assertEqual(api_models.Teacher.objects.get(id=course.teacher_id).total_students, 1)
+        self.assertEqual(self.client.post('/api/v1/cart/checkout/').status_code, 400)
+
+    def test_carts_to_pay_are_refused_and_kept(self):
+        self.fill_cart([self.make_course(0, students=0), self.make_course(1, price=10, students=0)])
+        response = self.client.post('/api/v1/cart/checkout/', {}, format='json')
+        self.assertEqual(response.status_code, 402)
+        self.assertFalse(api_models.CartOrder.objects.exists())
+        self.assertFalse(api_models.EnrolledCourse.objects.filter(user=self.student).exists())
+        self.assertEqual(api_models.Cart.objects.get(user=self.student).total_cart_items(), 2)
+
+    def test_paid_orders_enroll_only_once_payment_is_confirmed(self):
+        course = self.make_course(0, price=10, students=0)
+        self.fill_cart([course])
+        order = checkout.place_order(self.student, country='India')
+        self.assertEqual((order.total, order.payment_status), (10, 'Processing'))
+        self.assertFalse(api_models.EnrolledCourse.objects.filter(user=self.student).exists())
+
+        checkout.confirm_payment(order)
+        self.assertEqual(api_models.CartOrder.objects.get().payment_status, 'Paid')
+        self.assertTrue(api_models.EnrolledCourse.objects.filter(user=self.student, course=course).exists())
+        self.assertEqual(api_models.Course.objects.get(id=course.id).total_students, 1)
+        with self.assertRaises(checkout.CheckoutConflict):
+            checkout.confirm_payment(order)
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        self.fill_cart([self.make_course(0, students=0)])
+        small = self.checkout()[1]
+        self.student = self.make_user('buyer2')
+        self.fill_cart([self.make_course(index, students=0) for index in range(1, 6)])
+        self.assertEqual(self.checkout()[1], small)
+
+    def test_already_enrolled_courses_are_not_charged_again(self):
+        owned, new = self.make_course(0, students=0), self.make_course(1, students=0)
+        api_models.EnrolledCourse.objects.create(user=self.student, course=owned, teacher=owned.teacher)
+        self.fill_cart([owned, new])
+        order = self.checkout()[0]
+        self.assertEqual([item.course for item in order.order_items()], [new])
+        self.assertEqual(api_models.EnrolledCourse.objects.filter(user=self.student).count(), 2)
+
+    def test_concurrent_double_submit_enrolls_once(self):
+        self.fill_cart([self.make_course(index, students=0) for index in range(2)])
+        cart = api_models.Cart.objects.get(user=self.student)
+        # the second submit read the cart before the first one claimed it
+        stale_items = checkout._load_items(cart)
+        checkout.checkout(self.student)
+        with mock.patch.object(checkout, '_load_items', return_value=stale_items), \
+                mock.patch.object(checkout, '_enrolled_course_ids', return_value=set()):
+            with self.assertRaises(checkout.CheckoutConflict):
+                checkout.checkout(self.student)
+        self.assertEqual(api_models.CartOrder.objects.count(), 1)
+        self.assertEqual(api_models.EnrolledCourse.objects.filter(user=self.student).count(), 2)
+        self.assertEqual(api_models.Course.objects.filter(total_students=1).count(), 2)
+
+
+class EnrollmentProgressTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.course = self.make_course(0, students=0, sections=2, lectures=2)
+        self.lectures = list(api_models.Lecture.objects.filter(section__course=self.course).order_by('id'))
+        self.student = self.make_user('learner')
+        self.enrollment = api_models.EnrolledCourse.objects.create(user=self.student, course=self.course, teacher=self.course.teacher)
+        self.client.force_authenticate(self.student)
+
+    def progress(self):
+        return api_models.EnrolledCourse.objects.values('completed_lectures', 'total_lectures', 'progress', 'last_lecture').get(id=self.enrollment.id)
+
+    def complete(self, *lectures, course=None):
+        return self.client.post('/api/v1/student/lectures-completed/', {
+            'course_id': (course or self.course).id,
+            'lecture_ids': [lecture.id for lecture in lectures],
+        }, format='json')
+
+    def test_single_completions_update_progress(self):
+        self.assertEqual(self.progress(), {'completed_lectures': 0, 'total_lectures': 4, 'progress': 0, 'last_lecture': None})
+        done = api_models.CompletedLecture.objects.create(user=self.student, course=self.course, lesson=self.lectures[1])
+        self.assertEqual(self.progress(), {'completed_lectures': 1, 'total_lectures': 4, 'progress': 25, 'last_lecture': self.lectures[1].id})
+        done.delete()
+        self.assertEqual(self.progress()['progress'], 0)
+
+    def test_lecture_changes_move_totals(self):
+        api_models.CompletedLecture.objects.create(user=self.student, course=self.course, lesson=self.lectures[0])
+        self.lectures[3].delete()
+        self.assertEqual(self.progress()['total_lectures'], 3)
+        self.assertEqual(self.progress()['progress'], 33)
+        self.lectures[0].delete()
+        self.assertEqual(self.progress(), {'completed_lectures': 0, 'total_lectures': 2, 'progress': 0, 'last_lecture': None})
+
+    def test_bulk_completion_is_idempotent(self):
+        response = self.complete(*self.lectures[:3])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['progress'], 75)
+        response = self.complete(self.lectures[0], self.lectures[3], self.lectures[3])
+        self.assertEqual(response.data['completed_lectures'], 4)
+        self.assertEqual(response.data['progress'], 100)
+        self.assertEqual(response.data['last_lecture'], self.lectures[3].id)
+        self.assertEqual(api_models.CompletedLecture.objects.filter(user=self.student).count(), 4)
+
+    def test_repeated_completion_writes_nothing(self):
+        self.complete(self.lectures[0])
+        versions = get_versions([course_version(self.course.slug)])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.complete(self.lectures[0])
+        self.assertEqual(response.data['progress'], 25)
+        self.assertFalse([query for query in queries if query['sql'].startswith(('INSERT', 'UPDATE'))])
+        self.assertEqual(get_versions([course_version(self.course.slug)]), versions)
+
+    def test_bulk_completion_checks_course_and_enrollment(self):
+        other = self.make_course(1, students=0)
+        other_lecture = api_models.Lecture.objects.filter(section__course=other).first()
+        self.assertEqual(self.complete(other_lecture).status_code, 400)
+        self.assertEqual(self.complete(other_lecture, course=other).status_code, 404)
+        self.assertEqual(self.progress()['completed_lectures'], 0)
+
+    def test_progress_list_query_count_is_flat(self):
+        small = self.count_queries('/api/v1/student/progress/')
+        for index in range(1, 4):
+            course = self.make_course(index, students=0)
+            api_models.EnrolledCourse.objects.create(user=self.student, course=course, teacher=course.teacher)
+        self.assertEqual(self.count_queries('/api/v1/student/progress/'), small)
+        self.assertEqual(len(self.client.get('/api/v1/student/progress/').data['results']), 4)
+
+    def test_rebuild_stats_fixes_progress(self):
+        self.complete(self.lectures[0])
+        api_models.EnrolledCourse.objects.update(completed_lectures=3, progress=75)
+        out = StringIO()
+        call_command('rebuild_stats', stdout=out)
+        self.assertIn(f'EnrolledCourse {self.enrollment.id}: completed_lectures 3 -> 1, progress 75 -> 25', out.getvalue())
+        self.assertEqual(self.progress()['progress'], 25)
+
+
+@override_settings(ANALYTICS_ROLLUP_LAG=0)
+class AnalyticsRollupTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.course = self.make_course(0, students=3)
+        self.teacher = self.course.teacher
+        self.second = api_models.Course.objects.create(category=self.category, teacher=self.teacher, title='Second', description='Second', price=25)
+        self.client.force_authenticate(self.teacher.user)
+
+    def rollup(self, *args):
+        out = StringIO()
+        call_command('rollup_analytics', *args, stdout=out)
+        return out.getvalue()
+
+    def test_rollups_count_each_source(self):
+        returning = api_models.EnrolledCourse.objects.filter(course=self.course).first().user
+        api_models.EnrolledCourse.objects.create(user=returning, course=self.second, teacher=self.teacher)
+        buyer = self.make_user('buyer')
+        cart = api_models.Cart.objects.create(user=buyer)
+        api_models.CartOrderItem.objects.create(cart=cart, course=self.second)
+        checkout.confirm_payment(checkout.place_order(buyer))
+        api_models.Review.objects.create(user=buyer, course=self.second, review='Meh', rating=2)
+        self.rollup()
+
+        totals = analytics.totals(api_models.TeacherDailyStats.objects.filter(teacher=self.teacher))
+        self.assertEqual(totals['enrollments'], 5)
+        self.assertEqual(totals['students'], 4)
+        self.assertEqual(totals['revenue'], 25)
+        self.assertEqual(totals['reviews'], 4)
+        self.assertEqual((totals['rating_5'], totals['rating_2']), (3, 1))
+        self.assertEqual(totals['completions'], 3)
+        second = analytics.totals(api_models.CourseDailyStats.objects.filter(course=self.second))
+        self.assertEqual((second['enrollments'], second['students'], second['reviews']), (2, 2, 1))
+        self.assertEqual(self.teacher.students(), 4)
+
+    def test_runs_are_incremental(self):
+        self.assertIn('enrollments: 3 new rows', self.rollup())
+        self.assertIn('enrollments: 0 new rows', self.rollup())
+        api_models.EnrolledCourse.objects.create(user=self.make_user('late'), course=self.second, teacher=self.teacher)
+        self.assertIn('enrollments: 1 new rows', self.rollup('--batch-size', '1'))
+        self.assertEqual(analytics.totals(api_models.TeacherDailyStats.objects.all())['enrollments'], 4)
+        self.rollup('--rebuild')
+        self.assertEqual(analytics.totals(api_models.TeacherDailyStats.objects.all())['enrollments'], 4)
+
+    @override_settings(ANALYTICS_ROLLUP_LAG=60)
+    def test_recent_rows_wait_for_older_ids_to_commit(self):
+        enrollments = api_models.EnrolledCourse.objects.filter(course=self.course).order_by('id')
+        api_models.EnrolledCourse.objects.filter(id=enrollments[0].id).update(date=timezone.now() - timedelta(minutes=5))
+        self.assertIn('enrollments: 1 new rows', self.rollup())
+        # the second row is recent, so the third waits behind it however old it is
+        api_models.EnrolledCourse.objects.filter(id=enrollments[2].id).update(date=timezone.now() - timedelta(minutes=5))
+        self.assertIn('enrollments: 0 new rows', self.rollup())
+        enrollments.update(date=timezone.now() - timedelta(minutes=2))
+        self.assertIn('enrollments: 2 new rows', self.rollup())
+
+    def test_dashboard_reads_only_rollups(self):
+        self.rollup()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/teacher/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['recent']['enrollments'], 3)
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('api_enrolledcourse', tables)
+        self.assertNotIn('api_review', tables)
+
+        response = self.client.get(f'/api/v1/teacher/course-stats/{self.course.id}/?days=7')
+        self.assertEqual([row['enrollments'] for row in response.data], [3])
+
+        api_models.CourseDailyStats.objects.filter(course=self.course).update(day=timezone.localdate() - timedelta(days=10))
+        self.assertEqual(self.client.get('/api/v1/teacher/summary/?days=7').data['courses'], [])
+        self.assertEqual(len(self.client.get('/api/v1/teacher/summary/?days=30').data['courses']), 1)
+        self.assertEqual(len(self.client.get('/api/v1/teacher/daily-stats/').data), 1)
+
+    def test_dashboard_is_for_own_courses_only(self):
+        other = self.make_course(1, students=0)
+        self.assertEqual(self.client.get(f'/api/v1/teacher/course-stats/{other.id}/').status_code, 404)
+        self.client.force_authenticate(self.make_user('student'))
+        self.assertEqual(self.client.get('/api/v1/teacher/summary/').status_code, 403)
+
+
+class LectureMediaTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=media_root, MEDIA_OFFLOAD='')
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.course = self.make_course(0, students=0, sections=1, lectures=1)
+        self.content = bytes(range(256)) * 40
+        self.lecture = api_models.Lecture.objects.get(section__course=self.course)
+        self.lecture.file.save('intro.mp4', ContentFile(self.content))
+        self.url = f'/api/v1/course/lecture/{self.lecture.lecture_id}/media/'
+        self.student = self.make_user('learner')
+
+    def enroll(self):
+        return api_models.EnrolledCourse.objects.create(user=self.student, course=self.course, teacher=self.course.teacher)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_only_enrolled_users_or_previews_stream(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_authenticate(self.student)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.enroll()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        api_models.Lecture.objects.filter(id=self.lecture.id).update(preview=True)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_payloads_link_the_checked_endpoint_only(self):
+        course = self.client.get(f'/api/v1/course/course-detail/{self.course.slug}').json()
+        lecture = course['curriculum'][0]['lectures'][0]
+        self.assertEqual(lecture['media_url'], self.url)
+        self.assertNotIn('file', lecture)
+        self.assertNotIn('/media/lectures/', json.dumps(course))
+
+    def test_access_check_is_cached_until_enrollment_changes(self):
+        self.client.force_authenticate(self.student)
+        enrollment = self.enroll()
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertNotIn('api_enrolledcourse', ' '.join(query['sql'] for query in queries.captured_queries))
+        enrollment.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_range_requests(self):
+        self.client.force_authenticate(self.student)
+        self.enroll()
+        size = len(self.content)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{size}')
+        self.assertEqual(self.body(response), self.content[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(self.body(response), self.content[-10:])
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={size - 5}-')
+        self.assertEqual(response['Content-Length'], '5')
+
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={size}-').status_code, 416)
+
+    def test_transfer_can_be_offloaded(self):
+        self.client.force_authenticate(self.student)
+        self.enroll()
+        with override_settings(MEDIA_OFFLOAD='x-accel-redirect', MEDIA_ACCEL_PREFIX='/protected-media/'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.lecture.file.name}')
+        self.assertEqual(response.content, b'')
+        with override_settings(MEDIA_OFFLOAD='x-sendfile'):
+            self.assertEqual(self.client.get(self.url)['X-Sendfile'], self.lecture.file.path)
+
+    def test_lecture_files_are_not_public(self):
+        self.assertEqual(self.client.get(f'/media/{self.lecture.file.name}').status_code, 404)
+
+
+def mp4_box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def mp4_file(seconds, timescale=1000, version=0, mdat_size=200 * 1024):
+    if version == 1:
+        mvhd = b'\x01\x00\x00\x00' + struct.pack('>QQIQ', 0, 0, timescale, int(seconds * timescale))
+    else:
+        mvhd = b'\x00\x00\x00\x00' + struct.pack('>IIII', 0, 0, timescale, int(seconds * timescale))
+    moov = mp4_box(b'moov', mp4_box(b'mvhd', mvhd + bytes(80)))
+    return mp4_box(b'ftyp', b'isom\x00\x00\x02\x00') + mp4_box(b'mdat', bytes(range(256)) * (mdat_size // 256)) + moov
+
+
+class LectureUploadTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media_root, upload_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.addCleanup(shutil.rmtree, upload_dir)
+        self.settings_override = override_settings(MEDIA_ROOT=media_root, CHUNKED_UPLOAD_DIR=upload_dir)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.course = self.make_course(0, students=0, sections=1, lectures=1)
+        self.lecture = api_models.Lecture.objects.get(section__course=self.course)
+        self.client.force_authenticate(self.course.teacher.user)
+        self.content = mp4_file(125.4)
+
+    def start(self, **extra):
+        response = self.client.post('/api/v1/teacher/lecture-upload/', {
+            'lecture_id': self.lecture.lecture_id, 'filename': 'intro.mp4', 'size': len(self.content), 'chunk_size': 64 * 1024, **extra,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def put_chunk(self, upload, index, data=None, checksum=None):
+        data = self.content[index * upload['chunk_size']:(index + 1) * upload['chunk_size']] if data is None else data
+        return self.client.put(
+            f"/api/v1/teacher/lecture-upload/{upload['upload_id']}/chunk/{index}/", data,
+            content_type='application/octet-stream', HTTP_X_CHUNK_SHA256=checksum or hashlib.sha256(data).hexdigest(),
+        )
+
+    def finalize(self, upload):
+        return self.client.post(f"/api/v1/teacher/lecture-upload/{upload['upload_id']}/finalize/", {}, format='json')
+
+    def test_out_of_order_chunks_are_assembled_and_timed(self):
+        upload = self.start(checksum=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(upload['total_chunks'], 4)
+        for index in (3, 1, 0, 2):
+            self.assertEqual(self.put_chunk(upload, index).status_code, 200)
+        response = self.finalize(upload)
+        self.assertEqual(response.status_code, 200)
+
+        self.lecture.refresh_from_db()
+        with self.lecture.file.open('rb') as handle:
+            self.assertEqual(handle.read(), self.content)
+        self.assertEqual(self.lecture.duration, 125)
+        self.assertEqual(self.lecture.content_duration, '00:02:05')
+        self.assertEqual(api_models.Course.objects.get(id=self.course.id).total_duration, 125)
+        self.assertEqual(os.listdir(settings.CHUNKED_UPLOAD_DIR), [])
+
+    def test_bad_chunks_are_rejected_and_resumable(self):
+        upload = self.start()
+        self.assertEqual(self.put_chunk(upload, 0, checksum='0' * 64).status_code, 400)
+        self.assertEqual(self.put_chunk(upload, 1, data=b'short').status_code, 400)
+        self.assertEqual(self.put_chunk(upload, 9).status_code, 400)
+        self.put_chunk(upload, 2)
+        response = self.client.get(f"/api/v1/teacher/lecture-upload/{upload['upload_id']}/")
+        self.assertEqual(response.data['received_chunks'], [2])
+        self.assertEqual(self.finalize(upload).status_code, 400)
+
+        for index in (0, 1, 3):
+            self.put_chunk(upload, index)
+        self.assertEqual(self.finalize(upload).status_code, 200)
+
+    def test_whole_file_checksum_is_verified(self):
+        upload = self.start(checksum='0' * 64)
+        for index in range(upload['total_chunks']):
+            self.put_chunk(upload, index)
+        self.assertEqual(self.finalize(upload).status_code, 400)
+        self.lecture.refresh_from_db()
+        self.assertFalse(self.lecture.file)
+
+    @override_settings(MAX_LECTURE_UPLOAD_SIZE=1024)
+    def test_size_is_capped(self):
+        response = self.client.post('/api/v1/teacher/lecture-upload/', {
+            'lecture_id': self.lecture.lecture_id, 'filename': 'intro.mp4', 'size': 1025,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('size', response.data)
+        self.assertEqual(os.listdir(settings.CHUNKED_UPLOAD_DIR), [])
+
+    def test_expired_part_file_is_a_client_error(self):
+        upload = self.start()
+        os.remove(os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{upload['upload_id']}.part"))
+        response = self.put_chunk(upload, 0)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('expired', response.data['detail'])
+        self.assertEqual(self.finalize(upload).status_code, 400)
+
+    def test_only_the_course_teacher_can_upload(self):
+        self.client.force_authenticate(self.make_user('student'))
+        response = self.client.post('/api/v1/teacher/lecture-upload/', {
+            'lecture_id': self.lecture.lecture_id, 'filename': 'intro.mp4', 'size': 10,
+        }, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_mp4_duration_parsing(self):
+        from api.media import mp4_duration
+        path = os.path.join(settings.CHUNKED_UPLOAD_DIR, 'sample.mp4')
+        for content, expected in ((mp4_file(3600.5, timescale=90000, version=1), 3600.5), (mp4_file(2), 2), (b'not a video at all', None)):
+            with open(path, 'wb') as handle:
+                handle.write(content)
+            self.assertEqual(mp4_duration(path), expected)
+
+
+class TokenBucketThrottleTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(email='learner@example.com', username='learner', full_name='learner', password='pass12345')
+
+    def reset(self, email):
+        return self.client.get(f'/api/v1/user/password-reset/{email}/')
+
+    def test_email_bucket_refuses_with_retry_after_then_refills(self):
+        now = time.time()
+        with mock.patch('api.throttling.time.time', return_value=now):
+            self.assertEqual([self.reset('learner@example.com').status_code for _ in range(3)], [200] * 3)
+            response = self.reset('Learner@example.com')
+            self.assertEqual(response.status_code, 429)
+            # 3/hour refills a token every 20 minutes
+            self.assertEqual(response['Retry-After'], '1200')
+            # other addresses only count against the ip bucket
+            self.assertEqual(self.reset('other@example.com').status_code, 200)
+
+        with mock.patch('api.throttling.time.time', return_value=now + 1200):
+            self.assertEqual(self.reset('learner@example.com').status_code, 200)
+            self.assertEqual(self.reset('learner@example.com').status_code, 429)
+
+    def test_ip_bucket_covers_every_email(self):
+        statuses = [self.reset(f'user{index}@example.com').status_code for index in range(11)]
+        self.assertEqual(statuses, [200] * 10 + [429])
+
+    def test_forwarded_for_is_only_trusted_behind_a_proxy(self):
+        statuses = [
+            self.client.get(f'/api/v1/user/password-reset/user{index}@example.com/', HTTP_X_FORWARDED_FOR=f'10.0.0.{index}').status_code
+            for index in range(11)
+        ]
+        self.assertEqual(statuses, [200] * 10 + [429])
+
+        cache.clear()
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            statuses = [
+                self.client.get(f'/api/v1/user/password-reset/user{index}@example.com/', HTTP_X_FORWARDED_FOR=f'10.0.0.{index}').status_code
+                for index in range(11)
+            ]
+        self.assertEqual(statuses, [200] * 11)
+
+    def test_refused_login_does_not_hash_the_password(self):
+        for _ in range(10):
+            self.client.post('/api/v1/user/token', {'email': 'learner@example.com', 'password': 'wrong'})
+        with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.verify') as verify:
+            response = self.client.post('/api/v1/user/token', {'email': 'learner@example.com', 'password': 'pass12345'})
+        self.assertEqual(response.status_code, 429)
+        verify.assert_not_called()
+
+
+class SeedLmsTest(TestCase):
+
+    def seed(self):
+        out = StringIO()
+        call_command('seed_lms', '--users', '60', '--teachers', '5', '--courses', '12', '--enrollments', '200', '--batch-size', '50', '--seed', '7', stdout=out)
+        return out.getvalue()
+
+    def fingerprint(self):
+        return (
+            list(api_models.Course.objects.order_by('course_id').values_list('course_id', 'title', 'total_students')),
+            api_models.CompletedLecture.objects.count(),
+            list(api_models.QuestionAnswerResponse.objects.order_by('qam_id').values_list('qam_id', flat=True)),
+        )
+
+    def test_seed_is_consistent_and_reproducible(self):
+        with transaction.atomic():
+            output = self.seed()
+            self.assertIn('users log in with', output)
+            self.assertEqual(User.objects.count(), 60)
+            self.assertEqual(Profile.objects.count(), 60)
+            self.assertGreater(api_models.EnrolledCourse.objects.count(), 0)
+            self.assertTrue(api_models.QuestionAnswerResponse.objects.exists())
+
+            out = StringIO()
+            call_command('rebuild_stats', '--dry-run', stdout=out)
+            self.assertIn('found 0 rows', out.getvalue())
+            self.client.force_login(User.objects.get(username='seed30'))
+            self.assertEqual(self.client.get('/api/v1/student/progress/').status_code, 200)
+            first = self.fingerprint()
+            transaction.set_rollback(True)
+
+        self.seed()
+        self.assertEqual(self.fingerprint(), first)
+
+    def test_refuses_to_seed_twice(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class BenchApiTest(TestCase):
+
+    def setUp(self):
+        call_command('seed_lms', '--users', '30', '--teachers', '3', '--courses', '6', '--enrollments', '60', stdout=StringIO())
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.output = os.path.join(directory, 'bench.json')
+
+    def bench(self, *args):
+        out = StringIO()
+        call_command('bench_api', '--iterations', '2', '--warmup', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_results_are_recorded_and_compared(self):
+        self.bench('--output', self.output)
+        with open(self.output) as handle:
+            report = json.load(handle)
+        # every route runs anonymously and authenticated
+        self.assertEqual(len(report['results']), 2 * len(api_urls.urlpatterns))
+        row = report['results']['GET course/course-list/ [anon]']
+        self.assertEqual(row['status'], 200)
+        self.assertGreater(row['bytes'], 0)
+        self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+        self.assertEqual(report['results']['GET student/progress/ [auth]']['status'], 200)
+        self.assertEqual(report['results']['GET teacher/summary/ [auth]']['status'], 200)
+        self.assertEqual(report['results']['GET student/progress/ [anon]']['status'], 401)
+        # the benchmark leaves no trace
+        self.assertFalse(User.objects.filter(email='audit-new@example.com').exists())
+
+        self.assertIn('No regressions', self.bench('--baseline', self.output, '--route', 'course/'))
+
+        for key, row in report['results'].items():
+            if key.startswith('GET course/category/'):
+                row['queries'] -= 1
+        with open(self.output, 'w') as handle:
+            json.dump(report, handle)
+        with self.assertRaisesMessage(CommandError, 'regressions'):
+            self.bench('--baseline', self.output, '--route', 'course/category/')
+
+
+class AuditQueryPlansTest(TestCase):
+
+    def test_api_endpoints_pass_the_plan_audit(self):
+        out = StringIO()
+        call_command('audit_query_plans', '--courses', '4', '--students', '4', '--min-rows', '10', stdout=out)
+        self.assertIn('GET    /api/v1/course/course-list/ -> 200', out.getvalue())
+
+    def test_existing_data_is_never_kept(self):
+        with self.assertRaises(CommandError):
+            call_command('audit_query_plans', '--no-seed', '--keep', stdout=StringIO())
+
+    def test_full_scans_and_sorts_are_reported(self):
+        from api.management.commands.audit_query_plans import Command
+        command = Command()
+        command.row_counts = {'api_note': 1000}
+        reasons = command.check_plan('SELECT * FROM "api_note" ORDER BY "api_note"."title"', min_rows=10)
+        self.assertEqual(len(reasons), 2)
+
+
+class AsyncViewsTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.course = self.make_course(0)
+        self.make_course(1)
+        self.student = self.make_user('buyer')
+
+    def call(self, view, path, user=None, data=None, headers=None, **kwargs):
+        '''Runs an async view on an event loop thread, where a lazy query would raise SynchronousOnlyOperation'''
+        factory = AsyncRequestFactory()
+        if data is None:
+            request = factory.get(path, headers=headers)
+        else:
+            request = factory.post(path, data, content_type='application/json')
+        if user is not None:
+            force_authenticate(request, user)
+        response = async_to_sync(view.as_view())(request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_catalog_matches_sync_views(self):
+        detail = f'/api/v1/course/course-detail/{self.course.slug}'
+        cases = [
+            (async_views.CategoryListAPIView, '/api/v1/course/category/', {}),
+            (async_views.CourseListAPIView, '/api/v1/course/course-list/?page_size=1', {}),
+            (async_views.CourseDetailAPIView, detail, {'slug': self.course.slug}),
+        ]
+        for view, path, kwargs in cases:
+            with self.subTest(path=path):
+                expected = self.client.get(path).json()
+                cache.clear()
+                response = self.call(view, path, **kwargs)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), expected)
+        self.assertEqual(expected['title'], self.course.title)
+
+    def test_cached_response_and_304(self):
+        path = '/api/v1/course/course-list/'
+        first = self.call(async_views.CourseListAPIView, path)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.call(async_views.CourseListAPIView, path)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(second.content, first.content)
+        response = self.call(async_views.CourseListAPIView, path, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_course_is_404(self):
+        response = self.call(async_views.CourseDetailAPIView, '/api/v1/course/course-detail/none', slug='none')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cart_add_and_list(self):
+        response = self.call(async_views.CartView, '/api/v1/cart/list/')
+        self.assertEqual(response.status_code, 401)
+
+        response = self.call(async_views.AddToCartView, '/api/v1/cart/add/', self.student, {'course_id': self.course.id})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)['cart']['total_cart_items'], 1)
+        response = self.call(async_views.AddToCartView, '/api/v1/cart/add/', self.student, {'course_id': self.course.id})
+        self.assertEqual(response.status_code, 200)
+        response = self.call(async_views.AddToCartView, '/api/v1/cart/add/', self.student, {'course_id': 0})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.call(async_views.CartView, '/api/v1/cart/list/', self.student)
+        self.assertEqual(response.status_code, 200)
+        items = json.loads(response.content)['cart_items']
+        self.assertEqual([item['course_title'] for item in items], [self.course.title])
+
+
+class BenchConcurrencyTest(CatalogFixtureMixin, TransactionTestCase):
+    '''A TransactionTestCase, the benchmark serves requests from other threads'''
+
+    def test_servers_answer_every_request(self):
+        self.category = api_models.Category.objects.create(title='Programming')
+        self.make_course(0, students=1)
+        for name in [name for name, (_, views) in CONFIGS.items() if views == settings.ASYNC_VIEWS]:
+            with self.subTest(name=name):
+                out = StringIO()
+                call_command('bench_concurrency', '--child', name, '--clients', '1,8', '--requests', '2', '--threads', '2', stdout=out)
+                results = json.loads(out.getvalue())
+                self.assertEqual(results['8']['requests'], 16)
+                self.assertEqual(results['8']['statuses'], {'200': 16})
+                self.assertLessEqual(results['8']['p50_ms'], results['8']['p99_ms'])
+
+    def test_child_refuses_the_wrong_views(self):
+        wrong = next(name for name, (_, views) in CONFIGS.items() if views != settings.ASYNC_VIEWS)
+        with self.assertRaisesMessage(CommandError, 'needs ASYNC_VIEWS='):
+            call_command('bench_concurrency', '--child', wrong, '--clients', '1', stdout=StringIO())
+
+
+class BenchSqliteWritesTest(TransactionTestCase):
+    '''A TransactionTestCase, the benchmark writes from other threads'''
+
+    @override_settings(SQLITE_WRITE_QUEUE=True)
+    def test_child_reports_throughput(self):
+        call_command('seed_lms', '--users', '10', '--teachers', '2', '--courses', '3', '--enrollments', '20', stdout=StringIO())
+        out = StringIO()
+        call_command('bench_sqlite_writes', '--child', 'tuned+queue', '--seconds', '0.5', '--writers', '3', '--readers', '1', stdout=out)
+        row = json.loads(out.getvalue())
+        self.assertGreater(row['writes'], 0)
+        self.assertGreater(row['reads'], 0)
+        # the in-memory test database locks whole tables, so 'locked' says nothing here
+        self.assertGreaterEqual(row['batch_size'], 1)
+        self.assertLessEqual(row['write_p50_ms'], row['write_p99_ms'])
+        self.assertTrue(api_models.CompletedLecture.objects.exists())
+
+
+class NotificationTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.course = self.make_course(0, students=0)
+        self.teacher_user = self.course.teacher.user
+        self.student = self.make_user('asker')
+
+    def unread(self, user):
+        self.client.force_authenticate(user)
+        return self.client.get('/api/v1/notification/unread/').data['unread']
+
+    def test_reviews_questions_and_answers_notify(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            api_models.Review.objects.create(user=self.student, course=self.course, review='Good', rating=5)
+            question = api_models.QuestionAnswer.objects.create(user=self.student, course=self.course, title='Why?')
+            api_models.QuestionAnswerResponse.objects.create(user=self.teacher_user, course=self.course, question=question, message='Because')
+            # answering your own question notifies nobody
+            api_models.QuestionAnswerResponse.objects.create(user=self.student, course=self.course, question=question, message='Thanks')
+
+        teacher_types = api_models.Notification.objects.filter(teacher=self.course.teacher).values_list('type', flat=True)
+        self.assertEqual(sorted(teacher_types), ['New QandA', 'New Review'])
+        self.assertEqual(list(api_models.Notification.objects.filter(user=self.student).values_list('type', flat=True)), ['New QandA'])
+
+        self.client.force_authenticate(self.teacher_user)
+        response = self.client.get('/api/v1/notification/list/')
+        self.assertEqual([row['type'] for row in response.data['results']], ['New QandA', 'New Review'])
+
+    def test_unread_counter_is_cached_and_kept_up_to_date(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            api_models.Notification.objects.fan_out([api_models.Notification(user=self.student, type='New QandA')])
+        self.assertEqual(self.unread(self.student), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(api_models.Notification.objects.unread_count(self.student), 1)
+
+        # checkout counts its notifications in, for the student and the teacher
+        cart, _ = api_models.Cart.objects.get_or_create(user=self.student)
+        api_models.CartOrderItem.objects.create(cart=cart, course=self.course)
+        self.assertEqual(self.unread(self.teacher_user), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout.confirm_payment(checkout.place_order(self.student))
+        with self.assertNumQueries(0):
+            self.assertEqual(api_models.Notification.objects.unread_count(self.student), 2)
+            self.assertEqual(api_models.Notification.objects.unread_count(self.teacher_user), 1)
+
+        # single saves drop the counter, it is recounted
+        with self.captureOnCommitCallbacks(execute=True):
+            api_models.Notification.objects.filter(user=self.student).first().delete()
+        self.assertEqual(self.unread(self.student), 1)
+
+    def test_mark_all_seen_is_one_update(self):
+        api_models.Notification.objects.fan_out([
+            api_models.Notification(user=self.student, type='New QandA') for _ in range(3)
+        ])
+        self.client.force_authenticate(self.student)
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/v1/notification/mark-all-seen/')
+        self.assertEqual(response.data, {'updated': 3, 'unread': 0})
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries.captured_queries), 1)
+        self.assertFalse(api_models.Notification.objects.unseen().exists())
+        with self.assertNumQueries(0):
+            self.assertEqual(api_models.Notification.objects.unread_count(self.student), 0)
+
+    def test_wsgi_stream_sends_the_count_and_ends(self):
+        self.client.force_authenticate(self.student)
+        response = self.client.get('/api/v1/notification/stream/', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(list(response.streaming_content), [
+            f'retry: {settings.NOTIFICATION_WSGI_RETRY * 1000}\n\n'.encode(), b'event: unread\ndata: {"unread": 0}\n\n',
+        ])
+
+    @override_settings(NOTIFICATION_STREAM_POLL=0)
+    def test_stream_sends_the_count_when_it_changes(self):
+        events = iter(notifications.UnreadStream(lambda: api_models.Notification.objects.unread_count(self.student), seconds=5))
+        self.assertEqual(next(events), 'retry: 0\n\n')
+        self.assertEqual(next(events), 'event: unread\ndata: {"unread": 0}\n\n')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            api_models.Notification.objects.fan_out([api_models.Notification(user=self.student, type='New QandA')])
+        self.assertEqual(next(events), 'event: unread\ndata: {"unread": 1}\n\n')
+        events.close()
+
+    def test_stream_needs_a_user(self):
+        response = APIClient().get('/api/v1/notification/stream/', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(response.content.startswith(b'event: error\n'))
+
+
+class QuestionAnswerThreadTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.course = self.make_course(0, students=2, sections=1, lectures=1)
+        self.teacher_user = self.course.teacher.user
+
+    def reply(self, question, user, message):
+        return api_models.QuestionAnswerResponse.objects.create(course=self.course, question=question, user=user, message=message)
+
+    def test_thread_list_query_count_is_flat(self):
+        url = f'/api/v1/course/question-answer/{self.course.slug}/'
+        small = self.count_queries(url)
+        student = self.make_user('busy')
+        for index in range(5):
+            question = api_models.QuestionAnswer.objects.create(user=student, course=self.course, title=f'Question {index}')
+            for number in range(4):
+                self.reply(question, self.teacher_user if number % 2 else student, f'Reply {number}')
+        cache.clear()
+        self.assertEqual(self.count_queries(url), small)
+
+    def test_threads_carry_reply_count_and_latest_reply(self):
+        student = self.make_user('asker')
+        question = api_models.QuestionAnswer.objects.create(user=student, course=self.course, title='Newest')
+        self.reply(question, student, 'First')
+        self.reply(question, self.teacher_user, 'Last')
+        api_models.QuestionAnswer.objects.create(user=student, course=self.course, title='Unanswered')
+
+        threads = self.client.get(f'/api/v1/course/question-answer/{self.course.slug}/').data['results']
+        self.assertEqual(len(threads), 4)
+        unanswered, newest = threads[0], threads[1]
+        self.assertEqual((unanswered['title'], unanswered['reply_count'], unanswered['latest_reply']), ('Unanswered', 0, None))
+        self.assertEqual((newest['title'], newest['reply_count']), ('Newest', 2))
+        self.assertEqual(newest['latest_reply']['message'], 'Last')
+        self.assertEqual(newest['latest_reply']['profile']['user'], self.teacher_user.id)
+        self.assertEqual(newest['profile']['user'], student.id)
+        self.assertNotIn('messages', newest)
+
+    def test_messages_are_paginated_oldest_first(self):
+        question = api_models.QuestionAnswer.objects.filter(course=self.course).first()
+        for number in range(4):
+            self.reply(question, self.teacher_user, f'Reply {number}')
+        url = f'/api/v1/course/question-answer/{self.course.slug}/{question.qa_id}/'
+
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get(url, {'page_size': 3}).data
+        self.assertEqual([row['message'] for row in first['results']], ['Answer', 'Reply 0', 'Reply 1'])
+        self.assertEqual(first['results'][0]['profile']['user'], self.teacher_user.id)
+        # the thread lookup and the page, profiles ride along
+        self.assertEqual(len(queries), 2)
+
+        second = self.client.get(first['next']).data
+        self.assertEqual([row['message'] for row in second['results']], ['Reply 2', 'Reply 3'])
+        self.assertIsNone(second['next'])
+
+    def test_unknown_course_or_thread_is_404(self):
+        question = api_models.QuestionAnswer.objects.filter(course=self.course).first()
+        other = self.make_course(1, students=0)
+        self.assertEqual(self.client.get('/api/v1/course/question-answer/no-such-course/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/v1/course/question-answer/{other.slug}/{question.qa_id}/').status_code, 404)
+
+
+class CartPricingTest(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.courses = [self.make_course(index, students=0, sections=1, lectures=1) for index in range(3)]
+        for course, price in zip(self.courses, ('10.00', '25.00', '19.99')):
+            course.price = Decimal(price)
+            course.save()
+        self.student = self.make_user('buyer')
+        self.client.force_authenticate(self.student)
+        self.cart = api_models.Cart.objects.create(user=self.student)
+        for course in self.courses:
+            api_models.CartOrderItem.objects.create(cart=self.cart, course=course)
+        api_models.Country.objects.create(name='India', tax_rate=Decimal('18.00'))
+        self.coupon = api_models.Coupon.objects.create(teacher=self.courses[1].teacher, code='HALF', discount=50, active=True)
+        api_models.Coupon.objects.create(teacher=self.courses[1].teacher, code='TENTH', discount=10, active=True)
+
+    def test_cart_is_priced_in_one_query_and_cached(self):
+        # loads this process' copy of the countries
+        pricing.tax_rate('India')
+        with self.assertNumQueries(1):
+            totals = pricing.price_cart(self.cart, 'india', ['TENTH', 'HALF', 'NOPE'])
+        self.assertEqual(totals['items'], 3)
+        self.assertEqual(totals['sub_total'], Decimal('54.99'))
+        self.assertEqual(totals['saved'], Decimal('12.50'))
+        # (10.00 + 12.50 + 19.99) * 18%, rounded per line
+        self.assertEqual(totals['tax_fee'], Decimal('1.80') + Decimal('2.25') + Decimal('3.60'))
+        self.assertEqual(totals['total'], Decimal('54.99') - Decimal('12.50') + Decimal('7.65'))
+        self.assertEqual(totals['coupons'], ['HALF'])
+        with self.assertNumQueries(0):
+            self.assertEqual(pricing.price_cart(self.cart, 'India', ['NOPE', 'HALF', 'TENTH']), totals)
+
+    def test_totals_follow_what_they_are_built_from(self):
+        price = lambda: pricing.price_cart(self.cart, 'India', ['HALF'])['total']
+        self.assertEqual(price(), Decimal('50.14'))
+
+        api_models.CartOrderItem.objects.filter(cart=self.cart, course=self.courses[2]).delete()
+        self.assertEqual(price(), Decimal('26.55'))
+
+        self.courses[0].price = Decimal('20.00')
+        self.courses[0].save()
+        self.assertEqual(price(), Decimal('38.35'))
+
+        country = api_models.Country.objects.get(name='India')
+        country.tax_rate = Decimal('0.00')
+        country.save()
+        self.assertEqual(price(), Decimal('32.50'))
+
+        self.coupon.used_by.add(self.student)
+        self.assertEqual(price(), Decimal('45.00'))
+
+    def test_checkout_charges_what_the_cart_shows(self):
+        response = self.client.get('/api/v1/cart/pricing/', {'country': 'India', 'coupons': 'HALF'})
+        self.assertEqual(response.status_code, 200)
+        shown = response.data
+        self.assertEqual((shown['total'], shown['coupons']), ('50.14', ['HALF']))
+
+        placed = checkout.place_order(self.student, country='India', coupons=['HALF'])
+        order = api_serializers.CartOrderSerializer(placed).data
+        for field in ('sub_total', 'saved', 'tax_fee', 'total'):
+            self.assertEqual(order[field], shown[field])
+        line = next(item for item in order['order_items'] if item['course'] == self.courses[1].id)
+        self.assertEqual((line['initial_total'], line['saved'], line['tax_fee'], line['total']), ('25.00', '12.50', '2.25', '14.75'))
+        self.assertTrue(self.coupon.used_by.filter(pk=self.student.pk).exists())
+        self.assertEqual(placed.coupons, self.coupon)
+
+        # a used coupon does not apply again, and the emptied cart is priced fresh
+        self.assertEqual(pricing.price_cart(self.cart, 'India', ['HALF'])['items'], 0)
+
+
+class DuplicateRowsMigrationTest(TransactionTestCase):
+    '''0007 and 0008 add unique constraints the old schema did not enforce'''
+
+    def migrate(self, target):
+        from django.db.migrations.executor import MigrationExecutor
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+        return executor.loader.project_state(target).apps
+
+    def tearDown(self):
+        from django.db.migrations.loader import MigrationLoader
+        self.migrate(MigrationLoader(connection).graph.leaf_nodes('api')[0])
+
+    def test_duplicates_are_dropped_keeping_the_oldest(self):
+        apps = self.migrate(('api', '0006_hot_path_indexes'))
+        user = apps.get_model('usersauth', 'User').objects.create(email='dup@example.com', username='dup', full_name='dup')
+        category = apps.get_model('api', 'Category').objects.create(title='Programming')
+        course = apps.get_model('api', 'Course').objects.create(category=category, title='Course', slug='course')
+        section = apps.get_model('api', 'Section').objects.create(course=course, title='Section')
+        lecture = apps.get_model('api', 'Lecture').objects.create(section=section, title='Lecture')
+        EnrolledCourse = apps.get_model('api', 'EnrolledCourse')
+        CompletedLecture = apps.get_model('api', 'CompletedLecture')
+        for index in range(3):
+            EnrolledCourse.objects.create(user=user, course=course, enrollment_id=f'enrol-{index}')
+        # without a user there is nothing to be unique about
+        EnrolledCourse.objects.create(user=None, course=course, enrollment_id='enrol-a')
+        EnrolledCourse.objects.create(user=None, course=course, enrollment_id='enrol-b')
+        completions = [CompletedLecture.objects.create(user=user, course=course, lesson=lecture) for _ in range(2)]
+
+        apps = self.migrate(('api', '0008_enrollment_progress'))
+        self.assertEqual(
+            sorted(apps.get_model('api', 'EnrolledCourse').objects.values_list('enrollment_id', flat=True)),
+            ['enrol-0', 'enrol-a', 'enrol-b'],
+        )
+        self.assertEqual(list(apps.get_model('api', 'CompletedLecture').objects.values_list('id', flat=True)), [completions[0].id])
@@ -0,0 +1,121 @@
+'''
+Token-bucket throttles for the anonymous auth endpoints.
+
+A view sets `throttle_scope` and lists the buckets it wants in
+`throttle_classes`; each bucket reads its rate from
+REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] under '<scope>.<kind>', e.g.
+'login.ip': '20/min' allows a burst of 20 and refills 20 tokens a minute.
+A kind without a rate is not throttled.
+
+A bucket is two cache entries, the time it was last full and the number of
+tokens taken since. A request costs one get_many and one atomic incr, and a
+refused request one decr to hand its token back. Entries expire
+EXPIRY_PERIODS refill periods after the bucket was last full, when it is full
+again anyway; a client using every token for that long gets one extra burst.
+'''
+import hashlib
+import time
+
+from django.core.cache import cache as default_cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+EXPIRY_PERIODS = 10
+
+
+def parse_rate(rate):
+    '''"20/min" -> (capacity 20, 20 / 60 tokens per second)'''
+    capacity, period = rate.split('/')
+    capacity = int(capacity)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+def _field(request, view, name):
+    value = view.kwargs.get(name)
+    if value is None and hasattr(request.data, 'get'):
+        value = request.data.get(name)
+    return None if value in (None, '') else str(value)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    cache = default_cache
+    kind = None
+
+    def __init__(self):
+        self.retry_after = None
+
+    def get_ident_value(self, request, view):
+        '''The value the bucket is keyed on, or None to skip this request'''
+        raise NotImplementedError('.get_ident_value() must be overridden')
+
+    def get_rate(self, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(f'{scope}.{self.kind}') if scope else None
+        return parse_rate(rate) if rate else None
+
+    def allow_request(self, request, view):
+        rate = self.get_rate(view)
+        value = self.get_ident_value(request, view) if rate else None
+        if value is None:
+            return True
+        capacity, per_second = rate
+
+        digest = hashlib.sha1(str(value).encode()).hexdigest()
+        start_key = f'throttle:{view.throttle_scope}:{self.kind}:{digest}:start'
+        taken_key = f'throttle:{view.throttle_scope}:{self.kind}:{digest}:taken'
+        now = time.time()
+        state = self.cache.get_many([start_key, taken_key])
+        start, taken = state.get(start_key), state.get(taken_key)
+
+        if start is None or taken is None or taken <= (now - start) * per_second:
+            # the bucket has refilled: start counting again from a full one
+            self.cache.set_many({start_key: now, taken_key: 1}, EXPIRY_PERIODS * capacity / per_second)
+            return True
+
+        try:
+            taken = self.cache.incr(taken_key)
+        except ValueError:
+            return True  # expired between the two calls, so the bucket is full
+        overdraft = taken - capacity - (now - start) * per_second
+        if overdraft <= 0:
+            return True
+        try:
+            self.cache.decr(taken_key)
+        except ValueError:
+            pass
+        self.retry_after = overdraft / per_second
+        return False
+
+    def wait(self):
+        return self.retry_after
+
+
+class IPBucketThrottle(TokenBucketThrottle):
+    kind = 'ip'
+
+    def get_ident_value(self, request, view):
+        return self.get_ident(request)
+
+
+class EmailBucketThrottle(TokenBucketThrottle):
+    '''Keyed on the email in the URL or the request body'''
+    kind = 'email'
+
+    def get_ident_value(self, request, view):
+        email = _field(request, view, 'email')
+        return email.strip().lower() if email else None
+
+
+class UserBucketThrottle(TokenBucketThrottle):
+    '''
+    Keyed on the authenticated user, or for anonymous requests on the account
+    a view names in the request body through `throttle_user_field`
+    '''
+    kind = 'user'
+
+    def get_ident_value(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        field = getattr(view, 'throttle_user_field', None)
+        return _field(request, view, field) if field else None
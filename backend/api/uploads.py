@@ -0,0 +1,151 @@
+'''
+Resumable chunked lecture uploads.
+
+start() reserves a sparse file of the final size under CHUNKED_UPLOAD_DIR,
+write_chunk() streams one chunk from the request body straight to its offset
+while hashing it, and finish() checks every chunk arrived, verifies the
+whole-file checksum when the client sent one, reads the duration from the MP4
+movie header and moves the file into the lecture's storage. Chunks can arrive
+in any order and be resent; memory use does not depend on file or chunk size.
+'''
+import hashlib
+import os
+import shutil
+from struct import error as struct_error
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from api import models as api_models
+from api.media import mp4_duration
+
+READ_SIZE = 64 * 1024
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+EXPIRED = 'This upload has expired, start it again'
+
+
+def part_path(upload):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{upload.upload_id}.part')
+
+
+def start(lecture, user, filename, size, chunk_size=None, checksum=''):
+    chunk_size = min(max(chunk_size or DEFAULT_CHUNK_SIZE, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+    upload = api_models.LectureUpload.objects.create(
+        lecture=lecture,
+        user=user,
+        filename=os.path.basename(filename),
+        size=size,
+        chunk_size=chunk_size,
+        checksum=checksum.lower(),
+    )
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    with open(part_path(upload), 'wb') as handle:
+        # sparse on most filesystems, chunks fill it in at their offsets
+        handle.truncate(size)
+    return upload
+
+
+def write_chunk(upload, index, stream, checksum):
+    '''Copies chunk `index` from a file-like stream to its place in the part file'''
+    if upload.status != upload.Status.UPLOADING:
+        raise UploadError('This upload is already finished')
+    if not 0 <= index < upload.total_chunks():
+        raise UploadError(f'Chunk index must be between 0 and {upload.total_chunks() - 1}')
+    expected = upload.chunk_length(index)
+
+    # a resent chunk overwrites the bytes, so it only counts again once verified
+    upload.chunks.filter(index=index).delete()
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        handle = open(part_path(upload), 'r+b')
+    except FileNotFoundError:
+        # removed by clean_lecture_uploads
+        raise UploadError(EXPIRED)
+    with handle:
+        handle.seek(index * upload.chunk_size)
+        while True:
+            block = stream.read(min(READ_SIZE, expected - received + 1))
+            if not block:
+                break
+            received += len(block)
+            if received > expected:
+                raise UploadError(f'Chunk {index} must be {expected} bytes')
+            digest.update(block)
+            handle.write(block)
+    if received != expected:
+        raise UploadError(f'Chunk {index} must be {expected} bytes, got {received}')
+    if digest.hexdigest() != (checksum or '').lower():
+        raise UploadError(f'Chunk {index} checksum does not match')
+
+    try:
+        with transaction.atomic():
+            api_models.LectureUploadChunk.objects.create(upload=upload, index=index, checksum=digest.hexdigest())
+    except IntegrityError:
+        pass  # the same chunk was resent concurrently and landed first
+    return index
+
+
+def _file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finish(upload, checksum=''):
+    '''Verifies and publishes the upload, returns the updated lecture'''
+    if upload.status != upload.Status.UPLOADING:
+        raise UploadError('This upload is already finished')
+    missing = sorted(set(range(upload.total_chunks())) - set(upload.received_chunks()))
+    if missing:
+        raise UploadError(f'Missing chunks: {missing[:20]}')
+
+    path = part_path(upload)
+    if not os.path.exists(path):
+        raise UploadError(EXPIRED)
+    checksum = (checksum or upload.checksum).lower()
+    if checksum and _file_checksum(path) != checksum:
+        raise UploadError('File checksum does not match')
+
+    try:
+        duration = mp4_duration(path)
+    except (OSError, ValueError, struct_error):
+        duration = None
+
+    lecture = upload.lecture
+    name = default_storage.get_available_name(lecture.file.field.generate_filename(lecture, upload.filename))
+    destination = default_storage.path(name)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    # a rename when both live on one filesystem, a streamed copy otherwise
+    shutil.move(path, destination)
+
+    with transaction.atomic():
+        lecture.file.name = name
+        update_fields = ['file']
+        if duration is not None:
+            lecture.duration = round(duration)
+            lecture.content_duration = lecture.duration_formatted
+            update_fields += ['duration', 'content_duration']
+        lecture.save(update_fields=update_fields)
+        upload.status = upload.Status.COMPLETE
+        upload.completed_at = timezone.now()
+        upload.save(update_fields=['status', 'completed_at'])
+    return lecture
+
+
+def discard(upload):
+    if os.path.exists(part_path(upload)):
+        os.remove(part_path(upload))
+    upload.delete()
@@ -1,23 +1,50 @@
 from api import views as api_views
+from api import async_views
+from django.conf import settings
 from django.urls import path
 
 from rest_framework_simplejwt.views import TokenRefreshView
  
+# the catalog and cart endpoints also exist as async views, see api.async_views
+catalog_views = async_views if settings.ASYNC_VIEWS else api_views
+
 urlpatterns = [
 
     # Authentication Endpoints
-    path('user/token', api_views.MyTokenObtainPairView.as_view()),
-    path('user/token/refresh/', TokenRefreshView.as_view()),
-    path('user/register/', api_views.RegisterView.as_view()),
-    path('user/password-reset/<email>/', api_views.PasswordResetEmailVerifyAPIView.as_view()),
-    path('user/password-change/', api_views.PasswordChangeAPIView.as_view()),
+    path('user/token', api_views.MyTokenObtainPairView.as_view(), name='token'),
+    path('user/token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('user/register/', api_views.RegisterView.as_view(), name='register'),
+    path('user/password-reset/<email>/', api_views.PasswordResetEmailVerifyAPIView.as_view(), name='password-reset'),
+    path('user/password-change/', api_views.PasswordChangeAPIView.as_view(), name='password-change'),
   
     # Core Endpoints
-    path('course/category/', api_views.CategoryListAPIView.as_view()),
-    path('course/course-list/', api_views.CourseListAPIView.as_view()),
-    path('course/course-detail/<slug>', api_views.CourseDetailAPIView.as_view()),
+    path('course/category/', catalog_views.CategoryListAPIView.as_view(), name='category-list'),
+    path('course/course-list/', catalog_views.CourseListAPIView.as_view(), name='course-list'),
+    path('course/search/', api_views.CourseSearchAPIView.as_view(), name='course-search'),
+    path('course/course-detail/<slug>', catalog_views.CourseDetailAPIView.as_view(), name='course-detail'),
+    path('course/question-answer/<slug>/', api_views.QuestionAnswerListAPIView.as_view(), name='qa-thread-list'),
+    path('course/question-answer/<slug>/<qa_id>/', api_views.QuestionAnswerMessageListAPIView.as_view(), name='qa-message-list'),
+    path('course/lecture/<lecture_id>/media/', api_views.LectureMediaAPIView.as_view(), name='lecture-media'),
+
+    path('cart/list/', catalog_views.CartView.as_view(), name='cart-list'),
+    path('cart/add/', catalog_views.AddToCartView.as_view(), name='cart-add'),
+    path('cart/remove/<int:course_id>', api_views.RemoveFromCartView.as_view(), name='cart-remove'),
+    path('cart/pricing/', api_views.CartPricingAPIView.as_view(), name='cart-pricing'),
+    path('cart/checkout/', api_views.CheckoutAPIView.as_view(), name='cart-checkout'),
+
+    path('student/progress/', api_views.StudentProgressListAPIView.as_view(), name='student-progress'),
+    path('student/lectures-completed/', api_views.LectureCompletionAPIView.as_view(), name='lectures-completed'),
+
+    path('notification/list/', api_views.NotificationListAPIView.as_view(), name='notification-list'),
+    path('notification/unread/', api_views.NotificationUnreadAPIView.as_view(), name='notification-unread'),
+    path('notification/mark-all-seen/', api_views.NotificationMarkAllSeenAPIView.as_view(), name='notification-mark-all-seen'),
+    path('notification/stream/', api_views.NotificationStreamAPIView.as_view(), name='notification-stream'),
 
-    path('cart/list/', api_views.CartView.as_view()),
-    path('cart/add/', api_views.AddToCartView.as_view()),
-    path('cart/remove/<int:course_id>', api_views.RemoveFromCartView.as_view())
-]
\ No newline at end of file
+    path('teacher/summary/', api_views.TeacherSummaryAPIView.as_view(), name='teacher-summary'),
+    path('teacher/daily-stats/', api_views.TeacherDailyStatsAPIView.as_view(), name='teacher-daily-stats'),
+    path('teacher/course-stats/<int:course_id>/', api_views.TeacherCourseStatsAPIView.as_view(), name='teacher-course-stats'),
+    path('teacher/lecture-upload/', api_views.LectureUploadStartAPIView.as_view(), name='lecture-upload-start'),
+    path('teacher/lecture-upload/<upload_id>/', api_views.LectureUploadStatusAPIView.as_view(), name='lecture-upload-status'),
+    path('teacher/lecture-upload/<upload_id>/chunk/<int:index>/', api_views.LectureUploadChunkAPIView.as_view(), name='lecture-upload-chunk'),
+    path('teacher/lecture-upload/<upload_id>/finalize/', api_views.LectureUploadFinalizeAPIView.as_view(), name='lecture-upload-finalize'),
+]
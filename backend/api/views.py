@@ -1,4 +1,5 @@
 import random
+from decimal import Decimal, InvalidOperation
 from django.shortcuts import render
 from api import serializer as api_serializer
 from rest_framework_simplejwt.views import TokenObtainPairView
@@ -7,23 +8,43 @@ from rest_framework.permissions import AllowAny
 from usersauth.models import User, Profile
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.response import Response
-from django.core.mail import EmailMultiAlternatives
+from django.db import models, transaction
 from django.template.loader import render_to_string
 from django.conf import settings
+from django.http import StreamingHttpResponse
 from api import serializer as api_serializers
 from api import models as api_models
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
+from rest_framework.renderers import JSONRenderer
+from api.cache import VersionedCacheMixin, SHARED_VERSION, course_version
+from api import search
+from api import checkout
+from api import pricing
+from api import analytics
+from api import notifications
+from api import media
+from api import uploads
+from api.throttling import IPBucketThrottle, EmailBucketThrottle, UserBucketThrottle
+from rest_framework.exceptions import ValidationError, PermissionDenied, NotFound
+from datetime import timedelta
+from django.utils import timezone
+from core.outbox import enqueue_email
+from core import writer
 
 
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = api_serializer.MyTokenObtainPairSerializer
+    throttle_classes = [ IPBucketThrottle, EmailBucketThrottle ]
+    throttle_scope = 'login'
 
 
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     permission_classes = [ AllowAny ]
     serializer_class = api_serializer.RegisterSerializer
+    throttle_classes = [ IPBucketThrottle, EmailBucketThrottle ]
+    throttle_scope = 'register'
 
 
 def generate_random_otp(length=6):
@@ -34,6 +55,8 @@ def generate_random_otp(length=6):
 class PasswordResetEmailVerifyAPIView(generics.RetrieveAPIView):
     permission_classes = [ AllowAny ]
     serializer_class = api_serializer.UserSerializer
+    throttle_classes = [ IPBucketThrottle, EmailBucketThrottle ]
+    throttle_scope = 'password-reset'
 
     def get_object(self):
         email = self.kwargs['email']
@@ -47,7 +70,6 @@ class PasswordResetEmailVerifyAPIView(generics.RetrieveAPIView):
 
             user.refresh_token = refresh_token
             user.otp = generate_random_otp()
-            user.save()
 
             link = f'http://localhost:5173/create-new-password/?otp={user.otp}&uuidb64={uuidb64}&refresh_token={refresh_token}'
 
@@ -59,14 +81,10 @@ class PasswordResetEmailVerifyAPIView(generics.RetrieveAPIView):
             text_body = render_to_string('email/password_reset.txt', email_context)
             html_body = render_to_string('email/password_reset.html', email_context)
 
-            msg = EmailMultiAlternatives(
-                subject=subject,
-                from_email=settings.FROM_EMAIL,
-                to=[user.email],
-                body=text_body,
-            )
-            msg.attach_alternative(html_body, 'text/html')
-            msg.send()
+            # the otp and its email commit together; `manage.py send_outbox` delivers it
+            with transaction.atomic():
+                user.save()
+                enqueue_email(subject, [user.email], text_body, html_body, from_email=settings.FROM_EMAIL)
             # print('link:', link)
             return user
        
@@ -75,6 +93,10 @@ class PasswordChangeAPIView(generics.CreateAPIView):
 
     permission_classes = [ AllowAny ]
     serializer_class = api_serializer.UserSerializer
+    # each reset OTP is six digits, so guesses are limited per account too
+    throttle_classes = [ IPBucketThrottle, UserBucketThrottle ]
+    throttle_scope = 'password-change'
+    throttle_user_field = 'uuidb64'
     
     def create(self, request, *args, **kwargs):
         otp = request.data['otp']
@@ -93,35 +115,163 @@ class PasswordChangeAPIView(generics.CreateAPIView):
             return Response({ 'message': 'user does not exist'}, status=status.HTTP_404_NOT_FOUND)
         
 
-class CategoryListAPIView(generics.ListAPIView):
-    queryset=api_models.Category.objects.filter(active=True)
+class CategoryListAPIView(VersionedCacheMixin, generics.ListAPIView):
+    queryset=api_models.Category.objects.for_catalog()
     serializer_class=api_serializers.CategorySerializer
     permission_classes=[AllowAny]
+    keyset_ordering=('title', 'id')
 
 
-class CourseListAPIView(generics.ListAPIView):
-    queryset=api_models.Course.objects.filter(platform_status='Published')
-    serializer_class=api_serializers.CourseSerializer
+class CourseListAPIView(VersionedCacheMixin, generics.ListAPIView):
+    serializer_class=api_serializers.CourseSummarySerializer
     permission_classes=[AllowAny]
 
+    def get_queryset(self):
+        fields = self.serializer_class.requested_fields(self.request)
+        return api_models.Course.objects.for_listing(self.serializer_class.model_columns(fields))
+
 
-class CourseDetailAPIView(generics.RetrieveAPIView):
+class CourseDetailAPIView(VersionedCacheMixin, generics.RetrieveAPIView):
     serializer_class=api_serializers.CourseSerializer
     permission_classes=[ AllowAny ]
 
+    def get_cache_versions(self):
+        return [SHARED_VERSION, course_version(self.kwargs['slug'])]
+
     def get_object(self):
         slug = self.kwargs['slug']
-        course = api_models.Course.objects.get(slug=slug, platform_status='Published')
+        course = api_models.Course.objects.for_catalog().get(slug=slug)
         return course
     
+class CourseSearchAPIView(VersionedCacheMixin, generics.GenericAPIView):
+    '''
+    Ranked full-text search over course, lecture, category and teacher text.
+    ?q= is required; ?level=, ?language=, ?category=<id>, ?min_price=, ?max_price=
+    narrow the results. Facet counts cover every match, not just the page.
+    '''
+    serializer_class=api_serializers.CourseSummarySerializer
+    permission_classes=[AllowAny]
+    pagination_class=None
+    page_size=20
+    max_page=50
+
+    def get_filters(self):
+        params = self.request.query_params
+        filters = {
+            'level': params.get('level'),
+            'language': params.get('language'),
+            'category_id': params.get('category'),
+        }
+        for name in ('min_price', 'max_price'):
+            if params.get(name):
+                try:
+                    filters[name] = Decimal(params[name])
+                except InvalidOperation:
+                    raise ValidationError({ name: 'Must be a number' })
+        return filters
+
+    def get(self, request, *args, **kwargs):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({ 'q': 'This parameter is required' })
+        try:
+            page = min(max(int(request.query_params.get('page', 1)), 1), self.max_page)
+        except ValueError:
+            page = 1
+
+        ids, facets = search.search_courses(text, self.get_filters(), limit=self.page_size + 1, offset=(page - 1) * self.page_size)
+        has_next = len(ids) > self.page_size and page < self.max_page
+        ids = ids[:self.page_size]
+
+        fields = self.serializer_class.requested_fields(request)
+        courses = api_models.Course.objects.for_listing(self.serializer_class.model_columns(fields)).in_bulk(ids)
+        serializer = self.get_serializer([courses[course_id] for course_id in ids if course_id in courses], many=True)
+
+        return Response({
+            'page': page,
+            'has_next': has_next,
+            'facets': facets,
+            'results': serializer.data,
+        })
+
+
+class QuestionAnswerListAPIView(VersionedCacheMixin, generics.ListAPIView):
+    '''
+    Q&A threads of a course, newest first. Threads carry their reply count and
+    latest reply instead of every message, so a page costs the same three
+    queries however long its threads are.
+    '''
+    serializer_class = api_serializers.QuestionAnswerThreadSerializer
+    permission_classes = [AllowAny]
+
+    def get_cache_versions(self):
+        return [SHARED_VERSION, course_version(self.kwargs['slug'])]
+
+    def get_queryset(self):
+        course_id = api_models.Course.objects.published().filter(slug=self.kwargs['slug']).values_list('id', flat=True).first()
+        if course_id is None:
+            raise NotFound('No such course')
+        return api_models.QuestionAnswer.objects.threads().filter(course_id=course_id)
+
+
+class QuestionAnswerMessageListAPIView(VersionedCacheMixin, generics.ListAPIView):
+    '''The messages of one Q&A thread, oldest first, with their authors' profiles'''
+    serializer_class = api_serializers.QuestionAnswerResponseSerializer
+    permission_classes = [AllowAny]
+    keyset_ordering = ('date', 'id')
+
+    def get_cache_versions(self):
+        return [SHARED_VERSION, course_version(self.kwargs['slug'])]
+
+    def get_queryset(self):
+        question_id = api_models.QuestionAnswer.objects.filter(
+            qa_id=self.kwargs['qa_id'], course__in=api_models.Course.objects.published().filter(slug=self.kwargs['slug']),
+        ).values_list('id', flat=True).first()
+        if question_id is None:
+            raise NotFound('No such question')
+        return api_models.QuestionAnswerResponse.objects.filter(question_id=question_id).select_related('user__profile')
+
+
+class LectureMediaAPIView(APIView):
+    '''
+    Streams a lecture file to enrolled students, the course teacher, or anyone
+    for preview lectures. Honours Range/If-Range with 206 responses so players
+    can seek without downloading the whole file.
+    '''
+    permission_classes = [AllowAny]
+
+    def get(self, request, lecture_id, *args, **kwargs):
+        lecture = api_models.Lecture.objects.select_related('section__course').filter(lecture_id=lecture_id).first()
+        if lecture is None or not lecture.file:
+            raise NotFound('No such lecture')
+        if not media.can_stream(request.user, lecture, lecture.section.course):
+            raise PermissionDenied('Enroll in this course to watch this lecture')
+        return media.serve_file(request, lecture.file)
+
+
 class CartView(generics.RetrieveAPIView):
     serializer_class=api_serializers.CartSerializer
     permission_classes=[IsAuthenticated]
 
     def get_object(self):
         cart, created_at = api_models.Cart.objects.get_or_create(user=self.request.user)
+        # course prices and titles for every line in one query
+        models.prefetch_related_objects([cart], 'cart_items__course')
         return cart
 
+
+class CartPricingAPIView(APIView):
+    '''
+    Subtotal, coupon savings, tax and total of the user's cart, see api.pricing.
+    ?country= picks the tax rate, ?coupons=CODE1,CODE2 the coupons to try.
+    '''
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        cart, _ = api_models.Cart.objects.get_or_create(user=request.user)
+        totals = pricing.price_cart(cart, request.query_params.get('country'), request.query_params.get('coupons', '').split(','))
+        return Response(api_serializers.CartPricingSerializer(totals).data)
+
 class AddToCartView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = api_serializers.AddToCartSerializer
@@ -130,18 +280,7 @@ class AddToCartView(generics.CreateAPIView):
         serializer = api_serializers.AddToCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        course_id = serializer.validated_data['course_id']
-
-        course_id = serializer.validate_course_id(course_id)
-
-        course = api_models.Course.objects.get(id=course_id)
-
-        cart, _ = api_models.Cart.objects.get_or_create(user=request.user)
-
-        cart_item, created = api_models.CartOrderItem.objects.get_or_create(
-            cart=cart,
-            course=course
-        )
+        cart, created = writer.run(checkout.add_to_cart, request.user, serializer.validated_data['course_id'])
 
         if not created:
             return Response({ 'detail':'Course already in cart' }, status=status.HTTP_200_OK)
@@ -149,6 +288,231 @@ class AddToCartView(generics.CreateAPIView):
         return Response({ 'detail': 'Course added to cart', 'cart': api_serializers.CartSerializer(cart).data}, status=status.HTTP_201_CREATED)
     
 
+class CheckoutAPIView(generics.CreateAPIView):
+    '''
+    Turns a cart with nothing to pay into an order and enrollments; a cart
+    with a total gets a 402 (see api.checkout). A second submit of the same
+    cart gets a 400 (cart already empty) or a 409 (lost the race), never a
+    second set of enrollments.
+    '''
+    permission_classes = [IsAuthenticated]
+    serializer_class = api_serializers.CheckoutSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            order = checkout.checkout(request.user, **serializer.validated_data)
+        except checkout.EmptyCart as error:
+            return Response({ 'detail': str(error) }, status=status.HTTP_400_BAD_REQUEST)
+        except checkout.CheckoutConflict as error:
+            return Response({ 'detail': str(error) }, status=status.HTTP_409_CONFLICT)
+        except checkout.PaymentRequired as error:
+            return Response({ 'detail': str(error) }, status=status.HTTP_402_PAYMENT_REQUIRED)
+
+        order = api_models.CartOrder.objects.prefetch_related(
+            models.Prefetch('orderitem', queryset=api_models.CartOrderItem.objects.select_related('course')),
+        ).get(id=order.id)
+        return Response({ 'detail': 'Order placed', 'order': api_serializers.CartOrderSerializer(order).data }, status=status.HTTP_201_CREATED)
+
+
+class StudentProgressListAPIView(generics.ListAPIView):
+    '''Stored progress of every course the user is enrolled in, no completion rows are read'''
+    serializer_class = api_serializers.EnrollmentProgressSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return api_models.EnrolledCourse.objects.filter(user=self.request.user).select_related('course')
+
+
+class LectureCompletionAPIView(generics.CreateAPIView):
+    '''Marks many lectures of an enrolled course as completed at once; repeats are ignored'''
+    serializer_class = api_serializers.LectureCompletionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        enrollment = api_models.EnrolledCourse.objects.select_related('course').filter(
+            user=request.user, course_id=serializer.validated_data['course_id'],
+        ).first()
+        if enrollment is None:
+            return Response({ 'detail': 'Not enrolled in this course' }, status=status.HTTP_404_NOT_FOUND)
+
+        completed = enrollment.mark_completed(serializer.validated_data['lecture_ids'])
+        if not completed:
+            raise ValidationError({ 'lecture_ids': 'None of these lectures belong to the course' })
+        return Response(api_serializers.EnrollmentProgressSerializer(enrollment).data, status=status.HTTP_200_OK)
+
+
+class NotificationListAPIView(generics.ListAPIView):
+    '''The user's notifications as a student and as a teacher, newest first'''
+    serializer_class = api_serializers.NotificationSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return api_models.Notification.objects.for_recipient(self.request.user)
+
+
+class NotificationUnreadAPIView(APIView):
+    '''The unread count behind the bell icon, from the cache'''
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({ 'unread': api_models.Notification.objects.unread_count(request.user) })
+
+
+class NotificationMarkAllSeenAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        updated = api_models.Notification.objects.mark_all_seen(request.user)
+        return Response({ 'updated': updated, 'unread': 0 }, status=status.HTTP_200_OK)
+
+
+class NotificationStreamAPIView(APIView):
+    '''
+    Server-sent events with the unread count, see api.notifications.UnreadStream.
+    With settings.ASYNC_VIEWS (ASGI) the stream stays open on the event loop;
+    under WSGI it sends the count and ends instead of holding a worker thread.
+    '''
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [notifications.EventStreamRenderer, JSONRenderer]
+
+    def get(self, request):
+        user = request.user
+        unread = lambda: api_models.Notification.objects.unread_count(user)
+        if settings.ASYNC_VIEWS:
+            events = aiter(notifications.UnreadStream(unread))
+        else:
+            events = iter(notifications.UnreadStream(unread, seconds=0, retry=settings.NOTIFICATION_WSGI_RETRY))
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx would otherwise buffer the events
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class TeacherStatsMixin:
+    '''Teacher dashboards read the daily rollups only, never enrollments or reviews'''
+    permission_classes = [IsAuthenticated]
+    pagination_class = None
+    default_days = 30
+    max_days = 366
+
+    def get_teacher(self):
+        teacher = api_models.Teacher.objects.filter(user=self.request.user).first()
+        if teacher is None:
+            raise PermissionDenied('Only teachers have a dashboard')
+        return teacher
+
+    def get_since(self):
+        try:
+            days = min(max(int(self.request.query_params.get('days', self.default_days)), 1), self.max_days)
+        except ValueError:
+            raise ValidationError({ 'days': 'Must be a whole number' })
+        return timezone.localdate() - timedelta(days=days - 1)
+
+
+class TeacherSummaryAPIView(TeacherStatsMixin, generics.GenericAPIView):
+
+    def get(self, request, *args, **kwargs):
+        teacher = self.get_teacher()
+        since = self.get_since()
+        stats = api_models.TeacherDailyStats.objects.filter(teacher=teacher)
+        courses = api_models.CourseDailyStats.objects.filter(course__teacher=teacher, day__gte=since).values('course_id', 'course__title').annotate(
+            enrollments=models.Sum('enrollments'), revenue=models.Sum('revenue'), reviews=models.Sum('reviews'),
+        ).order_by('-enrollments')
+        return Response({
+            'since': since,
+            'all_time': analytics.totals(stats),
+            'recent': analytics.totals(stats.filter(day__gte=since)),
+            'courses': list(courses),
+        })
+
+
+class TeacherDailyStatsAPIView(TeacherStatsMixin, generics.ListAPIView):
+    serializer_class = api_serializers.TeacherDailyStatsSerializer
+
+    def get_queryset(self):
+        return api_models.TeacherDailyStats.objects.filter(teacher=self.get_teacher(), day__gte=self.get_since())
+
+
+class TeacherCourseStatsAPIView(TeacherStatsMixin, generics.ListAPIView):
+    serializer_class = api_serializers.CourseDailyStatsSerializer
+
+    def get_queryset(self):
+        course = api_models.Course.objects.filter(id=self.kwargs['course_id'], teacher=self.get_teacher()).first()
+        if course is None:
+            raise NotFound('No such course of yours')
+        return api_models.CourseDailyStats.objects.filter(course=course, day__gte=self.get_since())
+
+
+class LectureUploadMixin:
+    permission_classes = [IsAuthenticated]
+    serializer_class = api_serializers.LectureUploadSerializer
+
+    def get_upload(self):
+        upload = api_models.LectureUpload.objects.select_related('lecture').filter(
+            upload_id=self.kwargs['upload_id'], user=self.request.user,
+        ).first()
+        if upload is None:
+            raise NotFound('No such upload')
+        return upload
+
+
+class LectureUploadStartAPIView(LectureUploadMixin, generics.CreateAPIView):
+    '''
+    Starts a resumable upload of a lecture file. The client then PUTs each
+    chunk as a raw body with its SHA-256 in X-Chunk-SHA256 and finalizes.
+    '''
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        lecture = api_models.Lecture.objects.filter(
+            lecture_id=data['lecture_id'], section__course__teacher__user=request.user,
+        ).first()
+        if lecture is None:
+            raise NotFound('No such lecture of yours')
+        upload = uploads.start(lecture, request.user, data['filename'], data['size'], data.get('chunk_size'), data.get('checksum', ''))
+        return Response(self.get_serializer(upload).data, status=status.HTTP_201_CREATED)
+
+
+class LectureUploadStatusAPIView(LectureUploadMixin, generics.RetrieveAPIView):
+    '''Lists the chunks received so far, so an interrupted client knows what to resend'''
+
+    def get_object(self):
+        return self.get_upload()
+
+
+class LectureUploadChunkAPIView(LectureUploadMixin, APIView):
+
+    def put(self, request, upload_id, index, *args, **kwargs):
+        upload = self.get_upload()
+        try:
+            # read the body as a stream; request.data would buffer the whole chunk
+            uploads.write_chunk(upload, index, request._request, request.headers.get('X-Chunk-SHA256', ''))
+        except uploads.UploadError as error:
+            return Response({ 'detail': str(error) }, status=status.HTTP_400_BAD_REQUEST)
+        return Response({ 'index': index, 'received_chunks': upload.received_chunks() })
+
+
+class LectureUploadFinalizeAPIView(LectureUploadMixin, APIView):
+
+    def post(self, request, upload_id, *args, **kwargs):
+        upload = self.get_upload()
+        try:
+            lecture = uploads.finish(upload, request.data.get('checksum', ''))
+        except uploads.UploadError as error:
+            return Response({ 'detail': str(error) }, status=status.HTTP_400_BAD_REQUEST)
+        return Response(api_serializers.LectureSerializer(lecture).data)
+
+
 class RemoveFromCartView(generics.DestroyAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = api_serializers.RemoveFromCartSerializer
@@ -22,7 +22,21 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 env = Env(
     BREVO_API_KEY=(str, ''),
-    FROM_EMAIL=(str, '')
+    FROM_EMAIL=(str, ''),
+    CACHE_URL=(str, 'locmemcache://'),
+    EMAIL_BACKEND=(str, 'anymail.backends.brevo.EmailBackend'),
+    MEDIA_OFFLOAD=(str, ''),
+    MEDIA_ACCEL_PREFIX=(str, '/protected-media/'),
+    CHUNKED_UPLOAD_DIR=(str, str(BASE_DIR / 'chunked-uploads')),
+    MAX_LECTURE_UPLOAD_SIZE=(int, 10 * 1024 ** 3),
+    METRICS_TOKEN=(str, ''),
+    DATABASE_URL=(str, f'sqlite:///{BASE_DIR / "db.sqlite3"}'),
+    REPLICA_DATABASE_URLS=(list, []),
+    DB_CONN_MAX_AGE=(int, 60),
+    DB_POOL=(bool, False),
+    REPLICA_PIN_SECONDS=(int, 10),
+    NUM_PROXIES=(int, 0),
+    SQLITE_PRODUCTION=(bool, False),
 )
 env.read_env(os.path.join(BASE_DIR, '.env'))
 
@@ -63,6 +77,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its timings cover every other middleware
+    'core.middleware.RequestMetricsMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -75,6 +92,13 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'backend.urls'
 
+# Per-request timings (see core.metrics): a Server-Timing header on every
+# response, which reveals query counts, so only while debugging, and the
+# Prometheus endpoint at /metrics, which needs this bearer token (without one
+# it is only served while debugging)
+SERVER_TIMING = env.bool('SERVER_TIMING', default=DEBUG)
+METRICS_TOKEN = env('METRICS_TOKEN')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -91,17 +115,98 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
+
+# Route the catalog and cart endpoints to the async views in api.async_views.
+# Only worth it when served by an ASGI server, see bench_concurrency
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# DATABASE_URL is the primary, REPLICA_DATABASE_URLS (comma separated) are read
+# replicas that core.routers sends catalog reads to. Connections persist for
+# DB_CONN_MAX_AGE seconds in each worker thread; under ASGI set it to 0 and
+# pool PostgreSQL connections instead with DB_POOL=on (needs psycopg[pool])
+#
+# SQLITE_PRODUCTION=on tunes SQLite for concurrent traffic: WAL so readers never
+# wait for the writer, a busy timeout instead of instant "database is locked",
+# fsync only at checkpoints, a larger page cache and memory-mapped reads, and
+# BEGIN IMMEDIATE so a transaction takes the write lock up front rather than
+# failing when it upgrades from a read. It also turns on the single-writer
+# queue, see core.writer
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+]
+
+
+def database_config(url):
+    config = env.db_url_config(url)
+    if config['ENGINE'] == 'django.db.backends.sqlite3' and env('SQLITE_PRODUCTION'):
+        config['OPTIONS'] = {
+            **config.get('OPTIONS', {}),
+            'init_command': ';'.join(SQLITE_PRAGMAS),
+            'transaction_mode': 'IMMEDIATE',
+        }
+    if config['ENGINE'] == 'django.db.backends.postgresql' and env('DB_POOL'):
+        config['OPTIONS'] = {**config.get('OPTIONS', {}), 'pool': True}
+    else:
+        config['CONN_MAX_AGE'] = env('DB_CONN_MAX_AGE')
+    config['CONN_HEALTH_CHECKS'] = True
+    return config
+
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_config(env('DATABASE_URL')),
 }
+for index, url in enumerate(env('REPLICA_DATABASE_URLS'), 1):
+    # tests read the replicas through the primary's connection
+    DATABASES[f'replica{index}'] = {**database_config(url), 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# Small, frequent writes (lecture completions, cart items) go through one writer
+# thread per process that commits whatever has queued up together
+SQLITE_WRITE_QUEUE = env.bool('SQLITE_WRITE_QUEUE', default=env('SQLITE_PRODUCTION')) and (
+    DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3'
+)
+SQLITE_WRITE_BATCH = 200
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+# Safe requests to these routes read from the replicas. A request that writes
+# keeps its client on the primary for REPLICA_PIN_SECONDS, so it reads its own writes
+REPLICA_READ_ROUTES = ['category-list', 'course-list', 'course-search', 'course-detail', 'qa-thread-list', 'qa-message-list']
+REPLICA_PIN_SECONDS = env('REPLICA_PIN_SECONDS')
+REPLICA_PIN_COOKIE = 'primary_pin'
+
+
+# Cache
+# Local memory by default, e.g. CACHE_URL=filecache:///var/tmp/lms_cache to share it between processes
+
+CACHES = {
+    'default': env.cache('CACHE_URL'),
+}
+
+# Unread notification counters live in the cache (see api.notifications). The
+# timeout bounds how long a counter that missed an update can stay off. The
+# live stream checks the counter every NOTIFICATION_STREAM_POLL seconds and
+# ends after NOTIFICATION_STREAM_SECONDS, when the client reconnects. Without
+# ASYNC_VIEWS it would hold a worker thread, so it sends the count once and the
+# client reconnects after NOTIFICATION_WSGI_RETRY seconds.
+NOTIFICATION_UNREAD_TIMEOUT = 600
+NOTIFICATION_STREAM_POLL = 2
+NOTIFICATION_STREAM_SECONDS = 55
+NOTIFICATION_WSGI_RETRY = 15
+
+# rollup_analytics leaves rows dated within the last ANALYTICS_ROLLUP_LAG
+# seconds for the next run, while transactions with lower ids may still commit
+# (see api.analytics)
+ANALYTICS_ROLLUP_LAG = 120
 
 
 # Password validation
@@ -145,6 +250,29 @@ STATIC_ROOT = BASE_DIR / 'templates'
 MEDIA_URL = '/media/'  # 127.0.0.1:8000/media
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# How lecture media leaves the app once access is checked: '' streams it from
+# Django, 'x-accel-redirect' hands it to nginx (an internal location mapping
+# MEDIA_ACCEL_PREFIX to MEDIA_ROOT), 'x-sendfile' to Apache/lighttpd.
+#
+# Lecture files live under MEDIA_ROOT/lectures/. Django refuses that path
+# itself (see backend/urls.py), but a web server serving MEDIA_URL directly
+# must refuse it too, or every file is public. With nginx:
+#
+#     location /media/lectures/ { internal; }
+#     location /protected-media/ { internal; alias /path/to/backend/media/; }
+#     location /media/ { alias /path/to/backend/media/; }
+MEDIA_OFFLOAD = env('MEDIA_OFFLOAD')
+MEDIA_ACCEL_PREFIX = env('MEDIA_ACCEL_PREFIX')
+
+# Resized, content-hashed image variants (see core.images), served with
+# immutable cache headers from MEDIA_URL + DERIVED_IMAGE_DIR
+DERIVED_IMAGE_DIR = 'derived'
+
+# Lecture uploads in progress, kept outside MEDIA_ROOT so partial files are never served
+CHUNKED_UPLOAD_DIR = env('CHUNKED_UPLOAD_DIR')
+# largest lecture file a teacher may upload, in bytes; start() reserves it on disk
+MAX_LECTURE_UPLOAD_SIZE = env('MAX_LECTURE_UPLOAD_SIZE')
+
 AUTH_USER_MODEL = 'usersauth.User'
 
 
@@ -160,6 +288,34 @@ JAZZMIN_SETTINGS = {
     'welcome_sign': 'Welcome to LMS'
 }
 
+####### REST FRAMEWORK CONFIGURATIONS #########
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        # JWT with cached user lookups, see usersauth.cache
+        'usersauth.authentication.CachedJWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
+    # reverse proxies in front of the app; X-Forwarded-For is only trusted for
+    # that many hops, with 0 the client address is REMOTE_ADDR (throttles key on it)
+    'NUM_PROXIES': env('NUM_PROXIES'),
+    # token buckets for the anonymous auth endpoints, '<scope>.<kind>': 'burst/period'
+    # (see api.throttling); the count refills evenly over the period
+    'DEFAULT_THROTTLE_RATES': {
+        'login.ip': '30/min',
+        'login.email': '10/min',
+        'register.ip': '10/hour',
+        'register.email': '3/hour',
+        'password-reset.ip': '10/hour',
+        'password-reset.email': '3/hour',
+        'password-change.ip': '10/hour',
+        'password-change.user': '5/hour',
+    },
+}
+
 ####### CORS CONFIGURATIONS #########
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -224,7 +380,8 @@ SIMPLE_JWT = {
 BREVO_API_KEY = env('BREVO_API_KEY')
 FROM_EMAIL = env('FROM_EMAIL')
 
-EMAIL_BACKEND = "anymail.backends.brevo.EmailBackend"
+# e.g. EMAIL_BACKEND=django.core.mail.backends.console.EmailBackend to run the outbox worker offline
+EMAIL_BACKEND = env('EMAIL_BACKEND')
 DEFAULT_FROM_EMAIL = FROM_EMAIL
 
 ANYMAIL = {
@@ -15,12 +15,14 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from api.media import protected_media
+from core.views import derived_image, metrics
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -41,8 +43,13 @@ urlpatterns = [
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('admin/', admin.site.urls),
-    path('api/v1/', include('api.urls'))
+    path('api/v1/', include('api.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
 
+# lecture files only go out through the enrollment-checked lecture media endpoint;
+# a web server serving MEDIA_URL itself needs the same rule, see MEDIA_OFFLOAD in settings
+urlpatterns += [re_path(r'^' + settings.MEDIA_URL.lstrip('/') + 'lectures/', protected_media)]
+urlpatterns += [re_path(r'^' + settings.MEDIA_URL.lstrip('/') + settings.DERIVED_IMAGE_DIR + r'/(?P<path>.*)$', derived_image)]
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
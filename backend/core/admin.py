@@ -1,3 +1,18 @@
 from django.contrib import admin
+from core.models import OutboxEmail, ImageJob
 
-# Register your models here.
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status']
+
+
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
+
+
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ['model_label', 'object_id', 'source', 'status', 'attempts', 'next_attempt_at', 'done_at']
+    list_filter = ['status', 'model_label']
+
+
+admin.site.register(ImageJob, ImageJobAdmin)
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from core import metrics, routers
+
+        connection_created.connect(metrics.install_query_recorder)
+        connection_created.connect(routers.install_write_recorder)
+        metrics.instrument_serializers()
@@ -0,0 +1,110 @@
+'''
+Image derivatives.
+
+render() turns one uploaded image into resized WebP and JPEG (PNG when the
+image has transparency) files named after the hash of their bytes, under
+DERIVED_IMAGE_DIR in the default storage. A file's name changes whenever its
+content does, so derivatives are served with immutable cache headers.
+record_results() writes the names into the owning row's `image_variants` as
+{'source': <original name>, 'variants': {format: {width: name}}}.
+'''
+import hashlib
+import io
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from core import queue
+from core.models import IMAGE_FIELDS, ImageJob
+
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+CLAIM_LEASE = timedelta(minutes=10)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+
+def claim_batch(size):
+    return queue.claim_rows(ImageJob, size, ImageJob.Status.PENDING, ImageJob.Status.PROCESSING, CLAIM_LEASE)
+
+
+def _store(data, extension):
+    digest = hashlib.sha256(data).hexdigest()[:24]
+    name = f'{settings.DERIVED_IMAGE_DIR}/{digest[:2]}/{digest}.{extension}'
+    # identical bytes were already rendered, from this image or another
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def render(source, widths):
+    '''Renders the derivatives of one stored image, returns {format: {width: name}}'''
+    with default_storage.open(source, 'rb') as handle:
+        image = Image.open(handle)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    image = image.convert('RGBA' if transparent else 'RGB')
+    fallback = 'png' if transparent else 'jpeg'
+
+    # never upscale; an image narrower than every width gets one variant at its own size
+    targets = sorted({width for width in widths if width < image.width} or {image.width})
+    variants = {'webp': {}, fallback: {}}
+    for width in targets:
+        resized = image if width == image.width else image.resize(
+            (width, max(round(image.height * width / image.width), 1)), Image.LANCZOS,
+        )
+        for image_format in variants:
+            buffer = io.BytesIO()
+            if image_format == 'webp':
+                resized.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+            elif image_format == 'jpeg':
+                resized.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            else:
+                resized.save(buffer, 'PNG', optimize=True)
+            variants[image_format][str(width)] = _store(buffer.getvalue(), 'jpg' if image_format == 'jpeg' else image_format)
+    return variants
+
+
+def process(job):
+    '''Runs in worker threads and only touches storage; returns (variants, error)'''
+    try:
+        return render(job.source, IMAGE_FIELDS[job.model_label][1]), None
+    except Exception as error:
+        return None, f'{type(error).__name__}: {error}'
+
+
+def record_results(jobs, results, max_attempts):
+    now = timezone.now()
+    done = failed = 0
+    for job in jobs:
+        variants, error = results.get(job.id, (None, 'not attempted'))
+        job.attempts += 1
+        job.claim_token = ''
+        if error is None:
+            model = apps.get_model(job.model_label)
+            instance = model._default_manager.filter(pk=job.object_id).first()
+            # skip rows deleted or given another image while the job waited
+            if instance is not None and getattr(instance, job.field).name == job.source:
+                instance.image_variants = {'source': job.source, 'variants': variants}
+                instance.save(update_fields=['image_variants'])
+            job.status = ImageJob.Status.DONE
+            job.done_at = now
+            job.last_error = ''
+            done += 1
+        else:
+            job.last_error = error
+            if job.attempts >= max_attempts:
+                job.status = ImageJob.Status.DEAD
+            else:
+                job.status = ImageJob.Status.PENDING
+                job.next_attempt_at = now + queue.backoff(job.attempts, BACKOFF_BASE, BACKOFF_MAX)
+            failed += 1
+        job.save(update_fields=['status', 'attempts', 'claim_token', 'next_attempt_at', 'last_error', 'done_at'])
+    return done, failed
@@ -0,0 +1,38 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core import images
+
+
+class Command(BaseCommand):
+    help = 'Renders thumbnails and WebP variants of uploaded images with a thread pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Images claimed per round')
+        parser.add_argument('--threads', type=int, default=4, help='Concurrent rendering threads')
+        parser.add_argument('--max-attempts', type=int, default=3, help='Attempts before a job is dead-lettered')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when nothing is queued')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due instead of polling')
+
+    def handle(self, *args, **options):
+        total_done = total_failed = 0
+
+        with ThreadPoolExecutor(max_workers=max(1, options['threads']), thread_name_prefix='images') as pool:
+            while True:
+                jobs = images.claim_batch(options['batch_size'])
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                # Pillow releases the GIL while resizing and encoding
+                results = dict(zip([job.id for job in jobs], pool.map(images.process, jobs)))
+                done, failed = images.record_results(jobs, results, options['max_attempts'])
+                total_done += done
+                total_failed += failed
+                self.stdout.write(f'rendered {done}, failed {failed}')
+
+        self.stdout.write(self.style.SUCCESS(f'Images processed: {total_done} rendered, {total_failed} failed'))
@@ -0,0 +1,43 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core import outbox
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued outbox emails with a thread pool, retrying failures with exponential backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Emails claimed per round')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent sending threads')
+        parser.add_argument('--max-attempts', type=int, default=6, help='Attempts before an email is dead-lettered')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due instead of polling')
+
+    def handle(self, *args, **options):
+        threads = max(1, options['threads'])
+        total_sent = total_failed = 0
+
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='outbox') as pool:
+            while True:
+                emails = outbox.claim_batch(options['batch_size'])
+                if not emails:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                # one backend connection per chunk instead of per email
+                chunks = [emails[index::threads] for index in range(threads) if emails[index::threads]]
+                results = {}
+                for chunk_results in pool.map(outbox.send_chunk, chunks):
+                    results.update(chunk_results)
+
+                sent, failed = outbox.record_results(emails, results, options['max_attempts'])
+                total_sent += sent
+                total_failed += failed
+                self.stdout.write(f'sent {sent}, failed {failed}')
+
+        self.stdout.write(self.style.SUCCESS(f'Outbox drained: {total_sent} sent, {total_failed} failed'))
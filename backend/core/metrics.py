@@ -0,0 +1,178 @@
+'''
+Per-request performance metrics.
+
+RequestMetricsMiddleware opens a RequestStats for every request in a context
+variable. While one is open, every database connection reports its statements
+to it (record_query is added to each connection's execute_wrappers when the
+connection is created), and DRF serializers report the time spent building
+`.data` (instrument_serializers). The middleware turns the result into a
+Server-Timing header and adds it to the process-wide REGISTRY, which the
+/metrics view renders in the Prometheus text format.
+
+Routes are labelled by their URL name, so the number of series is bounded by
+the URLconf and not by the URLs clients send. Each process keeps its own
+registry, and Prometheus should scrape every worker.
+'''
+import threading
+import time
+from contextvars import ContextVar
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db', 'serialize', 'serializing', 'render_started')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.serializing = False
+        self.render_started = None
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db += time.perf_counter() - started
+        stats.queries += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def _timed_data(prop):
+    def data(self):
+        stats = current.get()
+        # nested serializers are part of the outermost one's time
+        if stats is None or stats.serializing:
+            return prop.fget(self)
+        stats.serializing = True
+        started = time.perf_counter()
+        try:
+            return prop.fget(self)
+        finally:
+            stats.serialize += time.perf_counter() - started
+            stats.serializing = False
+    data.timed = True
+    return property(data)
+
+
+def instrument_serializers():
+    from rest_framework.serializers import ListSerializer, Serializer
+
+    for cls in (Serializer, ListSerializer):
+        if not getattr(cls.data.fget, 'timed', False):
+            cls.data = _timed_data(cls.data)
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # (route, method) -> [bucket counts..., count, sum, queries, db, serialize, render]
+            self.routes = {}
+            # (route, method, status) -> count
+            self.responses = {}
+            self.overhead = 0.0
+
+    def observe(self, route, method, status, seconds, stats, render):
+        index = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+        with self._lock:
+            row = self.routes.get((route, method))
+            if row is None:
+                row = self.routes[route, method] = [0] * len(BUCKETS) + [0, 0.0, 0, 0.0, 0.0, 0.0]
+            if index < len(BUCKETS):
+                row[index] += 1
+            offset = len(BUCKETS)
+            row[offset] += 1
+            row[offset + 1] += seconds
+            row[offset + 2] += stats.queries
+            row[offset + 3] += stats.db
+            row[offset + 4] += stats.serialize
+            row[offset + 5] += render
+            key = (route, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def add_overhead(self, seconds):
+        with self._lock:
+            self.overhead += seconds
+
+    def render(self):
+        with self._lock:
+            routes = {key: list(row) for key, row in self.routes.items()}
+            responses = dict(self.responses)
+            overhead = self.overhead
+
+        offset = len(BUCKETS)
+        lines = [
+            '# HELP lms_http_request_duration_seconds Time from the first middleware to the rendered response.',
+            '# TYPE lms_http_request_duration_seconds histogram',
+        ]
+        for (route, method), row in sorted(routes.items()):
+            labels = f'route="{_escape(route)}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, row):
+                cumulative += count
+                lines.append(f'lms_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'lms_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {row[offset]}')
+            lines.append(f'lms_http_request_duration_seconds_sum{{{labels}}} {row[offset + 1]:.6f}')
+            lines.append(f'lms_http_request_duration_seconds_count{{{labels}}} {row[offset]}')
+
+        lines += ['# HELP lms_http_responses_total Responses by route, method and status.', '# TYPE lms_http_responses_total counter']
+        for (route, method, status), count in sorted(responses.items()):
+            lines.append(f'lms_http_responses_total{{route="{_escape(route)}",method="{method}",status="{status}"}} {count}')
+
+        totals = (
+            ('lms_db_queries_total', 'SQL statements run while serving the route.', 2, '{}'),
+            ('lms_db_seconds_total', 'Time spent executing SQL.', 3, '{:.6f}'),
+            ('lms_serialize_seconds_total', 'Time spent building serializer data, SQL it triggers included.', 4, '{:.6f}'),
+            ('lms_render_seconds_total', 'Time spent rendering responses.', 5, '{:.6f}'),
+        )
+        for name, description, field, number in totals:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+            for (route, method), row in sorted(routes.items()):
+                lines.append(f'{name}{{route="{_escape(route)}",method="{method}"}} {number.format(row[offset + field])}')
+
+        lines += [
+            '# HELP lms_metrics_overhead_seconds_total Time the metrics middleware spent on its own bookkeeping.',
+            '# TYPE lms_metrics_overhead_seconds_total counter',
+            f'lms_metrics_overhead_seconds_total {overhead:.6f}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = Registry()
+
+
+def route_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name if match.url_name else match.route
+
+
+def server_timing(stats, render, total):
+    return (
+        f'db;dur={stats.db * 1000:.2f};desc="{stats.queries} queries", '
+        f'serialize;dur={stats.serialize * 1000:.2f}, '
+        f'render;dur={render * 1000:.2f}, '
+        f'total;dur={total * 1000:.2f}'
+    )
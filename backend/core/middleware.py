@@ -0,0 +1,107 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from core import metrics, routers
+
+
+class RequestMetricsMiddleware:
+    '''
+    Times each request and records it in core.metrics.REGISTRY. Listed first
+    in MIDDLEWARE so the total covers every other middleware. With
+    settings.SERVER_TIMING on, the breakdown is also sent back in a
+    Server-Timing header.
+
+    Works in both sync and async chains, so under ASGI it does not push async
+    views onto a thread.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started, stats, token, setup = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        return self.finish(request, response, started, stats, setup)
+
+    async def __acall__(self, request):
+        started, stats, token, setup = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        return self.finish(request, response, started, stats, setup)
+
+    def start(self):
+        started = time.perf_counter()
+        stats = metrics.RequestStats()
+        token = metrics.current.set(stats)
+        return started, stats, token, time.perf_counter() - started
+
+    def finish(self, request, response, started, stats, setup):
+        finished = time.perf_counter()
+        total = finished - started
+        # DRF responses render after process_template_response, so this is the render time
+        render = finished - stats.render_started if stats.render_started else 0.0
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = metrics.server_timing(stats, render, total)
+        metrics.REGISTRY.observe(metrics.route_label(request), request.method, response.status_code, total, stats, render)
+        metrics.REGISTRY.add_overhead(setup + time.perf_counter() - finished)
+        return response
+
+    def process_template_response(self, request, response):
+        stats = metrics.current.get()
+        if stats is not None:
+            stats.render_started = time.perf_counter()
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    '''
+    Opens the core.routers state for each request and pins clients whose
+    request wrote something to the primary.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = routers.RoutingState(request)
+        token = routers.current.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.current.reset(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state = routers.RoutingState(request)
+        token = routers.current.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.current.reset(token)
+        return self.finish(state, response)
+
+    def finish(self, state, response):
+        if state.wrote and settings.DATABASE_REPLICAS:
+            routers.pin(state, response)
+        return response
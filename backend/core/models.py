@@ -1,3 +1,103 @@
 from django.db import models
+from django.db.models.signals import post_save
+from django.utils import timezone
 
-# Create your models here.
+
+class OutboxEmail(models.Model):
+    """
+    Transactional email waiting to be delivered by `manage.py send_outbox`.
+
+    Rows are written in the same transaction as the change that triggers the
+    email, so an email is queued if and only if that change commits. The worker
+    claims rows in batches, sends them from a thread pool and retries failures
+    with exponential backoff until `max_attempts`, after which the row is
+    dead-lettered for inspection in the admin.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        SENDING = 'sending', 'Sending'
+        SENT = 'sent', 'Sent'
+        DEAD = 'dead', 'Dead'
+
+    subject = models.CharField(max_length=255)
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField(default=list)
+    body = models.TextField(blank=True)
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} -> {", ".join(self.to)}'
+
+
+# Image fields that get resized WebP/JPEG derivatives, with the widths to render.
+# Each model stores the result in an `image_variants` JSON field.
+IMAGE_FIELDS = {
+    'api.Course': ('image', (320, 640, 1280)),
+    'api.Category': ('image', (96, 192)),
+    'api.Teacher': ('image', (96, 256)),
+    'usersauth.Profile': ('image', (64, 128)),
+}
+
+
+class ImageJob(models.Model):
+    """
+    An uploaded image waiting for `manage.py process_images` to render its
+    derivatives. Queued by the post_save receiver below whenever an image field
+    points at a file its derivatives were not made from.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        PROCESSING = 'processing', 'Processing'
+        DONE = 'done', 'Done'
+        DEAD = 'dead', 'Dead'
+
+    model_label = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    field = models.CharField(max_length=50)
+    source = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    done_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='image_job_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.model_label} {self.object_id}: {self.source}'
+
+
+def queue_image_variants(sender, instance, raw=False, **kwargs):
+    field_name, widths = IMAGE_FIELDS[sender._meta.label]
+    name = getattr(instance, field_name).name
+    if raw or not name or name == instance._meta.get_field(field_name).default:
+        return
+    if (instance.image_variants or {}).get('source') == name:
+        return
+    ImageJob.objects.get_or_create(
+        model_label=sender._meta.label, object_id=instance.pk, source=name, status=ImageJob.Status.PENDING,
+        defaults={'field': field_name},
+    )
+
+
+for label in IMAGE_FIELDS:
+    post_save.connect(queue_image_variants, sender=label)
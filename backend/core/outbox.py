@@ -0,0 +1,106 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from core import queue
+from core.models import OutboxEmail
+
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+# A claimed row whose worker died is handed out again after this long
+CLAIM_LEASE = timedelta(minutes=5)
+
+
+def enqueue_email(subject, to, body, html_body='', from_email=None):
+    '''Queues an email; call it inside the transaction of the change that triggers it'''
+    return OutboxEmail.objects.create(
+        subject=subject,
+        to=list(to),
+        body=body,
+        html_body=html_body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL or '',
+    )
+
+
+def claim_batch(size):
+    '''Marks up to `size` due emails as sending and returns them, see core.queue.claim_rows'''
+    return queue.claim_rows(OutboxEmail, size, OutboxEmail.Status.PENDING, OutboxEmail.Status.SENDING, CLAIM_LEASE)
+
+
+def send_chunk(emails):
+    '''
+    Sends emails over one backend connection. Runs in worker threads, so it does
+    not touch the database; returns {id: error or None}.
+    '''
+    results = {}
+    connection = get_connection()
+    try:
+        connection.open()
+        for email in emails:
+            message = EmailMultiAlternatives(
+                subject=email.subject,
+                body=email.body,
+                from_email=email.from_email or None,
+                to=email.to,
+                connection=connection,
+            )
+            if email.html_body:
+                message.attach_alternative(email.html_body, 'text/html')
+            try:
+                message.send()
+                results[email.id] = None
+            except Exception as error:
+                results[email.id] = f'{type(error).__name__}: {error}'
+    except Exception as error:
+        for email in emails:
+            results.setdefault(email.id, f'{type(error).__name__}: {error}')
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return results
+
+
+def backoff(attempts):
+    return queue.backoff(attempts, BACKOFF_BASE, BACKOFF_MAX)
+
+
+def record_results(emails, results, max_attempts):
+    '''
+    Writes the outcome of a claimed batch. Rows whose claim token changed were
+    handed to another worker after our lease ran out; their state is left to
+    that worker.
+    '''
+    now = timezone.now()
+    tokens = {email.id: email.claim_token for email in emails}
+    sent, failed = [], []
+    for email in emails:
+        error = results.get(email.id, 'not attempted')
+        email.attempts += 1
+        email.claim_token = ''
+        if error is None:
+            email.status = OutboxEmail.Status.SENT
+            email.sent_at = now
+            email.last_error = ''
+            sent.append(email)
+        else:
+            email.last_error = error
+            if email.attempts >= max_attempts:
+                email.status = OutboxEmail.Status.DEAD
+            else:
+                email.status = OutboxEmail.Status.PENDING
+                email.next_attempt_at = now + backoff(email.attempts)
+            failed.append(email)
+
+    with transaction.atomic():
+        claims = OutboxEmail.objects.select_for_update().filter(id__in=tokens).values_list('id', 'claim_token')
+        owned = {email_id for email_id, token in claims if token and token == tokens[email_id]}
+        sent = [email for email in sent if email.id in owned]
+        failed = [email for email in failed if email.id in owned]
+        OutboxEmail.objects.bulk_update(sent, ['status', 'attempts', 'claim_token', 'sent_at', 'last_error'])
+        OutboxEmail.objects.bulk_update(failed, ['status', 'attempts', 'claim_token', 'next_attempt_at', 'last_error'])
+    return len(sent), len(failed)
@@ -0,0 +1,32 @@
+'''
+Helpers shared by the database-backed work queues (the email outbox and the
+image derivative jobs). Rows carry status, next_attempt_at and claim_token.
+'''
+import random
+import uuid
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+
+def claim_rows(model, size, pending, working, lease):
+    '''
+    Marks up to `size` due rows as `working` under a fresh claim token and
+    returns them. The conditional UPDATE makes concurrent workers skip rows
+    another worker claimed first; a claimed row whose worker died is handed
+    out again once `lease` has passed.
+    '''
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    due = Q(status=pending, next_attempt_at__lte=now) | Q(status=working, next_attempt_at__lte=now - lease)
+    with transaction.atomic():
+        ids = list(model.objects.filter(due).order_by('next_attempt_at', 'id').values_list('id', flat=True)[:size])
+        model.objects.filter(due, id__in=ids).update(status=working, claim_token=token, next_attempt_at=now)
+    return list(model.objects.filter(claim_token=token, status=working))
+
+
+def backoff(attempts, base, maximum):
+    delay = min(base * (2 ** (attempts - 1)), maximum)
+    # jitter keeps retries of a failed batch from arriving together
+    return delay * random.uniform(0.8, 1.2)
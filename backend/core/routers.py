@@ -0,0 +1,149 @@
+'''
+Read replicas.
+
+ReplicaRouter sends reads of api models to one of settings.DATABASE_REPLICAS
+during safe requests to settings.REPLICA_READ_ROUTES (tracked by
+ReplicaRoutingMiddleware). Writes, accounts and everything outside a request
+(workers, management commands) use the primary, so a replica that is behind
+can only make catalog pages a little stale.
+
+A request that writes pins its client to the primary for
+settings.REPLICA_PIN_SECONDS so users read their own writes while the
+replicas catch up. Only statements that change rows count as writes
+(record_writes), not reads that merely go to the primary, such as
+get_or_create() finding its row. The pin travels in a cookie and, for
+authenticated users, in the cache, for API clients that drop cookies.
+
+For a pin's length after a write (note_write()), replicas may not have the
+write yet, so cached responses built from replica reads in that window only
+live as long as a pin (see api.cache).
+'''
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import SimpleLazyObject
+
+current = ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    __slots__ = ('request', 'use_replica', 'replica', 'read_replica', 'wrote', 'pinned_until', 'user_checked')
+
+    def __init__(self, request):
+        self.request = request
+        self.use_replica = None
+        self.replica = None
+        self.read_replica = False
+        self.wrote = False
+        self.user_checked = False
+        try:
+            self.pinned_until = float(request.COOKIES.get(settings.REPLICA_PIN_COOKIE, 0))
+        except ValueError:
+            self.pinned_until = 0.0
+
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+LAG_KEY = 'replica-lag-until'
+
+
+def record_writes(execute, sql, params, many, context):
+    '''Execute wrapper on the primary marking the request as one that wrote'''
+    state = current.get()
+    if state is not None and not state.wrote and sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+        state.wrote = True
+    return execute(sql, params, many, context)
+
+
+def install_write_recorder(sender, connection, **kwargs):
+    if connection.alias == DEFAULT_DB_ALIAS and record_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_writes)
+
+
+def pin_key(user_id):
+    return f'primary-pin:{user_id}'
+
+
+def request_user(request):
+    '''The authenticated user, once something (DRF) has resolved it, else None'''
+    user = request.__dict__.get('user')
+    # evaluating Django's lazy user would run a query from inside the router
+    if user is None or isinstance(user, SimpleLazyObject) or not user.is_authenticated:
+        return None
+    return user
+
+
+def use_replica(state):
+    '''Whether the request may read from a replica, known once its URL has been resolved'''
+    if state.use_replica is None:
+        match = getattr(state.request, 'resolver_match', None)
+        if match is None:
+            return False
+        state.use_replica = state.request.method in ('GET', 'HEAD', 'OPTIONS') and match.url_name in settings.REPLICA_READ_ROUTES
+    return state.use_replica
+
+
+def pinned(state=None):
+    '''Whether the current request must read from the primary'''
+    state = state or current.get()
+    if state is None or not settings.DATABASE_REPLICAS:
+        return False
+    if not state.user_checked:
+        user = request_user(state.request)
+        if user is not None:
+            state.user_checked = True
+            state.pinned_until = max(state.pinned_until, cache.get(pin_key(user.pk), 0))
+    return state.pinned_until > time.time()
+
+
+def pin(state, response):
+    '''Keeps the client that made this request on the primary for a while'''
+    seconds = settings.REPLICA_PIN_SECONDS
+    until = time.time() + seconds
+    response.set_cookie(settings.REPLICA_PIN_COOKIE, f'{until:.3f}', max_age=seconds, httponly=True, samesite='Lax')
+    user = request_user(state.request)
+    if user is not None:
+        cache.set(pin_key(user.pk), until, seconds)
+
+
+def note_write():
+    '''Replicas may lag behind a write that changed cached data for a pin's length'''
+    if settings.DATABASE_REPLICAS:
+        seconds = settings.REPLICA_PIN_SECONDS
+        cache.set(LAG_KEY, time.time() + seconds, seconds)
+
+
+def cache_timeout(timeout):
+    '''Cache timeout for a response, short when it was built from replica reads that may lag'''
+    state = current.get()
+    if state is not None and state.read_replica and cache.get(LAG_KEY, 0) > time.time():
+        return min(timeout, settings.REPLICA_PIN_SECONDS)
+    return timeout
+
+
+class ReplicaRouter:
+    replica_apps = {'api'}
+
+    def db_for_read(self, model, **hints):
+        state = current.get()
+        if state is None or not settings.DATABASE_REPLICAS or not use_replica(state):
+            return None
+        # explicit, the default would follow an instance read from a replica
+        if model._meta.app_label not in self.replica_apps or pinned(state):
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = random.choice(settings.DATABASE_REPLICAS)
+        state.read_replica = True
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
@@ -1,3 +1,336 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from PIL import Image
+
+from rest_framework.test import APIClient
+
+from api.cache import CATALOG_VERSION, bump_versions
+from api.models import Cart, Category, Course
+from usersauth.models import User
+from core.models import ImageJob, OutboxEmail
+from core import routers
+from core.metrics import BUCKETS, REGISTRY
+from core import outbox
+from core.outbox import enqueue_email
+from core.writer import Writer, run as run_write
+
+
+class FailingEmailBackend(BaseEmailBackend):
+
+    def send_messages(self, email_messages):
+        raise ConnectionError('provider unavailable')
+
+
+class OutboxTest(TestCase):
+
+    def drain(self, *args):
+        call_command('send_outbox', '--once', '--threads', '3', *args, stdout=StringIO())
+
+    def test_password_reset_queues_instead_of_sending(self):
+        User.objects.create_user(email='learner@example.com', username='learner', full_name='learner', password='pass12345')
+        response = self.client.get('/api/v1/user/password-reset/learner@example.com/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.drain()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['learner@example.com'])
+        self.assertEqual(len(mail.outbox[0].alternatives), 1)
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.Status.SENT)
+
+    def test_worker_drains_batches_concurrently(self):
+        for index in range(25):
+            enqueue_email(f'Hello {index}', [f'user{index}@example.com'], 'Body')
+        self.drain('--batch-size', '10')
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.Status.SENT).exists())
+
+    @override_settings(EMAIL_BACKEND='core.tests.FailingEmailBackend')
+    def test_failures_back_off_then_dead_letter(self):
+        email = enqueue_email('Hello', ['user@example.com'], 'Body')
+        self.drain('--max-attempts', '2')
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.Status.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('provider unavailable', email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.drain('--max-attempts', '2')
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.Status.DEAD)
+        self.assertEqual(email.attempts, 2)
+
+    def test_late_worker_leaves_reclaimed_rows_alone(self):
+        email = enqueue_email('Hello', ['user@example.com'], 'Body')
+        stale, = outbox.claim_batch(1)
+        OutboxEmail.objects.update(next_attempt_at=timezone.now() - outbox.CLAIM_LEASE)
+        current, = outbox.claim_batch(1)
+
+        self.assertEqual(outbox.record_results([stale], {email.id: 'timed out'}, 5), (0, 0))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.claim_token, email.attempts), (OutboxEmail.Status.SENDING, current.claim_token, 0))
+
+        self.assertEqual(outbox.record_results([current], {email.id: None}, 5), (1, 0))
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.Status.SENT)
+
+
+def image_upload(name, size, mode='RGB'):
+    buffer = BytesIO()
+    Image.new(mode, size, (200, 40, 40, 128) if mode == 'RGBA' else (200, 40, 40)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ImageVariantsTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=Path(media_root))
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def render(self):
+        call_command('process_images', '--once', '--threads', '2', stdout=StringIO())
+
+    def test_upload_queues_job_and_worker_renders_variants(self):
+        category = Category.objects.create(title='Design', image=image_upload('design.png', (400, 200)))
+        self.assertEqual(ImageJob.objects.get().status, ImageJob.Status.PENDING)
+        self.assertEqual(category.image_variants, {})
+
+        self.render()
+        category.refresh_from_db()
+        self.assertEqual(ImageJob.objects.get().status, ImageJob.Status.DONE)
+        self.assertEqual(category.image_variants['source'], category.image.name)
+        self.assertEqual(set(category.image_variants['variants']), {'webp', 'jpeg'})
+        webp = category.image_variants['variants']['webp']
+        self.assertEqual(set(webp), {'96', '192'})
+        with default_storage.open(webp['96']) as handle:
+            image = Image.open(handle)
+            self.assertEqual((image.format, image.size), ('WEBP', (96, 48)))
+
+        # saving again with the same image queues nothing new
+        category.title = 'Graphic design'
+        category.save()
+        self.assertEqual(ImageJob.objects.count(), 1)
+
+        response = self.client.get('/api/v1/course/category/')
+        self.assertEqual(response.status_code, 200)
+        srcset = response.json()['results'][0]['image_variants']['webp']
+        self.assertIn('/media/derived/', srcset)
+        self.assertTrue(srcset.endswith(' 192w'))
+
+    def test_small_transparent_images_are_not_upscaled(self):
+        category = Category.objects.create(title='Icons', image=image_upload('icon.png', (50, 50), 'RGBA'))
+        self.render()
+        category.refresh_from_db()
+        variants = category.image_variants['variants']
+        self.assertEqual(set(variants), {'webp', 'png'})
+        self.assertEqual(list(variants['png']), ['50'])
+
+    def test_derivatives_are_served_with_immutable_cache_headers(self):
+        category = Category.objects.create(title='Design', image=image_upload('design.png', (400, 200)))
+        self.render()
+        category.refresh_from_db()
+        name = category.image_variants['variants']['webp']['192']
+        response = self.client.get('/media/' + name)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_unreadable_image_backs_off(self):
+        Category.objects.create(title='Broken', image=SimpleUploadedFile('broken.png', b'not an image'))
+        self.render()
+        job = ImageJob.objects.get()
+        self.assertEqual(job.status, ImageJob.Status.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('UnidentifiedImageError', job.last_error)
+
+
+@override_settings(SERVER_TIMING=True, METRICS_TOKEN='scrape-secret')
+class RequestMetricsTest(TestCase):
+
+    def setUp(self):
+        REGISTRY.reset()
+        Category.objects.create(title='Design')
+
+    def test_server_timing_breaks_the_request_down(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/course/category/')
+        timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(timing), {'db', 'serialize', 'render', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timing['db'])
+
+    async def test_asgi_requests_are_recorded(self):
+        response = await self.async_client.get('/api/v1/course/category/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        row = REGISTRY.routes['category-list', 'GET']
+        # the view ran in a worker thread and its queries still counted
+        self.assertEqual(row[len(BUCKETS)], 1)
+        self.assertGreater(row[len(BUCKETS) + 2], 0)
+
+    def test_routes_are_labelled_by_url_name(self):
+        for lecture_id in ('lecture-a1', 'lecture-b2', 'lecture-c3'):
+            self.client.get(f'/api/v1/course/lecture/{lecture_id}/media/')
+        self.client.get('/api/v1/course/category/')
+        self.client.get('/no-such-page/')
+
+        body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret').content.decode()
+        self.assertIn('lms_http_request_duration_seconds_count{route="lecture-media",method="GET"} 3', body)
+        self.assertIn('lms_http_responses_total{route="lecture-media",method="GET",status="404"} 3', body)
+        self.assertIn('lms_http_request_duration_seconds_bucket{route="category-list",method="GET",le="+Inf"} 1', body)
+        self.assertIn('route="unmatched"', body)
+        self.assertNotIn('lecture-a1', body)
+        self.assertIn('lms_metrics_overhead_seconds_total', body)
+
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_without_a_token_only_while_debugging(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTest(TestCase):
+    '''A second SQLite file stands in for a replica that has not caught up with the primary yet'''
+
+    @classmethod
+    def setUpClass(cls):
+        # registered before TestCase sets up, the runner only knows the aliases in settings
+        cls.directory = tempfile.mkdtemp()
+        replica = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(Path(cls.directory) / 'replica.sqlite3')}
+        connections.settings['replica1'] = connections.configure_settings({'default': replica})['default']
+        call_command('migrate', database='replica1', verbosity=0)
+        cls.databases = {'default', 'replica1'}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica1'].close()
+        del connections['replica1']
+        del connections.settings['replica1']
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        Category.objects.create(title='Design')
+        self.course = Course.objects.create(title='Typography', price=10)
+        self.user = User.objects.create_user(email='writer@example.com', username='writer', password='pass12345')
+
+    def titles(self, client):
+        return [row['title'] for row in client.get('/api/v1/course/category/').json()['results']]
+
+    def test_catalog_reads_come_from_the_replica(self):
+        self.assertEqual(self.titles(APIClient()), [])
+        # only catalog routes during a request use the replica
+        self.assertEqual(Category.objects.count(), 1)
+
+    def test_writers_read_their_own_writes(self):
+        writer = APIClient()
+        writer.force_authenticate(self.user)
+        response = writer.post('/api/v1/cart/add/', {'course_id': self.course.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+        self.assertEqual(self.titles(writer), ['Design'])
+
+        # the same user without the cookie is pinned through the cache
+        elsewhere = APIClient()
+        elsewhere.force_authenticate(self.user)
+        self.assertEqual(self.titles(elsewhere), ['Design'])
+
+        cache.clear()
+        self.assertEqual(self.titles(APIClient()), [])
+
+        later = time.time() + settings.REPLICA_PIN_SECONDS + 1
+        with mock.patch('core.routers.time.time', return_value=later):
+            cache.clear()
+            self.assertEqual(self.titles(writer), [])
+
+    def test_reads_do_not_pin(self):
+        response = APIClient().get('/api/v1/course/category/')
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_reading_the_cart_does_not_pin(self):
+        Cart.objects.create(user=self.user)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for url in ('/api/v1/cart/list/', '/api/v1/cart/pricing/'):
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_replica_pages_are_cached_briefly_after_writes(self):
+        # long after the writes in setUp
+        cache.delete(routers.LAG_KEY)
+        with mock.patch('api.cache.cache.set') as cache_set:
+            APIClient().get('/api/v1/course/category/')
+        self.assertEqual(cache_set.call_args.args[2], 60 * 60)
+
+        bump_versions(CATALOG_VERSION)
+        with mock.patch('api.cache.cache.set') as cache_set:
+            APIClient().get('/api/v1/course/category/')
+        self.assertEqual(cache_set.call_args.args[2], settings.REPLICA_PIN_SECONDS)
+
+
+class WriterTest(TransactionTestCase):
+    '''A TransactionTestCase, the writes commit on the writer thread'''
+
+    def test_queued_writes_share_a_commit(self):
+        writer = Writer(batch_size=10)
+        started, release = threading.Event(), threading.Event()
+
+        def first():
+            started.set()
+            release.wait(5)
+            return Category.objects.create(title='First').title
+
+        # holds the writer thread while the other writes queue up
+        first = writer.submit(first)
+        started.wait(5)
+        futures = [writer.submit(Category.objects.create, title=f'Queued {number}') for number in range(5)]
+        failing = writer.submit(Category.objects.create, title=None)
+        release.set()
+
+        self.assertEqual(first.result(5), 'First')
+        self.assertEqual(sorted(future.result(5).title for future in futures), [f'Queued {number}' for number in range(5)])
+        # a failing write fails its caller only
+        with self.assertRaises(Exception):
+            failing.result(5)
+        self.assertEqual(Category.objects.count(), 6)
+        self.assertEqual((writer.batches, writer.writes), (2, 7))
+
+    @override_settings(SQLITE_WRITE_QUEUE=True)
+    def test_run(self):
+        category = run_write(Category.objects.create, title='Design')
+        self.assertTrue(Category.objects.filter(pk=category.pk).exists())
+
+        # inside a transaction the write belongs to it
+        with mock.patch('core.writer.writer') as writer, transaction.atomic():
+            run_write(Category.objects.create, title='Inline')
+        writer.assert_not_called()
+        self.assertTrue(Category.objects.filter(title='Inline').exists())
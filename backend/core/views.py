@@ -1,3 +1,32 @@
-from django.shortcuts import render
+import hmac
 
-# Create your views here.
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.views.static import serve
+
+from core.metrics import REGISTRY
+
+
+def derived_image(request, path):
+    '''
+    Serves image derivatives when Django serves media (in production the web
+    server should send the same header). Their names are content hashes, so
+    they can be cached forever.
+    '''
+    response = serve(request, path, document_root=settings.MEDIA_ROOT / settings.DERIVED_IMAGE_DIR)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+def metrics(request):
+    '''
+    Prometheus scrape endpoint; needs `Authorization: Bearer <METRICS_TOKEN>`.
+    Without a token it is only served while DEBUG is on.
+    '''
+    if not settings.METRICS_TOKEN and not settings.DEBUG:
+        raise Http404()
+    if settings.METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(supplied.encode(), settings.METRICS_TOKEN.encode()):
+            return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,98 @@
+'''
+Single-writer queue for SQLite.
+
+SQLite takes one writer at a time. Concurrent writers wait for the lock, up
+to busy_timeout, and then fail with "database is locked". Each of them also
+pays for its own commit. With settings.SQLITE_WRITE_QUEUE on, run() gives
+small writes to one writer thread per process. That thread commits
+everything that queued up while it was busy in one transaction, at most
+SQLITE_WRITE_BATCH writes, so a burst of writers shares one lock and one
+commit. Each write runs in its own savepoint, so a failing write fails only
+its caller.
+
+run() blocks until the batch has committed, so a response that follows it
+still means the write is durable. Writes inside an open transaction run
+inline: they have to be part of their caller's transaction.
+'''
+import contextvars
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class Writer:
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        # committed batches and the writes in them
+        self.batches = 0
+        self.writes = 0
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.loop, name='sqlite-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        # the write reports to the caller's request state (metrics, replica pins)
+        self.queue.put((future, contextvars.copy_context(), fn, args, kwargs))
+        return future
+
+    def loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.commit(batch)
+
+    def commit(self, batch):
+        # expire the connection like a request would, CONN_MAX_AGE and health checks apply
+        close_old_connections()
+        outcomes = []
+        try:
+            with transaction.atomic():
+                for future, context, fn, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction.atomic():
+                            outcomes.append((future, context.run(fn, *args, **kwargs), None))
+                    except Exception as exc:
+                        outcomes.append((future, None, exc))
+        except Exception as exc:
+            # the commit failed, nothing in the batch was written
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        self.batches += 1
+        self.writes += len(outcomes)
+        for future, result, exc in outcomes:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+
+def writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = Writer(settings.SQLITE_WRITE_BATCH)
+        return _writer
+
+
+def run(fn, *args, **kwargs):
+    '''Calls fn(*args, **kwargs) on the writer thread when the queue is on and returns its result'''
+    if not settings.SQLITE_WRITE_QUEUE or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return fn(*args, **kwargs)
+    return writer().submit(fn, *args, **kwargs).result()
@@ -0,0 +1,33 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from usersauth.cache import get_user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    '''
+    simplejwt's JWTAuthentication with the per-request User SELECT replaced by
+    usersauth.cache.get_user(). The active and revoked-token checks are the
+    same as upstream, the latter against the cached password fingerprint.
+    '''
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = get_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != user.password_fingerprint:
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
@@ -0,0 +1,117 @@
+'''
+User lookups for token authentication.
+
+get_user() answers from a small per-process LRU first, then from the shared
+cache, and only then from the database. Saving or deleting a user drops both
+entries in the process that made the change, before and after it commits; other processes keep their
+local copy for at most LOCAL_TTL seconds, so a deactivated user's access
+tokens stop working within that window everywhere.
+
+Neither cache holds secrets: the password hash, otp and refresh_token are
+left out and load from the database if a request reads them. Instead of the
+hash, entries keep the fingerprint that simplejwt's revoked-token check
+compares, as the password_fingerprint attribute of the users it returns.
+'''
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+LOCAL_SIZE = 1024
+LOCAL_TTL = 30
+SHARED_TTL = 15 * 60
+# fields never cached, deferred on the users get_user() returns
+SECRET_FIELDS = ('password', 'otp', 'refresh_token')
+
+
+class LRUCache:
+    '''A thread-safe, size-bounded mapping whose entries expire after `ttl` seconds'''
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_users = LRUCache(LOCAL_SIZE, LOCAL_TTL)
+
+
+def user_key(user_id):
+    return f'auth-user-fields:{user_id}'
+
+
+def user_entry(user):
+    '''(field names, values, password fingerprint) of a user, without its secrets'''
+    fields = [field.attname for field in user._meta.concrete_fields if field.attname not in SECRET_FIELDS]
+    return tuple(fields), tuple(getattr(user, name) for name in fields), get_md5_hash_password(user.password)
+
+
+def get_user(user_id):
+    '''
+    Returns the user with this id, or None. Every caller gets its own instance
+    so a request setting attributes on request.user cannot leak into another.
+    '''
+    key = user_key(user_id)
+    entry = local_users.get(key)
+    if entry is None:
+        entry = cache.get(key)
+        if entry is None:
+            user = get_user_model().objects.filter(pk=user_id).first()
+            if user is None:
+                return None
+            entry = user_entry(user)
+            cache.set(key, entry, SHARED_TTL)
+        local_users.set(key, entry)
+    fields, values, fingerprint = entry
+    user = get_user_model().from_db(DEFAULT_DB_ALIAS, fields, values)
+    user.password_fingerprint = fingerprint
+    return user
+
+
+def _evict(key):
+    local_users.delete(key)
+    cache.delete(key)
+
+
+def forget_user(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    '''
+    Drops the user's entries now and again once the write commits: a request
+    reading the user before the commit would otherwise re-cache the old row,
+    e.g. a deactivated account as still active, for SHARED_TTL.
+    '''
+    key = user_key(instance.pk)
+    _evict(key)
+    if transaction.get_connection(using).in_atomic_block:
+        transaction.on_commit(lambda: _evict(key), using=using)
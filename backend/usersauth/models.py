@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
+
+from usersauth.cache import forget_user
 
 
 class User(AbstractUser):
@@ -78,6 +80,7 @@ class Profile(models.Model):
     
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     image = models.FileField(upload_to='user_folder', default='default-user.jpg', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     full_name = models.CharField(max_length=100)
     country = models.CharField(max_length=100, null=True, blank=True)
     about = models.TextField(null=True, blank=True)
@@ -104,4 +107,6 @@ def save_user_profile(sender, instance, **kwargs):
 
 
 post_save.connect(create_user_profile, sender=User)
-post_save.connect(save_user_profile, sender=User)
\ No newline at end of file
+post_save.connect(save_user_profile, sender=User)
+post_save.connect(forget_user, sender=User)
+post_delete.connect(forget_user, sender=User)
\ No newline at end of file
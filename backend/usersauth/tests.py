@@ -1,3 +1,69 @@
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from usersauth.cache import get_user, local_users, user_key
+from usersauth.models import User
+
+
+class CachedJWTAuthenticationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        local_users.clear()
+        self.user = User.objects.create_user(email='learner@example.com', username='learner', full_name='learner', password='pass12345')
+        response = APIClient().post('/api/v1/user/token', {'email': 'learner@example.com', 'password': 'pass12345'})
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+
+    def user_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/student/progress/')
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries if 'FROM "usersauth_user"' in query['sql']]
+
+    def test_user_is_loaded_once(self):
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(self.user_queries(), [])
+
+        # another process: local cache empty, shared cache warm
+        local_users.clear()
+        self.assertEqual(self.user_queries(), [])
+
+    def test_saving_the_user_invalidates(self):
+        self.user_queries()
+        self.user.full_name = 'renamed'
+        self.user.save()
+        self.assertEqual(len(self.user_queries()), 1)
+
+    def test_deactivated_user_is_rejected(self):
+        self.user_queries()
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/api/v1/student/progress/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_entries_cached_before_commit_are_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+            # a concurrent request still seeing the committed, active row
+            cache.set(user_key(self.user.pk), 'stale', 60)
+        self.assertIsNone(cache.get(user_key(self.user.pk)))
+
+    def test_secrets_are_not_cached(self):
+        self.user.otp = '123456'
+        self.user.refresh_token = 'refresh-secret'
+        self.user.save()
+        self.user_queries()
+        entry = repr(cache.get(user_key(self.user.pk)))
+        for secret in (self.user.password, '123456', 'refresh-secret'):
+            self.assertNotIn(secret, entry)
+
+        # read from the database when a view needs them
+        user = get_user(self.user.pk)
+        self.assertEqual(user.email, 'learner@example.com')
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password('pass12345'))